@@ -0,0 +1,459 @@
+"""
+Local HTTP API for detection and question answering, for systems that can't use the Streamlit UI.
+
+    python api_server.py --port 8765 --workers 2            # OCI backend from secrets/env
+    python api_server.py --fake-llm                          # local stub model, no credentials
+
+Endpoints (JSON unless noted):
+    GET  /health
+    GET  /metrics                          LLM call summary
+    GET  /datasets                         registered datasets
+    POST /datasets?name=book.xlsx          body: workbook bytes (upload); &source=input_data/book.xlsx records
+                                           history under that book, so a corrected extract replaces it
+    POST /datasets                         body: {"path": "input_data/ClientFTPData.xlsx"} (register a local file)
+    POST /datasets/<id>/detect?wait=1      start detection on the worker pool; cached per contents + rule set
+    GET  /datasets/<id>/detect             detection status and per-policy counts
+    GET  /datasets/<id>/violations         NDJSON stream; ?offset=0&limit=1000&policy=<description>
+    POST /datasets/<id>/ask                {"question": "...", "mode": "compact|map_reduce|local_query",
+                                            "stream": false, "max_violations": null, "token_budget": null}
+    GET  /history/trend                    with --store: counts per as-of date; ?policy=TRANSFER_RATE&segment=currency
+    GET  /history/accounts                 with --store: first seen / resolved; ?account=...&policy=...
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from functions.data_loader import load_client_data, file_fingerprint
+from functions.ftp_rules import load_rules, detect_policy_violations, rules_version
+from functions.result_store import record_run, policy_trend, account_history, source_key
+
+# === CONFIG ===
+UPLOAD_DIR = os.path.join("output", "api_uploads")
+DATA_ROOTS = ("input_data", UPLOAD_DIR)   # registered paths must live under one of these
+MAX_UPLOAD_BYTES = 200 * 2**20
+PAGE_ROWS = 500                           # violations serialised per streamed chunk
+CACHED_RESULTS = 16                       # (contents, rules) detection results kept in memory
+CACHED_BOOKS = 4                          # loaded workbooks kept for local_query answers
+DETECT_WAIT_S = 300.0                     # how long /ask and ?wait=1 wait for a running detection
+ASK_MODES = ("compact", "map_reduce", "local_query")
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _detect_file(path: str, rules: list, store: str = None, source: str = None):
+    """Runs in a worker process; the violations frame is pickled back to the server."""
+    df = load_client_data(path)
+    violations_df = detect_policy_violations(df, rules)
+    if store:
+        record_run(store, violations_df, df, file_fingerprint(path), rules_version(rules),
+                   source=source or source_key(path))
+    return violations_df
+
+
+class ApiState:
+    """Datasets, detection jobs and cached results shared by all request threads."""
+
+    def __init__(self, workers: int = None, store: str = None):
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.store = store            # SQLite result store every detection run is appended to
+        self.lock = threading.Lock()
+        self.datasets = {}            # dataset id -> metadata
+        self.jobs = {}                # (sha256, rules_version) -> Future
+        self.results = OrderedDict()  # (sha256, rules_version) -> violations DataFrame
+        self.books = OrderedDict()    # sha256 -> book DataFrame
+
+    # --- datasets ---
+    def register(self, path: str, name: str = None, source: str = None) -> dict:
+        """source: the book the file is a version of, for the result store (default: the file itself)."""
+        sha = file_fingerprint(path)
+        dataset_id = sha[:16]
+        with self.lock:
+            if dataset_id not in self.datasets:
+                self.datasets[dataset_id] = {
+                    "id": dataset_id,
+                    "name": name or os.path.basename(path),
+                    "path": path,
+                    "source": source_key(source or path),
+                    "sha256": sha,
+                    "registered_at": datetime.now(timezone.utc).isoformat(),
+                }
+            return dict(self.datasets[dataset_id])
+
+    def dataset(self, dataset_id: str) -> dict:
+        with self.lock:
+            if dataset_id not in self.datasets:
+                raise ApiError(404, f"Unknown dataset '{dataset_id}'.")
+            return dict(self.datasets[dataset_id])
+
+    # --- detection ---
+    def start_detection(self, ds: dict):
+        """Returns (key, future) for the current rule set; identical contents share one job and result."""
+        rules = load_rules()
+        key = (ds["sha256"], rules_version(rules))
+        with self.lock:
+            if key in self.results:
+                self.results.move_to_end(key)
+                return key, None
+            future = self.jobs.get(key)
+            if future is None:
+                future = self.pool.submit(_detect_file, ds["path"], rules, self.store, ds["source"])
+                future.add_done_callback(lambda f, key=key: self._store_result(key, f))
+                self.jobs[key] = future
+            return key, future
+
+    def _store_result(self, key, future):
+        with self.lock:
+            self.jobs.pop(key, None)
+            if future.exception() is None:
+                self.results[key] = future.result()
+                while len(self.results) > CACHED_RESULTS:
+                    self.results.popitem(last=False)
+
+    def detection_status(self, ds: dict, start: bool = True, wait_s: float = 0.0) -> dict:
+        key, future = self.start_detection(ds) if start else self._peek(ds)
+        if future is not None and wait_s:
+            try:
+                future.exception(timeout=wait_s)
+            except FutureTimeout:
+                pass
+        if future is not None and future.done() and future.exception() is not None:
+            e = future.exception()
+            return {"dataset": ds["id"], "rules_version": key[1], "status": "failed",
+                    "error": f"{type(e).__name__}: {e}"}
+        violations_df = self.cached_violations(key)
+        if violations_df is None:
+            status = "running" if future is not None else "not_started"
+            return {"dataset": ds["id"], "rules_version": key[1], "status": status}
+        from functions.analytics_router import policy_counts
+        return {
+            "dataset": ds["id"],
+            "rules_version": key[1],
+            "status": "done",
+            "violations": len(violations_df),
+            "per_policy": policy_counts(violations_df).to_dict(orient="records"),
+        }
+
+    def _peek(self, ds: dict):
+        key = (ds["sha256"], rules_version(load_rules()))
+        with self.lock:
+            return key, self.jobs.get(key)
+
+    def cached_violations(self, key):
+        with self.lock:
+            return self.results.get(key)
+
+    def violations(self, ds: dict, wait_s: float = DETECT_WAIT_S):
+        """Detection result for the dataset, starting or joining a job and waiting up to wait_s."""
+        key, future = self.start_detection(ds)
+        if future is not None:
+            try:
+                future.result(timeout=wait_s)
+            except FutureTimeout:
+                raise ApiError(409, "Detection still running; retry later.")
+            except Exception as e:
+                raise ApiError(500, f"Detection failed: {type(e).__name__}: {e}")
+        violations_df = self.cached_violations(key)
+        if violations_df is None:  # the done-callback may not have stored it yet
+            violations_df = future.result()
+        return violations_df
+
+    def book(self, ds: dict):
+        with self.lock:
+            if ds["sha256"] in self.books:
+                self.books.move_to_end(ds["sha256"])
+                return self.books[ds["sha256"]]
+        df = load_client_data(ds["path"])
+        with self.lock:
+            self.books[ds["sha256"]] = df
+            while len(self.books) > CACHED_BOOKS:
+                self.books.popitem(last=False)
+        return df
+
+
+def _allowed_path(path: str) -> bool:
+    real = os.path.realpath(path)
+    return any(real.startswith(os.path.realpath(root) + os.sep) for root in DATA_ROOTS)
+
+
+def _ndjson_lines(violations_df, offset: int, limit: int):
+    """Yields NDJSON blocks of PAGE_ROWS violations; row_context is already JSON so it is spliced in as-is."""
+    end = len(violations_df) if limit is None else min(offset + limit, len(violations_df))
+    descriptions = violations_df["description"].to_numpy()
+    contexts = violations_df["row_context"].to_numpy()
+    for start in range(offset, end, PAGE_ROWS):
+        stop = min(start + PAGE_ROWS, end)
+        yield "".join(
+            f'{{"row": {i}, "description": {json.dumps(descriptions[i])}, "row_context": {contexts[i]}}}\n'
+            for i in range(start, stop)
+        ).encode("utf-8")
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive and chunked responses
+    server_version = "FTPAnalyzerAPI/1.0"
+    state: ApiState = None
+
+    ROUTES = [
+        ("GET", re.compile(r"^/health$"), "health"),
+        ("GET", re.compile(r"^/metrics$"), "metrics"),
+        ("GET", re.compile(r"^/datasets$"), "list_datasets"),
+        ("POST", re.compile(r"^/datasets$"), "add_dataset"),
+        ("GET", re.compile(r"^/datasets/(\w+)/detect$"), "get_detection"),
+        ("POST", re.compile(r"^/datasets/(\w+)/detect$"), "run_detection"),
+        ("GET", re.compile(r"^/datasets/(\w+)/violations$"), "stream_violations"),
+        ("POST", re.compile(r"^/datasets/(\w+)/ask$"), "ask"),
+        ("GET", re.compile(r"^/history/trend$"), "history_trend"),
+        ("GET", re.compile(r"^/history/accounts$"), "history_accounts"),
+    ]
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method: str):
+        url = urlparse(self.path)
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self.streaming = False
+        try:
+            for route_method, pattern, handler in self.ROUTES:
+                match = pattern.match(url.path)
+                if match and route_method == method:
+                    return getattr(self, handler)(*match.groups())
+            raise ApiError(404, f"No route for {method} {url.path}.")
+        except Exception as e:
+            if self.streaming:
+                # Headers are already out; a second response would corrupt the stream
+                self.close_connection = True
+            elif isinstance(e, ApiError):
+                self._send_json({"error": str(e)}, e.status)
+            else:
+                self._send_json({"error": f"{type(e).__name__}: {e}"}, 500)
+
+    # --- helpers ---
+    def _body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_UPLOAD_BYTES:
+            raise ApiError(413, f"Body larger than {MAX_UPLOAD_BYTES} bytes.")
+        return self.rfile.read(length) if length else b""
+
+    def _json_body(self) -> dict:
+        try:
+            body = json.loads(self._body() or b"{}")
+        except json.JSONDecodeError as e:
+            raise ApiError(400, f"Invalid JSON body: {e}")
+        if not isinstance(body, dict):
+            raise ApiError(400, "JSON body must be an object.")
+        return body
+
+    @staticmethod
+    def _positive_int(body: dict, name: str):
+        value = body.get(name)
+        if value is None:
+            return None
+        if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+            raise ApiError(400, f"'{name}' must be a positive integer.")
+        return value
+
+    def _int_param(self, name: str, default=None, minimum: int = 0):
+        if name not in self.query:
+            return default
+        try:
+            value = int(self.query[name])
+        except ValueError:
+            raise ApiError(400, f"'{name}' must be an integer.")
+        if value < minimum:
+            raise ApiError(400, f"'{name}' must be >= {minimum}.")
+        return value
+
+    def _send_json(self, payload, status: int = 200):
+        data = json.dumps(payload, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, chunk: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        self.wfile.flush()
+
+    def _send_chunked(self, chunks, content_type: str):
+        """
+        Streams an iterable of bytes with chunked transfer encoding. An error raised while producing
+        the chunks ends the stream with a final NDJSON record {"error": ...} (on its own line).
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.streaming = True
+        try:
+            try:
+                for chunk in chunks:
+                    if chunk:
+                        self._write_chunk(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                raise
+            except Exception as e:
+                record = json.dumps({"error": f"{type(e).__name__}: {e}"}, default=str)
+                # NDJSON blocks already end in a newline; streamed text may stop mid-line
+                lead = "" if "ndjson" in content_type else "\n"
+                self._write_chunk(f"{lead}{record}\n".encode("utf-8"))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # client went away mid-stream
+
+    # --- routes ---
+    def health(self):
+        self._send_json({"status": "ok"})
+
+    def metrics(self):
+        from functions.llm_metrics import metrics_summary
+        self._send_json(metrics_summary())
+
+    def list_datasets(self):
+        with self.state.lock:
+            self._send_json(list(self.state.datasets.values()))
+
+    def add_dataset(self):
+        if (self.headers.get("Content-Type") or "").startswith("application/json"):
+            path = self._json_body().get("path")
+            if not path or not os.path.isfile(path):
+                raise ApiError(400, f"File not found: {path}")
+            if not _allowed_path(path):
+                raise ApiError(403, f"Only files under {', '.join(DATA_ROOTS)} can be registered.")
+            ds = self.state.register(path)
+        else:
+            data = self._body()
+            if not data:
+                raise ApiError(400, "Upload the workbook as the request body, or send {\"path\": ...} as JSON.")
+            os.makedirs(UPLOAD_DIR, exist_ok=True)
+            tmp = os.path.join(UPLOAD_DIR, f"upload-{threading.get_ident()}-{time.time_ns()}.tmp")
+            with open(tmp, "wb") as f:
+                f.write(data)
+            path = os.path.join(UPLOAD_DIR, f"{file_fingerprint(tmp)[:16]}.xlsx")
+            os.replace(tmp, path)  # same contents -> same file, uploaded once
+            ds = self.state.register(path, name=self.query.get("name"), source=self.query.get("source"))
+        self._send_json(ds, 201)
+
+    def get_detection(self, dataset_id):
+        ds = self.state.dataset(dataset_id)
+        self._send_json(self.state.detection_status(ds, start=False))
+
+    def run_detection(self, dataset_id):
+        ds = self.state.dataset(dataset_id)
+        wait_s = DETECT_WAIT_S if self.query.get("wait") in ("1", "true") else 0.0
+        status = self.state.detection_status(ds, wait_s=wait_s)
+        self._send_json(status, 200 if status["status"] == "done" else 202)
+
+    def stream_violations(self, dataset_id):
+        ds = self.state.dataset(dataset_id)
+        offset = self._int_param("offset", 0)
+        limit = self._int_param("limit", None, minimum=1)
+        violations_df = self.state.violations(ds)
+        if self.query.get("policy"):
+            violations_df = violations_df[violations_df["description"] == self.query["policy"]]
+        self._send_chunked(_ndjson_lines(violations_df, offset, limit), "application/x-ndjson")
+
+    def ask(self, dataset_id):
+        from functions.langchain_llm import query_llm
+
+        ds = self.state.dataset(dataset_id)
+        body = self._json_body()
+        question = str(body.get("question") or "").strip()
+        if not question:
+            raise ApiError(400, "'question' is required.")
+        mode = body.get("mode", "compact")
+        if mode not in ASK_MODES:
+            raise ApiError(400, f"'mode' must be one of {', '.join(ASK_MODES)}.")
+        stream = bool(body.get("stream"))
+        max_violations = self._positive_int(body, "max_violations")
+        token_budget = self._positive_int(body, "token_budget")
+        chunk_by = body.get("chunk_by", "policy")
+        if not isinstance(chunk_by, str):
+            raise ApiError(400, "'chunk_by' must be a column name.")
+        violations_df = self.state.violations(ds)
+        answer = query_llm(
+            violations_df, question,
+            max_violations=max_violations,
+            token_budget=token_budget,
+            stream=stream,
+            map_reduce=mode == "map_reduce",
+            chunk_by=chunk_by,
+            local_query=mode == "local_query",
+            book_df=self.state.book(ds) if mode == "local_query" else None,
+            auto_table=False,
+        )
+        if stream and not isinstance(answer, str):
+            self._send_chunked((chunk.encode("utf-8") for chunk in answer), "text/plain; charset=utf-8")
+        else:
+            self._send_json({"dataset": ds["id"], "question": question, "mode": mode, "answer": answer})
+
+    def _store(self) -> str:
+        if not self.state.store:
+            raise ApiError(404, "No result store configured; start the server with --store.")
+        return self.state.store
+
+    def history_trend(self):
+        try:
+            trend = policy_trend(self._store(), self.query.get("policy"), self.query.get("segment"))
+        except ValueError as e:
+            raise ApiError(400, str(e))
+        self._send_json(trend.to_dict(orient="records"))
+
+    def history_accounts(self):
+        history = account_history(self._store(), self.query.get("account"), self.query.get("policy"))
+        self._send_json(history.to_dict(orient="records"))
+
+    def log_message(self, format, *args):
+        sys.stderr.write(f"{self.address_string()} - {format % args}\n")
+
+
+def make_server(host: str = "127.0.0.1", port: int = 8765, workers: int = None,
+                store: str = None) -> ThreadingHTTPServer:
+    handler = type("BoundApiHandler", (ApiHandler,), {"state": ApiState(workers, store)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Serve FTP detection and question answering over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None, help="detection worker processes (default: CPU count)")
+    parser.add_argument("--fake-llm", action="store_true", help="answer with the local stub model")
+    parser.add_argument("--store", help="append detection runs to this SQLite result store")
+    args = parser.parse_args(argv)
+
+    if args.fake_llm:
+        os.environ["LLM_BACKEND"] = "fake"  # read when langchain_llm is first imported
+    server = make_server(args.host, args.port, args.workers, args.store)
+    print(f"Serving on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.RequestHandlerClass.state.pool.shutdown(cancel_futures=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""
+Headless batch detection for scheduled (e.g. nightly cron) runs.
+
+Runs load_client_data + detect_policy_violations over many workbooks in parallel and writes
+violations (and optionally deterministic summaries) next to a small manifest. Files whose
+contents and rule set are unchanged since the last run are skipped. With --store each run is
+also appended to the SQLite result store used for trend and first-seen/resolved queries.
+
+    python batch_detect.py input_data/*.xlsx --out output --format parquet --summaries --workers 4
+    python batch_detect.py input_data/*.xlsx --store output/results.db
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timezone
+
+import pandas as pd
+
+from functions.data_loader import load_client_data, file_fingerprint
+from functions.ftp_rules import load_rules, detect_policy_violations, reads_clock, rules_version
+from functions.analytics_router import build_violation_cube, policy_counts
+from functions.result_store import has_run, record_run, source_key
+
+FORMATS = ("parquet", "csv")
+
+
+def output_paths(input_path: str, out_dir: str, fmt: str) -> dict:
+    """Output files for an input; the stem carries a hash of the input's directory so same-named books don't collide."""
+    folder = hashlib.sha256(os.path.dirname(os.path.abspath(input_path)).encode("utf-8")).hexdigest()[:8]
+    stem = f"{os.path.splitext(os.path.basename(input_path))[0]}-{folder}"
+    return {
+        "violations": os.path.join(out_dir, f"{stem}.violations.{fmt}"),
+        "policy_summary": os.path.join(out_dir, f"{stem}.policy_summary.{fmt}"),
+        "segment_summary": os.path.join(out_dir, f"{stem}.segment_summary.{fmt}"),
+        "manifest": os.path.join(out_dir, f"{stem}.manifest.json"),
+    }
+
+
+def evaluation_date(rules: list):
+    """Today's date when any rule reads the clock (its results go stale overnight), else None."""
+    return date.today().isoformat() if any(reads_clock(r) for r in rules) else None
+
+
+def is_current(input_path: str, out_dir: str, fmt: str, rules_ver: str, summaries: bool, evaluated_on=None,
+               store: str = None) -> bool:
+    """
+    True when the manifest records the same input contents, rule set and, for clock-dependent
+    rules, evaluation date, the outputs still exist and, with a store, the store holds that run.
+    """
+    paths = output_paths(input_path, out_dir, fmt)
+    if not os.path.exists(paths["manifest"]):
+        return False
+    with open(paths["manifest"], "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    needed = ["violations"] + (["policy_summary", "segment_summary"] if summaries else [])
+    return (
+        manifest.get("input_sha256") == file_fingerprint(input_path)
+        and manifest.get("rules_version") == rules_ver
+        and manifest.get("evaluated_on") == evaluated_on
+        and manifest.get("format") == fmt
+        and (manifest.get("summaries") or not summaries)
+        and all(os.path.exists(paths[k]) for k in needed)
+        and (not store or has_run(store, manifest["input_sha256"], rules_ver))
+    )
+
+
+def _write(df: pd.DataFrame, path: str, fmt: str):
+    tmp = f"{path}.tmp"
+    if fmt == "parquet":
+        df.to_parquet(tmp, index=False)
+    else:
+        df.to_csv(tmp, index=False)
+    os.replace(tmp, path)  # readers never see half-written files
+
+
+def process_file(input_path: str, out_dir: str, fmt: str, rules: list, summaries: bool, store: str = None) -> dict:
+    """Detects violations for one workbook and writes its outputs; runs in a worker process."""
+    t0 = time.perf_counter()
+    paths = output_paths(input_path, out_dir, fmt)
+    # Fingerprinted before loading: a workbook replaced mid-run is picked up by the next run, not mislabelled
+    input_sha256 = file_fingerprint(input_path)
+    df = load_client_data(input_path)
+    violations_df = detect_policy_violations(df, rules)
+    _write(violations_df, paths["violations"], fmt)
+    if summaries:
+        _write(policy_counts(violations_df), paths["policy_summary"], fmt)
+        _write(build_violation_cube(violations_df), paths["segment_summary"], fmt)
+    if store:
+        record_run(store, violations_df, df, input_sha256, rules_version(rules), source=source_key(input_path))
+
+    manifest = {
+        "input": os.path.abspath(input_path),
+        "input_sha256": input_sha256,
+        "rules_version": rules_version(rules),
+        "evaluated_on": evaluation_date(rules),
+        "rows": len(df),
+        "violations": len(violations_df),
+        "summaries": summaries,
+        "format": fmt,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "elapsed_s": round(time.perf_counter() - t0, 3),
+    }
+    with open(paths["manifest"], "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def run_batch(inputs: list, out_dir: str, fmt: str = "parquet", summaries: bool = False,
+              workers: int = None, force: bool = False, rules: list = None, store: str = None) -> list:
+    """Processes inputs in parallel; returns one status dict per input (processed, skipped or failed)."""
+    os.makedirs(out_dir, exist_ok=True)
+    rules = load_rules() if rules is None else rules
+    rules_ver = rules_version(rules)
+    evaluated_on = evaluation_date(rules)
+
+    results, todo = [], []
+    for path in inputs:
+        if not force and is_current(path, out_dir, fmt, rules_ver, summaries, evaluated_on, store):
+            results.append({"input": path, "status": "skipped"})
+        else:
+            todo.append(path)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_file, p, out_dir, fmt, rules, summaries, store): p for p in todo}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                results.append({**future.result(), "input": path, "status": "processed"})
+            except Exception as e:
+                results.append({"input": path, "status": "failed", "error": f"{type(e).__name__}: {e}"})
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Detect FTP policy violations for many workbooks.")
+    parser.add_argument("inputs", nargs="+", help="workbook paths or glob patterns")
+    parser.add_argument("--out", default="output", help="output directory")
+    parser.add_argument("--format", choices=FORMATS, default="parquet")
+    parser.add_argument("--summaries", action="store_true", help="also write per-policy and per-segment summaries")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="reprocess files even if outputs are current")
+    parser.add_argument("--store", help="append runs to this SQLite result store")
+    args = parser.parse_args(argv)
+
+    inputs = sorted({p for pattern in args.inputs for p in (glob.glob(pattern) or [pattern])})
+    missing = [p for p in inputs if not os.path.isfile(p)]
+    if missing:
+        print(f"Input not found: {', '.join(missing)}", file=sys.stderr)
+        return 2
+
+    results = run_batch(inputs, args.out, args.format, args.summaries, args.workers, args.force, store=args.store)
+    for r in sorted(results, key=lambda r: r["input"]):
+        detail = f"{r['violations']} violations in {r['elapsed_s']}s" if r["status"] == "processed" else r.get("error", "")
+        print(f"{r['status']:<10} {r['input']} {detail}")
+    return 1 if any(r["status"] == "failed" for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+from functions.frame_cache import cached_per_frame
+from functions.ftp_rules import expand_row_context
+from functions.violation_index import build_violation_index, code_positions
+
+# === CONFIG ===
+ACCOUNT_KEY_COLUMNS = ["ACCOUNT_NUMBER_MASKED", "CUSTOMER_CODE_MASKED"]
+
+
+def _normalise(key) -> str:
+    """Keys are matched as trimmed upper-case strings, like the violation index's code columns."""
+    return str(key).strip().upper()
+
+
+@cached_per_frame
+def build_book_account_index(book_df: pd.DataFrame) -> dict:
+    """{key column: {account key: row positions}} over the book (no NaN or blank keys), built once per book frame."""
+    index = {}
+    for col in ACCOUNT_KEY_COLUMNS:
+        if col in book_df:
+            index[col] = code_positions(book_df[col])
+    return index
+
+
+def account_keys(book_df: pd.DataFrame, column: str = "ACCOUNT_NUMBER_MASKED") -> list:
+    """Distinct keys of one key column, sorted (for pickers)."""
+    return sorted(build_book_account_index(book_df).get(column, {}))
+
+
+def lookup_account(key, book_df: pd.DataFrame = None, violations_df: pd.DataFrame = None, column: str = None) -> dict:
+    """
+    All book rows and violations for an account or customer key, by hash lookup on the prebuilt indexes.
+    column restricts the match to one of ACCOUNT_KEY_COLUMNS; otherwise the first column holding the key wins.
+    Returns {"column", "key", "book", "violations"} (violations expanded into columns).
+    """
+    norm = _normalise(key)
+    columns = [column] if column else ACCOUNT_KEY_COLUMNS
+    empty = np.array([], dtype=np.intp)
+
+    book_index = build_book_account_index(book_df) if book_df is not None else {}
+    violation_codes = build_violation_index(violations_df)["codes"] if violations_df is not None and not violations_df.empty else {}
+    matched = next(
+        (c for c in columns if norm in book_index.get(c, {}) or norm in violation_codes.get(c, {})),
+        columns[0],
+    )
+    book_rows = None
+    if book_df is not None:
+        book_rows = book_df.iloc[book_index.get(matched, {}).get(norm, empty)]
+    violation_rows = pd.DataFrame(columns=["description"])
+    if violation_codes:
+        violation_rows = expand_row_context(violations_df).iloc[violation_codes.get(matched, {}).get(norm, empty)]
+    return {"column": matched, "key": norm, "book": book_rows, "violations": violation_rows}
@@ -0,0 +1,197 @@
+import re
+from collections import Counter
+import pandas as pd
+from functions.frame_cache import cached_per_frame
+from functions.ftp_rules import load_rules, expand_row_context
+from functions.prompt_builder import column_words
+
+# === CONFIG ===
+# Cube dimensions: friendly name -> violations column
+CUBE_DIMENSIONS = {
+    "policy": "description",
+    "currency": "ISO_CURRENCY_CD",
+    "product": "PRODUCT_CODE",
+    "branch": "BRANCH_CODE",
+    "org unit": "ORG_UNIT_CODE",
+}
+DIMENSION_PATS = {
+    "policy": re.compile(r"\b(polic(?:y|ies)|rules?)\b", re.IGNORECASE),
+    "currency": re.compile(r"\b(currenc(?:y|ies)|ccys?)\b", re.IGNORECASE),
+    "product": re.compile(r"\bproducts?\b", re.IGNORECASE),
+    "branch": re.compile(r"\bbranch(?:es)?\b", re.IGNORECASE),
+    "org unit": re.compile(r"\b(org(?:anis|aniz)?(?:ation)?[\s_-]?units?|business\s+units?)\b", re.IGNORECASE),
+}
+GROUP_HINT_PAT = re.compile(r"\b(per|by|each|every|across|breakdown)\b", re.IGNORECASE)
+TOP_N_PAT      = re.compile(r"\b(?:top|largest|worst)\s+(\d+)\b", re.IGNORECASE)
+TOP_PAT        = re.compile(r"\b(top|most|highest|largest|worst)\b", re.IGNORECASE)
+COUNT_PAT      = re.compile(r"\b(how\s+many|number\s+of|count)\b", re.IGNORECASE)
+DEFAULT_TOP_N = 5
+BOTH_PAT         = re.compile(r"\b(both|all\s+of)\b", re.IGNORECASE)
+EITHER_PAT       = re.compile(r"\b(either|or|any\s+of)\b", re.IGNORECASE)
+ANY_VIOLATION_PAT = re.compile(r"\bany\s+(violations?|polic(?:y|ies)|rules?)\b", re.IGNORECASE)
+ACCOUNT_PAT      = re.compile(r"\b(accounts?|customers?)\b", re.IGNORECASE)
+ACCOUNT_COLUMNS = ["ACCOUNT_NUMBER_MASKED", "CUSTOMER_CODE_MASKED"]
+# Values that are also everyday words in questions; only used as filters when their dimension is named
+_AMBIGUOUS_VALUES = {"FTP", "HO"}
+# Column words too common in questions to name a rule on their own ("the last 5 accounts")
+_EVERYDAY_WORDS = {"last", "next", "current", "net", "total", "average", "avg"}
+
+
+def named_rules(rules: list, question: str) -> list:
+    """
+    Indices of the rules a question names by their column: every word of the column appears, or a
+    word no other rule's column has (so "reprice" names LAST_REPRICE_DATE).
+
+    >>> rules = [{"column": c} for c in ("TRANSFER_RATE", "MATURITY_DATE", "LAST_REPRICE_DATE", "NET_TP_RATE")]
+    >>> named_rules(rules, "accounts violating both the maturity and reprice rules")
+    [1, 2]
+    """
+    q_words = set(re.split(r"[^a-z0-9]+", question.lower()))
+    words = [column_words(r["column"]) if r.get("column") else set() for r in rules]
+    owners = Counter(w for ws in words for w in ws)
+    return [
+        i for i, ws in enumerate(words)
+        if ws and (ws <= q_words or any(owners[w] == 1 and w not in _EVERYDAY_WORDS and w in q_words for w in ws))
+    ]
+
+
+@cached_per_frame
+def build_violation_cube(violations_df: pd.DataFrame) -> pd.DataFrame:
+    """Violation counts by policy × currency × product × branch × org unit, built once per violations frame."""
+    expanded = expand_row_context(violations_df)
+    dims = [c for c in CUBE_DIMENSIONS.values() if c in expanded]
+    keys = expanded[dims].astype(str) if len(expanded) else expanded.reindex(columns=dims)
+    return keys.groupby(dims, dropna=False, sort=False).size().reset_index(name="Count")
+
+
+def policy_counts(violations_df: pd.DataFrame) -> pd.DataFrame:
+    """Per-policy counts (Policy, Count) read from the cube, sorted descending."""
+    cube = build_violation_cube(violations_df)
+    return (
+        cube.groupby("description")["Count"].sum()
+        .rename_axis("Policy").reset_index(name="Count")
+        .sort_values(by="Count", ascending=False, ignore_index=True)
+    )
+
+
+def _detect_filters(cube: pd.DataFrame, question: str, named_dims: list) -> dict:
+    """Finds cube values named in the question, e.g. 'AED' -> {'ISO_CURRENCY_CD': ['AED']}."""
+    exact = set(re.findall(r"[A-Za-z0-9_]+", question))
+    folded = {t.upper() for t in exact}
+    filters = {}
+    for name, col in CUBE_DIMENSIONS.items():
+        if col == "description" or col not in cube:
+            continue
+        # Codes must be written as codes ("AED", not "aed") unless their dimension is named
+        hits = [v for v in cube[col].unique() if v in exact or (name in named_dims and v.upper() in folded)]
+        hits = [v for v in hits if v.upper() not in _AMBIGUOUS_VALUES or name in named_dims]
+        if hits:
+            filters[col] = hits
+    # Policies are named by the column their rule tests, e.g. "maturity" -> the MATURITY_DATE rule
+    rules = load_rules()
+    policies = [rules[i]["description"] for i in named_rules(rules, question)]
+    policies = [p for p in policies if p in set(cube["description"])]
+    if policies:
+        filters["description"] = policies
+    return filters
+
+
+def route_question(violations_df: pd.DataFrame, question: str, policy_scope=None):
+    """
+    Answers group-by, top-N and filtered count questions from the cube without an LLM.
+    Returns (title, result_df) or None when the question is not an aggregate question.
+    policy_scope optionally restricts the cube to a set of policy descriptions.
+    """
+    cube = build_violation_cube(violations_df)
+    if cube.empty:
+        return None
+
+    named_dims = [name for name, pat in DIMENSION_PATS.items() if pat.search(question)]
+    top_match = TOP_N_PAT.search(question)
+    wants_top = bool(top_match or TOP_PAT.search(question))
+    group_dims = [d for d in named_dims if GROUP_HINT_PAT.search(question) or wants_top]
+    filters = _detect_filters(cube, question, named_dims)
+    named_policies = filters.get("description", [])
+    if policy_scope is not None:
+        filters["description"] = [p for p in filters.get("description", cube["description"].unique()) if p in policy_scope]
+
+    # Leave policy-only breakdowns and plain totals to the existing deterministic branches
+    non_policy_groups = [d for d in group_dims if d != "policy"]
+    value_filters = {c: v for c, v in filters.items() if c != "description"}
+    if not non_policy_groups and not value_filters and not (wants_top and group_dims):
+        return None
+    if not group_dims and not COUNT_PAT.search(question) and not wants_top:
+        return None
+
+    mask = pd.Series(True, index=cube.index)
+    for col, values in filters.items():
+        mask &= cube[col].isin(values)
+    scoped = cube[mask]
+
+    filter_note = "; ".join(f"{col} in {', '.join(map(str, vals))}" for col, vals in value_filters.items())
+    if named_policies:
+        filter_note = "; ".join(filter(None, [filter_note, f"policy in {' / '.join(named_policies)}"]))
+    filter_label = f" where {filter_note}" if filter_note else ""
+    if not group_dims:
+        total = int(scoped["Count"].sum())
+        by_policy = scoped.groupby("description")["Count"].sum().reset_index().rename(columns={"description": "Policy"})
+        return f"Violations{filter_label}: {total}", by_policy
+
+    cols = [CUBE_DIMENSIONS[d] for d in group_dims]
+    result = (
+        scoped.groupby(cols)["Count"].sum().reset_index()
+        .sort_values(by="Count", ascending=False, ignore_index=True)
+        .rename(columns={"description": "Policy"})
+    )
+    dims_label = " × ".join(group_dims)
+    if wants_top:
+        n = int(top_match.group(1)) if top_match else (1 if re.search(r"\b(most|highest)\b", question, re.IGNORECASE) else DEFAULT_TOP_N)
+        result = result.head(n)
+        return f"Top {n} by {dims_label}{filter_label} (violation count)", result
+    return f"Violations by {dims_label}{filter_label}", result
+
+
+def route_rule_sets(bitmap, book_df: pd.DataFrame, question: str):
+    """
+    Answers multi-rule questions ("accounts violating both the maturity and reprice rules",
+    "rows with any violation in AED") from the detection ViolationBitmap joined to the book.
+    Returns (title, result_df) or None when fewer than two rules (or no 'any violation' + filter) are named.
+    """
+    if bitmap is None or book_df is None or len(book_df) != bitmap.n_rows:
+        return None
+    named = named_rules(bitmap.rules, question)
+    named_dims = [name for name, pat in DIMENSION_PATS.items() if pat.search(question)]
+    exact = set(re.findall(r"[A-Za-z0-9_]+", question))
+    filters = {}
+    for name, col in CUBE_DIMENSIONS.items():
+        if col == "description" or col not in book_df:
+            continue
+        hits = [v for v in book_df[col].dropna().astype(str).unique() if v in exact]
+        hits = [v for v in hits if v.upper() not in _AMBIGUOUS_VALUES or name in named_dims]
+        if hits:
+            filters[col] = hits
+
+    if len(named) >= 2:
+        combine_all = bool(BOTH_PAT.search(question)) or not EITHER_PAT.search(question)
+        bits = bitmap.all_of(*named) if combine_all else bitmap.any_of(*named)
+        joiner = " and " if combine_all else " or "
+        label = ("both " if combine_all and len(named) == 2 else "") + joiner.join(bitmap.rules[i]["column"] for i in named)
+    elif ANY_VIOLATION_PAT.search(question) and filters:
+        bits = bitmap.any_of()
+        label = "any rule"
+    else:
+        return None
+    for col, values in filters.items():
+        bits = bits & bitmap.column_bits(book_df, col, values)
+    filter_note = "; ".join(f"{col} in {', '.join(vals)}" for col, vals in filters.items())
+    filter_label = f" where {filter_note}" if filter_note else ""
+
+    account_cols = [c for c in ACCOUNT_COLUMNS if c in book_df]
+    if ACCOUNT_PAT.search(question) and account_cols:
+        rows = bitmap.select(book_df, bits, account_cols)
+        result = rows.groupby(account_cols, dropna=False).size().reset_index(name="Rows")
+        return f"Accounts violating {label}{filter_label}: {len(result)}", result
+    key_cols = [c for c in account_cols + list(CUBE_DIMENSIONS.values()) if c in book_df]
+    key_cols += [r["column"] for r in bitmap.rules if r.get("column") in book_df and r["column"] not in key_cols]
+    result = bitmap.select(book_df, bits, key_cols)
+    return f"Rows violating {label}{filter_label}: {bitmap.count(bits)}", result
@@ -0,0 +1,100 @@
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from functions.ftp_rules import evaluate_rules, detect_policy_violations_with_bitmap
+
+# === CONFIG ===
+APPROX_MIN_ROWS = 100_000            # smaller books are checked exactly straight away
+SAMPLE_ROWS = 5_000                  # rows evaluated for the estimate (row-wise eval is ~0.1ms per rule)
+STRATA_COLUMNS = ["ISO_CURRENCY_CD", "PRODUCT_CODE"]
+CONFIDENCE = 0.95
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="exact-detect")
+_JOBS = {}                           # job key -> Future of (violations_df, bitmap)
+_JOBS_LOCK = threading.Lock()
+
+
+def _z(confidence: float) -> float:
+    # Normal quantile via bisection on erf; avoids a scipy dependency
+    lo, hi = 0.0, 10.0
+    for _ in range(60):
+        mid = (lo + hi) / 2
+        if math.erf(mid / math.sqrt(2)) < confidence:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2
+
+
+def stratified_sample(df: pd.DataFrame, n: int = SAMPLE_ROWS, strata=STRATA_COLUMNS, seed: int = 0):
+    """
+    Proportional stratified sample without replacement, at least two rows per stratum where available.
+    Returns (row positions, stratum code per book row).
+    """
+    strata = [c for c in strata if c in df]
+    if strata:
+        codes = df.groupby(strata, dropna=False, sort=False).ngroup().to_numpy()
+    else:
+        codes = np.zeros(len(df), dtype=np.int64)
+    rng = np.random.default_rng(seed)
+    sizes = np.bincount(codes)
+    alloc = np.minimum(sizes, np.maximum(2, np.round(sizes * min(n / max(len(df), 1), 1.0)).astype(int)))
+    order = np.argsort(codes, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    picks = [
+        rng.choice(order[start:start + size], size=k, replace=False)
+        for start, size, k in zip(starts, sizes, alloc) if k
+    ]
+    return np.sort(np.concatenate(picks)) if picks else np.array([], dtype=np.intp), codes
+
+
+def estimate_policy_violations(df: pd.DataFrame, rules: list, sample_rows: int = SAMPLE_ROWS,
+                               strata=STRATA_COLUMNS, confidence: float = CONFIDENCE, seed: int = 0) -> pd.DataFrame:
+    """
+    Estimated violations per policy from a stratified sample (by currency/product), with a normal
+    confidence interval using the stratified variance and finite-population correction.
+    Columns: Policy, Estimate, Lower, Upper, Sampled, Sample hits.
+    """
+    positions, codes = stratified_sample(df, sample_rows, strata, seed)
+    sample = df.iloc[positions]
+    evaluated, violated_masks, _errors, _messages = evaluate_rules(sample, rules)
+    sizes = np.bincount(codes)                        # N_h
+    sample_codes = codes[positions]
+    n_h = np.bincount(sample_codes, minlength=len(sizes))
+    z = _z(confidence)
+
+    rows = []
+    for rule, mask in zip(evaluated, violated_masks):
+        hits = np.bincount(sample_codes, weights=mask.astype(float), minlength=len(sizes))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            p = np.where(n_h > 0, hits / n_h, 0.0)
+            fpc = np.where(sizes > 0, 1 - n_h / sizes, 0.0)
+            var_h = np.where(n_h > 1, sizes ** 2 * fpc * p * (1 - p) / (n_h - 1), 0.0)
+        estimate = float((sizes * p).sum())
+        half = z * math.sqrt(float(var_h.sum()))
+        rows.append({
+            "Policy": rule.get("description", "No description"),
+            "Estimate": round(estimate),
+            "Lower": max(int(mask.sum()), math.floor(estimate - half)),  # at least what the sample saw
+            "Upper": min(len(df), math.ceil(estimate + half)),
+            "Sampled": len(positions),
+            "Sample hits": int(mask.sum()),
+        })
+    return pd.DataFrame(rows, columns=["Policy", "Estimate", "Lower", "Upper", "Sampled", "Sample hits"])
+
+
+def start_exact_detection(job_key, df: pd.DataFrame, rules: list, data_key=None):
+    """Runs detect_policy_violations_with_bitmap in the background once per job_key; returns its Future."""
+    with _JOBS_LOCK:
+        future = _JOBS.get(job_key)
+        if future is None:
+            future = _EXECUTOR.submit(detect_policy_violations_with_bitmap, df, rules, data_key)
+            _JOBS[job_key] = future
+        return future
+
+
+def forget_exact_detection(job_key):
+    with _JOBS_LOCK:
+        _JOBS.pop(job_key, None)
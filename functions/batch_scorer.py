@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from functions.data_loader import iter_client_data
+from functions.rate_model import RateModel, build_features, model_path
+from functions.report_export import write_csv, write_parquet
+
+# === CONFIG ===
+SCORE_CHUNK_ROWS = 100_000
+SCORE_DIR = os.path.join("output", "scored")
+IN_FLIGHT_PER_WORKER = 2        # chunks queued per worker process; bounds memory while scoring
+
+_MODELS = {}                    # (abs path, mtime) -> RateModel, per process
+_MODELS_LOCK = threading.Lock()
+_WORKER_MODEL = None            # model path a worker process was started with
+
+
+def get_model(path: str) -> RateModel:
+    """Loads a saved model once per process; reloaded only when the file changes."""
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    with _MODELS_LOCK:
+        model = _MODELS.get(key)
+        if model is None:
+            model = RateModel.load(path)
+            for old in [k for k in _MODELS if k[0] == key[0]]:
+                del _MODELS[old]
+            _MODELS[key] = model
+        return model
+
+
+def score_frame(df: pd.DataFrame, model: RateModel) -> pd.DataFrame:
+    """df with PREDICTED_<target> and RESIDUAL_BPS (actual minus predicted) appended."""
+    predicted = model.predict(build_features(df, cache=False))
+    actual = pd.to_numeric(df[model.target], errors="coerce").to_numpy(dtype=float) if model.target in df \
+        else np.full(len(df), np.nan)
+    scored = df.copy()
+    scored[f"PREDICTED_{model.target}"] = predicted
+    scored["RESIDUAL_BPS"] = (actual - predicted) * 100
+    return scored
+
+
+def _init_worker(path: str):
+    global _WORKER_MODEL
+    _WORKER_MODEL = path
+    get_model(path)
+
+
+def _score_chunk(df: pd.DataFrame) -> pd.DataFrame:
+    return score_frame(df, get_model(_WORKER_MODEL))
+
+
+def iter_scored(src, path: str, chunk_rows: int = SCORE_CHUNK_ROWS, workers: int = 1):
+    """
+    Streams src (a file path, or an iterable of DataFrames) through the model in chunks, yielding scored
+    chunks in input order. workers > 1 scores chunks in that many processes, each loading the model once.
+    """
+    chunks = iter_client_data(src, chunk_rows) if isinstance(src, (str, os.PathLike)) else iter(src)
+    if workers <= 1:
+        model = get_model(path)
+        for chunk in chunks:
+            yield score_frame(chunk, model)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(path,)) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_score_chunk, chunk))
+            if len(pending) >= workers * IN_FLIGHT_PER_WORKER:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def scored_path(src: str, fmt: str = "csv") -> str:
+    stem = os.path.splitext(os.path.basename(src))[0]
+    return os.path.join(SCORE_DIR, f"{stem}_scored.{fmt}")
+
+
+def score_file(src: str, dest: str = None, target: str = "TRANSFER_RATE", path: str = None,
+               chunk_rows: int = SCORE_CHUNK_ROWS, workers: int = 1) -> dict:
+    """
+    Scores a whole book with the saved model for target (or the model at path) and writes every source
+    row with its prediction and residual to dest (.csv or .parquet; default output/scored/<name>_scored.csv).
+    Returns a summary with row count, timings and throughput.
+    """
+    path = path or model_path(target)
+    dest = dest or scored_path(src)
+    os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+    stats = {"rows": 0, "chunks": 0}
+    t0 = time.perf_counter()
+
+    def _counted(chunks):
+        for chunk in chunks:
+            stats["rows"] += len(chunk)
+            stats["chunks"] += 1
+            yield chunk
+
+    scored = _counted(iter_scored(src, path, chunk_rows, workers))
+    if dest.lower().endswith(".parquet"):
+        write_parquet(scored, dest)
+    else:
+        with open(dest, "wb") as f:
+            write_csv(scored, f)
+    seconds = time.perf_counter() - t0
+    return {
+        "source": src,
+        "dest": dest,
+        "model": path,
+        "rows": stats["rows"],
+        "chunks": stats["chunks"],
+        "workers": workers,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(stats["rows"] / seconds) if seconds > 0 else None,
+    }
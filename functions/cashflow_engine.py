@@ -0,0 +1,166 @@
+import numpy as np
+import pandas as pd
+from functions.ftp_pricing import is_fixed_rate, normalised_codes, term_components
+from functions.data_loader import as_of_date
+
+# === CONFIG ===
+MAX_PERIODS = 360               # monthly periods generated past the as-of date (30 years)
+MAX_GRID_CELLS = 4_000_000      # instruments × periods per chunk; each grid is 8 bytes per cell
+BALANCE_COLUMN = "CUR_PAR_BAL_LCY"
+RATE_COLUMN = "CUR_NET_RATE"    # customer rate in percent, used for interest and annuity payments
+# AMORTIZATION_TYPE -> (profile, run-off start month, run-off end month). The LR codes are behavioural run-off
+# buckets; the months below are read from their names (1MB = one month, 6MB-5YB = month 6 to year 5, ...).
+AMORTIZATION_PROFILES = {
+    "NON-AMORTIZING": ("bullet", None, None),
+    "CONVENTIONAL FIXED": ("annuity", None, None),
+    "LR-1MB": ("runoff", 0, 1),
+    "LR-5YB": ("runoff", 0, 60),
+    "LR-6MB-5YB": ("runoff", 6, 60),
+    "LR_CASA_CBG": ("runoff", 0, 60),
+}
+DEFAULT_PROFILE = ("bullet", None, None)
+SCHEDULE_COLUMNS = ["POSITION", "PERIOD", "DATE", "OPENING_BALANCE", "PRINCIPAL", "INTEREST", "REPRICE"]
+
+
+def chunk_rows_for(max_periods: int = MAX_PERIODS, max_cells: int = MAX_GRID_CELLS) -> int:
+    return max(1, max_cells // max(max_periods, 1))
+
+
+def _profiles(df: pd.DataFrame):
+    """Per-row (is annuity, run-off start, run-off end) from AMORTIZATION_TYPE; bullets have NaN bounds."""
+    codes, uniques = normalised_codes(df.get("AMORTIZATION_TYPE", pd.Series(np.nan, index=df.index)))
+    table = [AMORTIZATION_PROFILES.get(u, DEFAULT_PROFILE) for u in uniques]
+    annuity = np.array([p[0] == "annuity" for p in table], dtype=bool)[codes]
+    start = np.array([np.nan if p[1] is None else p[1] for p in table], dtype=float)[codes]
+    end = np.array([np.nan if p[2] is None else p[2] for p in table], dtype=float)[codes]
+    return annuity, start, end
+
+
+def schedule_grids(df: pd.DataFrame, max_periods: int = MAX_PERIODS, as_of=None, terms: dict = None) -> dict:
+    """
+    Monthly schedule of one chunk as instruments × periods arrays (period k covers months k-1..k after
+    the as-of date). Principal follows the AMORTIZATION_TYPE profile and is repaid in full by maturity;
+    interest accrues on the opening balance at RATE_COLUMN/12. REPRICE holds the balance that reprices in
+    the first reprice period of adjustable instruments. Balances keep their sign (liabilities negative).
+    terms takes precomputed ftp_pricing.term_components for these rows.
+    Returns {"periods", "dates", "opening", "principal", "interest", "reprice"}.
+    """
+    as_of = pd.Timestamp(as_of or as_of_date(df))
+    terms = terms or term_components(df, as_of)
+    remaining = np.where(np.isnan(terms["remaining"]), max_periods, terms["remaining"])
+    n = np.clip(np.ceil(remaining), 1, max_periods)                 # last period with a principal flow
+    horizon = int(n.max()) if len(n) else 1
+    k = np.arange(1, horizon + 1, dtype=float)[None, :]               # periods 1..horizon
+    nn = n[:, None]
+
+    balance = pd.to_numeric(df.get(BALANCE_COLUMN, pd.Series(0.0, index=df.index)), errors="coerce").fillna(0.0).to_numpy(dtype=float)
+    rate = pd.to_numeric(df.get(RATE_COLUMN, pd.Series(0.0, index=df.index)), errors="coerce").fillna(0.0).to_numpy(dtype=float) / 1200
+    annuity, start, end = _profiles(df)
+
+    # Cumulative share of principal repaid by the end of each period; bullets are a one-period run-off at maturity
+    bullet = np.isnan(start)
+    a = np.where(bullet, n - 1, start)[:, None]
+    b = np.where(bullet, n, np.maximum(end, start + 1))[:, None]
+    repaid = np.clip((k - a) / (b - a), 0.0, 1.0)
+    if annuity.any():
+        r = rate[annuity][:, None]
+        na = nn[annuity]
+        growth_n = (1 + r) ** na
+        with np.errstate(divide="ignore", invalid="ignore"):
+            level = 1 - (growth_n - (1 + r) ** np.minimum(k, na)) / (growth_n - 1)
+        repaid[annuity] = np.where(r > 0, level, np.clip(k / na, 0.0, 1.0))
+    repaid[k >= nn] = 1.0
+
+    principal = balance[:, None] * np.diff(repaid, axis=1, prepend=0.0)
+    opening = balance[:, None] - np.cumsum(principal, axis=1) + principal
+    interest = opening * rate[:, None]
+
+    # Adjustable instruments reprice their outstanding balance in the period of the first reprice date
+    reprice_k = np.ceil(terms["reprice"])
+    reprices = ~is_fixed_rate(df) & (reprice_k >= 1) & (reprice_k < n)
+    reprice = np.zeros_like(opening)
+    rows = np.flatnonzero(reprices)
+    cols = reprice_k[rows].astype(int) - 1
+    reprice[rows, cols] = opening[rows, cols]
+
+    if as_of.is_month_end:
+        dates = pd.date_range(as_of, periods=horizon + 1, freq="ME")[1:]
+    else:
+        dates = pd.DatetimeIndex([as_of + pd.DateOffset(months=int(m)) for m in range(1, horizon + 1)])
+    return {"periods": k[0].astype(int), "dates": dates, "opening": opening,
+            "principal": principal, "interest": interest, "reprice": reprice}
+
+
+def iter_schedule_grids(df: pd.DataFrame, chunk_rows: int = None, max_periods: int = MAX_PERIODS, as_of=None):
+    """
+    Yields (row positions, grids) chunk by chunk; only one chunk's grids exist at a time, so memory stays
+    around 6 × MAX_GRID_CELLS × 8 bytes whatever the book size. Rows are taken in order of remaining term,
+    so each chunk's grid is only as wide as its longest instrument.
+    """
+    chunk_rows = chunk_rows or chunk_rows_for(max_periods)
+    as_of = as_of or as_of_date(df)
+    terms = term_components(df, as_of)
+    order = np.argsort(np.nan_to_num(terms["remaining"], nan=max_periods), kind="stable")
+    for begin in range(0, len(df), chunk_rows):
+        positions = order[begin:begin + chunk_rows]
+        chunk_terms = {name: values[positions] for name, values in terms.items()}
+        yield positions, schedule_grids(df.iloc[positions], max_periods, as_of, chunk_terms)
+
+
+def iter_cashflows(df: pd.DataFrame, chunk_rows: int = None, max_periods: int = MAX_PERIODS, as_of=None):
+    """Long-format schedules (SCHEDULE_COLUMNS, non-zero periods only), one DataFrame per chunk."""
+    for positions, g in iter_schedule_grids(df, chunk_rows, max_periods, as_of):
+        live = (g["principal"] != 0) | (g["interest"] != 0) | (g["reprice"] != 0)
+        rows, cols = np.nonzero(live)
+        yield pd.DataFrame({
+            "POSITION": positions[rows],
+            "PERIOD": g["periods"][cols],
+            "DATE": g["dates"][cols],
+            "OPENING_BALANCE": g["opening"][rows, cols],
+            "PRINCIPAL": g["principal"][rows, cols],
+            "INTEREST": g["interest"][rows, cols],
+            "REPRICE": g["reprice"][rows, cols],
+        }, columns=SCHEDULE_COLUMNS)
+
+
+def cashflow_ladder(df: pd.DataFrame, by: str = "ISO_CURRENCY_CD", chunk_rows: int = None,
+                    max_periods: int = MAX_PERIODS, as_of=None) -> pd.DataFrame:
+    """
+    Principal, interest and repricing per period summed by a book column (e.g. currency), accumulated
+    chunk by chunk. Columns: <by>, PERIOD, DATE, PRINCIPAL, INTEREST, REPRICE.
+    """
+    codes, groups = pd.factorize(df[by].astype(str)) if by in df else (np.zeros(len(df), dtype=np.intp), pd.Index(["ALL"]))
+    totals = {name: np.zeros((len(groups), max_periods)) for name in ("principal", "interest", "reprice")}
+    dates = None
+    for positions, g in iter_schedule_grids(df, chunk_rows, max_periods, as_of):
+        width = g["principal"].shape[1]
+        if dates is None or len(g["dates"]) > len(dates):
+            dates = g["dates"]
+        # Group sums as one (groups × rows) @ (rows × periods) product per grid
+        onehot = np.zeros((len(groups), len(positions)))
+        onehot[codes[positions], np.arange(len(positions))] = 1.0
+        for name, total in totals.items():
+            total[:, :width] += onehot @ g[name]
+    horizon = len(dates) if dates is not None else 0
+    frame = pd.DataFrame({
+        by: np.repeat(np.asarray(groups), horizon),
+        "PERIOD": np.tile(np.arange(1, horizon + 1), len(groups)),
+        "DATE": np.tile(np.asarray(dates if dates is not None else []), len(groups)),
+        **{name.upper(): total[:, :horizon].ravel() for name, total in totals.items()},
+    })
+    return frame[(frame[["PRINCIPAL", "INTEREST", "REPRICE"]] != 0).any(axis=1)].reset_index(drop=True)
+
+
+def weighted_average_life(df: pd.DataFrame, chunk_rows: int = None, max_periods: int = MAX_PERIODS, as_of=None) -> np.ndarray:
+    """
+    Principal-weighted average life in months per instrument (NaN for zero balances), the cash-flow
+    term to price on the curve instead of the contractual term.
+    """
+    wal = np.full(len(df), np.nan)
+    for positions, g in iter_schedule_grids(df, chunk_rows, max_periods, as_of):
+        flows = np.abs(g["principal"])
+        total = flows.sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Flows fall on average half-way through their month
+            wal[positions] = np.where(total > 0, (flows * (g["periods"] - 0.5)).sum(axis=1) / total, np.nan)
+    return wal
@@ -2,6 +2,7 @@ from langchain_community.chat_models.oci_generative_ai import ChatOCIGenAI
 from langchain.chains import LLMChain
 from langchain.prompts import PromptTemplate
 from ftp_rules import load_rules, detect_policy_violations
+from functions.policy_registry import get_registry
 import pandas as pd
 import os
 import json
@@ -15,12 +16,9 @@ llm = ChatOCIGenAI(
 
 # Load policy rules (textual guidance for LLM)
 def load_policies():
-    policy_path = os.path.join("functions", "ftp_policies.txt")
-    if os.path.exists(policy_path):
-        with open(policy_path, "r") as f:
-            return f.read()
-    else:
-        return "No policy rules provided."
+    # Cached by the policy registry and re-read only when functions/ftp_policies.txt changes
+    policies = get_registry().policy_text()
+    return policies if policies is not None else "No policy rules provided."
 
 # Prompt template for LLM
 template = """
@@ -44,10 +42,11 @@ prompt = PromptTemplate(
 chain = LLMChain(llm=llm, prompt=prompt)
 
 # Main function to run FTP analysis
-def ask_llm(question, df):
+def ask_llm(question, df, violations_df=None):
     policies = load_policies()
-    rules = load_rules()
-    violations_df = detect_policy_violations(df, rules)
+    if violations_df is None:  # reuse precomputed violations (e.g. from batch_detect.py) when given
+        rules = load_rules()
+        violations_df = detect_policy_violations(df, rules)
 
     if violations_df.empty:
         return "✅ No violations detected based on current FTP rules."
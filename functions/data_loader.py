@@ -1,5 +1,106 @@
+import hashlib
+from datetime import datetime, timezone
 import pandas as pd
+from pandas.io.parsers import TextParser
+
+_EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+CODE_SUFFIXES = ("_CODE", "_CD")    # identifier columns, read as text when streaming so every chunk agrees
 
 def load_client_data(filepath):
     df = pd.read_excel(filepath)  # Loads the first (and only) sheet
     return df
+
+def file_fingerprint(filepath, chunk_size=1 << 20):
+    """SHA-256 of the file contents; identifies an input independently of its name or mtime."""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def code_columns(columns) -> list:
+    return [c for c in columns if str(c).upper().endswith(CODE_SUFFIXES)]
+
+def _excel_frame(header, rows):
+    # Same parser read_excel uses, so other dtypes match load_client_data
+    return TextParser([list(header)] + rows, header=0, dtype={c: str for c in code_columns(header)}).read()
+
+def _pin_dtypes(chunk, dtypes):
+    """
+    Casts a chunk's columns to the dtypes of the first chunk, so a column does not flip between
+    int, float and object from chunk to chunk. Values that do not fit a numeric dtype keep the
+    column as object rather than being lost.
+    """
+    for col, dtype in dtypes.items():
+        if col not in chunk or chunk[col].dtype == dtype:
+            continue
+        values = chunk[col]
+        if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+            numeric = pd.to_numeric(values, errors="coerce")
+            if numeric.notna().sum() < values.notna().sum():
+                chunk[col] = values.astype(object)
+            elif pd.api.types.is_integer_dtype(dtype) and numeric.isna().any():
+                chunk[col] = numeric.astype(float)
+            else:
+                chunk[col] = numeric.astype(dtype) if numeric.notna().all() else numeric
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            dates = pd.to_datetime(values, errors="coerce")
+            chunk[col] = values.astype(object) if dates.notna().sum() < values.notna().sum() else dates
+        elif dtype == object:
+            chunk[col] = values.astype(object)
+    return chunk
+
+def _iter_raw_chunks(filepath, chunk_rows):
+    ext = str(filepath).lower().rsplit(".", 1)[-1]
+    if ext == "csv":
+        header = pd.read_csv(filepath, nrows=0).columns
+        yield from pd.read_csv(filepath, chunksize=chunk_rows, dtype={c: str for c in code_columns(header)})
+        return
+    if ext == "parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(filepath).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+        return
+
+    from openpyxl import load_workbook
+    wb = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        block = []
+        for row in rows:
+            block.append(row)
+            if len(block) >= chunk_rows:
+                yield _excel_frame(header, block)
+                block = []
+        if block:
+            yield _excel_frame(header, block)
+    finally:
+        wb.close()
+
+def iter_client_data(filepath, chunk_rows=100_000):
+    """
+    Yields the book in DataFrames of up to chunk_rows rows without loading it whole.
+    Excel sheets are streamed with openpyxl's read-only mode; CSV and Parquet are read in batches.
+    Code columns (*_CODE, *_CD) are read as text and the other columns keep the first chunk's dtypes.
+    """
+    dtypes = None
+    for chunk in _iter_raw_chunks(filepath, chunk_rows):
+        if dtypes is None:
+            dtypes = chunk.dtypes.to_dict()
+        else:
+            chunk = _pin_dtypes(chunk, dtypes)
+        yield chunk
+
+def as_of_date(book_df: pd.DataFrame) -> str:
+    """Book as-of date (ISO) from AS_OF_DATE, which holds Excel serials or dates; today if missing."""
+    if book_df is not None and "AS_OF_DATE" in book_df:
+        values = book_df["AS_OF_DATE"].dropna()
+        if not values.empty:
+            value = values.iloc[0]
+            if pd.api.types.is_number(value):
+                return (_EXCEL_EPOCH + pd.Timedelta(days=float(value))).date().isoformat()
+            return pd.Timestamp(value).date().isoformat()
+    return datetime.now(timezone.utc).date().isoformat()
@@ -0,0 +1,57 @@
+import random
+import time
+from typing import Any, Iterator, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class FakeLLMError(RuntimeError):
+    """Simulated service error; carries an HTTP-like status like OCI service errors do."""
+
+    def __init__(self, message: str, status: int = 503):
+        super().__init__(message)
+        self.status = status
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Local stand-in for ChatOCIGenAI: waits like a remote model, optionally fails,
+    and answers with a short canned text. Supports invoke and stream.
+    """
+    latency_s: float = 0.5          # time to first token
+    token_latency_s: float = 0.01   # gap between streamed tokens
+    failure_rate: float = 0.0       # probability that a call raises FakeLLMError
+    response: str = "Fake answer: the supplied violations were received and summarised locally."
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-ftp-chat"
+
+    def _reply(self, messages: List[BaseMessage]) -> str:
+        prompt_chars = sum(len(str(m.content)) for m in messages)
+        return f"{self.response} ({prompt_chars} prompt chars)"
+
+    def _maybe_fail(self):
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise FakeLLMError("Fake model unavailable", status=503)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency_s)
+        self._maybe_fail()
+        text = self._reply(messages)
+        time.sleep(self.token_latency_s * len(text.split()))
+        usage = {"input_tokens": sum(len(str(m.content)) for m in messages) // 4,
+                 "output_tokens": len(text) // 4, "total_tokens": 0}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text, usage_metadata=usage))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency_s)
+        self._maybe_fail()
+        for i, word in enumerate(self._reply(messages).split(" ")):
+            if i:
+                time.sleep(self.token_latency_s)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=(" " if i else "") + word))
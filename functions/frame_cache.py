@@ -0,0 +1,23 @@
+import weakref
+from functools import wraps
+
+
+def cached_per_frame(fn):
+    """
+    Caches fn(df) per DataFrame object (by identity) for as long as that frame is alive.
+    Frames are treated as immutable; cached results must be treated as read-only too.
+    """
+    cache = {}
+
+    @wraps(fn)
+    def wrapper(df):
+        key = id(df)
+        hit = cache.get(key)
+        if hit is not None and hit[0]() is df:
+            return hit[1]
+        result = fn(df)
+        cache[key] = (weakref.ref(df, lambda _ref, k=key: cache.pop(k, None)), result)
+        return result
+
+    wrapper.cache_clear = cache.clear
+    return wrapper
@@ -0,0 +1,217 @@
+import os
+import numpy as np
+import pandas as pd
+from functions.data_loader import as_of_date
+
+# === CONFIG ===
+CURVE_CSV = os.path.join("input_data", "ftp_curves.csv")   # ISO_CURRENCY_CD, TENOR_MONTHS, RATE[, LIQUIDITY_PREMIUM]
+CURVE_COLUMNS = ["ISO_CURRENCY_CD", "TENOR_MONTHS", "RATE", "LIQUIDITY_PREMIUM"]
+PRICING_METHODS = ("auto", "matched_maturity", "remaining_term", "reprice_term", "cash_flow_life")
+DAYS_PER_MONTH = 365.25 / 12
+NO_DATE_BEFORE = pd.Timestamp("1901-01-01")   # '1/1/1900' marks "no reprice date" in the extract
+FIXED_RATE_TYPES = {"FIXED RATE"}
+TOLERANCE_BPS = 25.0
+
+
+# --- curves ---
+def load_curves(path: str = CURVE_CSV) -> pd.DataFrame:
+    """
+    Curve points in long format, one row per (currency, tenor). Rates are in percent like TRANSFER_RATE;
+    LIQUIDITY_PREMIUM is optional and defaults to 0.
+    """
+    curves = pd.read_csv(path)
+    return normalise_curves(curves)
+
+
+def normalise_curves(curves: pd.DataFrame) -> pd.DataFrame:
+    missing = [c for c in CURVE_COLUMNS[:3] if c not in curves]
+    if missing:
+        raise ValueError(f"Curve file is missing column(s): {', '.join(missing)}.")
+    curves = curves.copy()
+    if "LIQUIDITY_PREMIUM" not in curves:
+        curves["LIQUIDITY_PREMIUM"] = 0.0
+    curves["ISO_CURRENCY_CD"] = curves["ISO_CURRENCY_CD"].astype(str).str.strip().str.upper()
+    for col in CURVE_COLUMNS[1:]:
+        curves[col] = pd.to_numeric(curves[col], errors="coerce")
+    curves["LIQUIDITY_PREMIUM"] = curves["LIQUIDITY_PREMIUM"].fillna(0.0)
+    curves = curves.dropna(subset=["TENOR_MONTHS", "RATE"])
+    return curves[CURVE_COLUMNS].sort_values(["ISO_CURRENCY_CD", "TENOR_MONTHS"]).reset_index(drop=True)
+
+
+def curves_from_book(df: pd.DataFrame, tenors=(1, 360)) -> pd.DataFrame:
+    """
+    Flat stand-in curves at each currency's median TRANSFER_RATE, for when no curve file is supplied.
+    Only useful to see which instruments sit far from their currency's typical rate.
+    """
+    medians = df.groupby(df["ISO_CURRENCY_CD"].astype(str).str.upper())["TRANSFER_RATE"].median().dropna()
+    rows = [(ccy, t, rate, 0.0) for ccy, rate in medians.items() for t in tenors]
+    return normalise_curves(pd.DataFrame(rows, columns=CURVE_COLUMNS))
+
+
+def curve_matrix(curves: pd.DataFrame):
+    """
+    All curves interpolated onto the union of their tenors (flat beyond each curve's ends), so pricing is
+    one gather per instrument. Returns (currencies, grid, rate matrix, premium matrix); matrices are
+    currencies × grid.
+    """
+    grid = np.unique(curves["TENOR_MONTHS"].to_numpy(dtype=float))
+    currencies = pd.Index(curves["ISO_CURRENCY_CD"].unique())
+    rates = np.empty((len(currencies), len(grid)))
+    premiums = np.empty_like(rates)
+    for i, (_ccy, points) in enumerate(curves.groupby("ISO_CURRENCY_CD", sort=False)):
+        tenors = points["TENOR_MONTHS"].to_numpy(dtype=float)
+        rates[i] = np.interp(grid, tenors, points["RATE"].to_numpy(dtype=float))
+        premiums[i] = np.interp(grid, tenors, points["LIQUIDITY_PREMIUM"].to_numpy(dtype=float))
+    return currencies, grid, rates, premiums
+
+
+def interpolate(currency_codes: np.ndarray, terms: np.ndarray, grid: np.ndarray, *matrices):
+    """
+    Batched linear interpolation: row currency_codes[k] of each matrix at terms[k]. Codes of -1 or NaN
+    terms give NaN. Terms outside the grid take the nearest end point.
+    """
+    valid = (currency_codes >= 0) & ~np.isnan(terms)
+    t = np.clip(np.where(valid, terms, grid[0]), grid[0], grid[-1])
+    if len(grid) > 1:
+        hi = np.clip(np.searchsorted(grid, t, side="left"), 1, len(grid) - 1)
+        lo = hi - 1
+    else:
+        lo = hi = np.zeros(len(t), dtype=np.intp)
+    span = grid[hi] - grid[lo]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        w = np.where(span > 0, (t - grid[lo]) / span, 0.0)
+    rows = np.where(valid, currency_codes, 0)
+    out = []
+    for m in matrices:
+        values = m[rows, lo] * (1 - w) + m[rows, hi] * w
+        out.append(np.where(valid, values, np.nan))
+    return out
+
+
+# --- terms ---
+def _dates(series: pd.Series) -> np.ndarray:
+    """datetime64 values with placeholders (before 1901, unparseable) as NaT."""
+    values = pd.to_datetime(series, errors="coerce", format="mixed") if series.dtype == object \
+        else pd.to_datetime(series, errors="coerce")
+    return values.where(values >= NO_DATE_BEFORE).to_numpy(dtype="datetime64[ns]")
+
+
+def normalised_codes(series: pd.Series):
+    """Codes and distinct values of a column as trimmed upper-case strings; only the distinct values are normalised."""
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    merged, names = pd.factorize(pd.Index(uniques.astype(str)).str.strip().str.upper())
+    return merged[codes], pd.Index(names, dtype=object)
+
+
+def _months_between(start, end) -> np.ndarray:
+    return (end - start) / np.timedelta64(1, "D") / DAYS_PER_MONTH
+
+
+def term_components(df: pd.DataFrame, as_of=None) -> dict:
+    """
+    Candidate terms in months per instrument (NaN where unknown):
+      original  — ORIGINATION_DATE to MATURITY_DATE (term at origination)
+      remaining — as-of date to MATURITY_DATE
+      reprice   — REPRICE_FREQ × REPRICE_FREQ_MULT (D/M/Y), else as-of to NEXT_REPRICE_DATE
+    """
+    n = len(df)
+    as_of = np.datetime64(pd.Timestamp(as_of or as_of_date(df)), "ns")
+    nat = np.full(n, np.datetime64("NaT"), dtype="datetime64[ns]")
+    origination = _dates(df["ORIGINATION_DATE"]) if "ORIGINATION_DATE" in df else nat
+    maturity = _dates(df["MATURITY_DATE"]) if "MATURITY_DATE" in df else nat
+    next_reprice = _dates(df["NEXT_REPRICE_DATE"]) if "NEXT_REPRICE_DATE" in df else nat
+
+    original = _months_between(origination, maturity)
+    original[original <= 0] = np.nan
+    remaining = np.maximum(_months_between(as_of, maturity), 0.0)
+
+    freq = pd.to_numeric(df.get("REPRICE_FREQ", pd.Series(np.nan, index=df.index)), errors="coerce").to_numpy(dtype=float)
+    codes, units = normalised_codes(df.get("REPRICE_FREQ_MULT", pd.Series("", index=df.index)))
+    per_unit = pd.Series({"D": 1 / DAYS_PER_MONTH, "M": 1.0, "Y": 12.0}).reindex(units).to_numpy(dtype=float)[codes]
+    reprice = np.where(freq > 0, freq * per_unit, np.nan)
+    to_next = _months_between(as_of, next_reprice)
+    reprice = np.where(np.isnan(reprice) & (to_next > 0), to_next, reprice)
+    return {"original": original, "remaining": remaining, "reprice": reprice}
+
+
+def pricing_terms(df: pd.DataFrame, method: str = "auto", as_of=None, components: dict = None):
+    """
+    Pricing term in months per instrument and the method that produced it:
+      matched_maturity — original term; remaining_term — remaining term; reprice_term — reprice term
+      cash_flow_life   — weighted average life of the amortization schedule (cashflow_engine)
+      auto             — reprice_term for non-fixed instruments that have reprice information,
+                         matched_maturity otherwise (falling back to remaining_term without an origination date)
+    """
+    if method not in PRICING_METHODS:
+        raise ValueError(f"Unknown pricing method '{method}'; expected one of {', '.join(PRICING_METHODS)}.")
+    n = len(df)
+    if method == "cash_flow_life":
+        from functions.cashflow_engine import weighted_average_life  # imports this module
+        return weighted_average_life(df, as_of=as_of), np.full(n, method, dtype=object)
+    terms = components or term_components(df, as_of)
+    original, remaining, reprice = terms["original"], terms["remaining"], terms["reprice"]
+
+    if method == "matched_maturity":
+        return original, np.full(n, method, dtype=object)
+    if method == "remaining_term":
+        return remaining, np.full(n, method, dtype=object)
+    if method == "reprice_term":
+        return reprice, np.full(n, method, dtype=object)
+
+    floating = ~is_fixed_rate(df) & ~np.isnan(reprice)
+    use_original = ~floating & ~np.isnan(original)
+    chosen = np.select([floating, use_original], [reprice, original], remaining)
+    used = np.select([floating, use_original], ["reprice_term", "matched_maturity"], "remaining_term").astype(object)
+    return chosen, used
+
+
+def is_fixed_rate(df: pd.DataFrame) -> np.ndarray:
+    codes, types = normalised_codes(df.get("ADJUSTABLE_TYPE", pd.Series("", index=df.index)))
+    return types.isin(FIXED_RATE_TYPES)[codes]
+
+
+# --- pricing ---
+def price_book(df: pd.DataFrame, curves: pd.DataFrame, method: str = "auto", as_of=None) -> pd.DataFrame:
+    """
+    Model transfer rates for every instrument, aligned to df's index: TERM_MONTHS, PRICING_METHOD,
+    BASE_RATE, LIQUIDITY_PREMIUM, MODEL_TRANSFER_RATE (base + premium, percent), the file's TRANSFER_RATE
+    and DIFF_BPS (file minus model). Currencies without a curve price as NaN.
+    """
+    currencies, grid, rates, premiums = curve_matrix(curves)
+    ccy_codes, ccys = normalised_codes(df["ISO_CURRENCY_CD"])
+    codes = currencies.get_indexer(ccys)[ccy_codes]
+    terms, used = pricing_terms(df, method, as_of)
+    base, premium = interpolate(codes, terms, grid, rates, premiums)
+    model = base + premium
+    file_rate = pd.to_numeric(df.get("TRANSFER_RATE", pd.Series(np.nan, index=df.index)), errors="coerce").to_numpy(dtype=float)
+    return pd.DataFrame({
+        "TERM_MONTHS": terms,
+        "PRICING_METHOD": used,
+        "BASE_RATE": base,
+        "LIQUIDITY_PREMIUM": premium,
+        "MODEL_TRANSFER_RATE": model,
+        "TRANSFER_RATE": file_rate,
+        "DIFF_BPS": (file_rate - model) * 100,
+    }, index=df.index)
+
+
+def compare_to_file(df: pd.DataFrame, priced: pd.DataFrame, tolerance_bps: float = TOLERANCE_BPS) -> pd.DataFrame:
+    """Per-currency comparison of model and file rates: instruments, priced, mean/max |diff| and share within tolerance."""
+    diff = priced["DIFF_BPS"].abs()
+    frame = pd.DataFrame({
+        "Currency": df["ISO_CURRENCY_CD"].astype(str).str.upper().to_numpy(),
+        "Priced": priced["MODEL_TRANSFER_RATE"].notna().to_numpy(),
+        "Compared": diff.notna().to_numpy(),
+        "AbsDiff": diff.to_numpy(),
+        "Within": (diff <= tolerance_bps).to_numpy(),
+    })
+    out = frame.groupby("Currency").agg(
+        Instruments=("Priced", "size"),
+        Priced=("Priced", "sum"),
+        Compared=("Compared", "sum"),
+        **{"Mean |diff| (bps)": ("AbsDiff", "mean"), "Max |diff| (bps)": ("AbsDiff", "max")},
+        Within=("Within", "sum"),
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out[f"Within {tolerance_bps:g} bps"] = (out.pop("Within") / out["Compared"]).round(3)
+    return out.reset_index().sort_values("Instruments", ascending=False).reset_index(drop=True)
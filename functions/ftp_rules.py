@@ -1,17 +1,54 @@
+import numpy as np
 import pandas as pd
 import json
 import os
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import date
 import json as pyjson  # for stringifying row_context
+from functions.frame_cache import cached_per_frame
+from functions.violation_bitmap import ViolationBitmap
+from functions.policy_registry import POLICY_JSON, get_registry, rule_key
+from functions.reconciliation import evaluate_reconciliation, is_reconciliation, required_columns
+from functions.fx_rates import converted_columns_in, table_version, with_converted
 
 # === CONFIG ===
 ROW_CONTEXT_FIELDS = None  # None = include all columns; or list of column names
+RULE_RESULT_CACHE_SIZE = 64  # (dataset, rule) evaluation results kept for re-detection after rule edits
 
-def load_rules(path: str = os.path.join("functions", "ftp_policies.json")):
-    """Loads rules from a JSON file."""
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return []
+_RULE_RESULTS = OrderedDict()  # (data_key, rule cache key) -> (violated mask, error mask, {pos: message})
+_RULE_RESULTS_LOCK = threading.Lock()
+_WATCHED_REGISTRIES = set()
+
+def load_rules(path: str = POLICY_JSON):
+    """Rules from the policy registry for a JSON file (reloaded when the file changes)."""
+    registry = get_registry(path)
+    if id(registry) not in _WATCHED_REGISTRIES:
+        _WATCHED_REGISTRIES.add(id(registry))
+        registry.on_change(_evict_rule_results)
+    return registry.rules()
+
+def _evict_rule_results(added: set, removed: set):
+    """Drops cached evaluations of rules that were edited or deleted; unchanged rules keep theirs."""
+    with _RULE_RESULTS_LOCK:
+        for key in [k for k in _RULE_RESULTS if k[1][0] in removed]:
+            del _RULE_RESULTS[key]
+
+def reads_clock(rule: dict) -> bool:
+    """True for conditions that read the clock (pd.Timestamp.now(), today()); their results only hold for a day."""
+    condition = rule.get("condition", "")
+    return "now(" in condition or "today(" in condition
+
+def _rule_cache_key(rule: dict) -> tuple:
+    # Conditions that read the clock are only reusable on the day they were evaluated
+    today = date.today().isoformat() if reads_clock(rule) else None
+    return rule_key(rule), today
+
+def rules_version(rules: list) -> str:
+    """Short stable hash of the rule set; changes whenever any rule's column, condition or description does."""
+    canonical = pyjson.dumps(rules, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
 
 def _make_row_context(row: pd.Series):
     """Return either full or filtered row dict, with all values JSON‑serializable."""
@@ -30,37 +67,119 @@ def _make_row_context(row: pd.Series):
                 data[k] = str(v)
     return data
 
-def detect_policy_violations(df: pd.DataFrame, rules: list) -> pd.DataFrame:
-    """Evaluates each rule and returns violations as a DataFrame with JSON‑safe row_context."""
-    violations = []
+def _fx_columns(rule: dict) -> list:
+    return converted_columns_in(f"{rule.get('column') or ''} {rule.get('condition', '')}")
+
+def with_requested_fx(df: pd.DataFrame, rules: list) -> pd.DataFrame:
+    """Adds the reporting-currency columns (e.g. NET_TP_AMOUNT_RPT) the rules refer to; df unchanged if none do."""
+    names = [n for rule in rules for n in _fx_columns(rule) if n not in df.columns]
+    if not names:
+        return df
+    try:
+        return with_converted(df, names)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ FX conversion unavailable: {e}")
+        return df
+
+def _evaluate_rule(df: pd.DataFrame, rule: dict, code):
+    """Row-by-row evaluation of one rule: (violated mask, error mask, {row position: error message})."""
+    col = rule.get("column")
+    violated = np.zeros(len(df), dtype=bool)
+    errored = np.zeros(len(df), dtype=bool)
+    messages = {}
+    for pos, (_, row) in enumerate(df.iterrows()):
+        try:
+            local_vars = {c: row[c] for c in df.columns}
+            local_vars["x"] = row[col] if col else None
+            local_vars["pd"] = pd
+
+            if eval(code, {}, local_vars):
+                violated[pos] = True
+
+        except Exception as e:
+            errored[pos] = True
+            messages[pos] = f"Error evaluating rule: {e}"
+    return violated, errored, messages
 
+def evaluate_rules(df: pd.DataFrame, rules: list, data_key=None):
+    """
+    Evaluates each rule row by row. Returns (evaluated rules, violated masks, error masks, error messages);
+    rules whose column is missing are skipped. error messages maps (rule index, row position) -> text.
+    With data_key (anything identifying df's contents, e.g. a file fingerprint) results are cached per
+    rule, so after a rule edit only the changed rules are re-evaluated.
+    """
+    registry = get_registry()
+    df = with_requested_fx(df, rules)
+    evaluated, violated_masks, error_masks, messages = [], [], [], {}
     for rule in rules:
         col = rule.get("column")
-        condition = rule["condition"]
-        description = rule.get("description", "No description")
 
         if col and col not in df.columns:
             print(f"⚠️ Skipping rule: column '{col}' not found in Excel data.")
             continue
+        missing = [c for c in required_columns(rule) if c not in df.columns] if is_reconciliation(rule) else []
+        if missing:
+            print(f"⚠️ Skipping reconciliation rule: column(s) {', '.join(missing)} not found in Excel data.")
+            continue
 
-        for _, row in df.iterrows():
-            try:
-                local_vars = {c: row[c] for c in df.columns}
-                local_vars["x"] = row[col] if col else None
-                local_vars["pd"] = pd
-
-                if eval(condition, {}, local_vars):
-                    row_context = _make_row_context(row)
-                    violations.append({
-                        "description": description,
-                        "row_context": pyjson.dumps(row_context, ensure_ascii=False)
-                    })
-
-            except Exception as e:
-                row_context = _make_row_context(row)
-                violations.append({
-                    "description": f"Error evaluating rule: {e}",
-                    "row_context": pyjson.dumps(row_context, ensure_ascii=False)
-                })
-
-    return pd.DataFrame(violations)
+        cache_key = (data_key, _rule_cache_key(rule)) if data_key is not None else None
+        if cache_key and _fx_columns(rule):
+            # Results on converted columns also depend on the rate file
+            cache_key = (data_key, _rule_cache_key(rule), table_version())
+        with _RULE_RESULTS_LOCK:
+            result = _RULE_RESULTS.get(cache_key) if cache_key else None
+            if result is not None:
+                _RULE_RESULTS.move_to_end(cache_key)
+        if result is None:
+            if is_reconciliation(rule):
+                result = evaluate_reconciliation(df, rule)
+            else:
+                result = _evaluate_rule(df, rule, registry.compiled(rule["condition"]))
+            if cache_key:
+                with _RULE_RESULTS_LOCK:
+                    _RULE_RESULTS[cache_key] = result
+                    while len(_RULE_RESULTS) > RULE_RESULT_CACHE_SIZE:
+                        _RULE_RESULTS.popitem(last=False)
+
+        k = len(evaluated)
+        violated, errored, rule_messages = result
+        messages.update({(k, pos): text for pos, text in rule_messages.items()})
+        evaluated.append(rule)
+        violated_masks.append(violated)
+        error_masks.append(errored)
+    return evaluated, violated_masks, error_masks, messages
+
+def detect_policy_violations_with_bitmap(df: pd.DataFrame, rules: list, data_key=None):
+    """detect_policy_violations plus the rules × rows ViolationBitmap from the same evaluation."""
+    df = with_requested_fx(df, rules)
+    evaluated, violated_masks, error_masks, messages = evaluate_rules(df, rules, data_key)
+    violations = []
+    contexts = {}  # a row breaking several rules is serialised once
+    for k, rule in enumerate(evaluated):
+        description = rule.get("description", "No description")
+        for pos in np.flatnonzero(violated_masks[k] | error_masks[k]):
+            if pos not in contexts:
+                contexts[pos] = pyjson.dumps(_make_row_context(df.iloc[pos]), ensure_ascii=False)
+            violations.append({
+                "description": messages.get((k, pos), description),
+                "row_context": contexts[pos]
+            })
+    bitmap = ViolationBitmap.from_masks(evaluated, violated_masks, error_masks, len(df))
+    return pd.DataFrame(violations), bitmap
+
+def detect_policy_violations(df: pd.DataFrame, rules: list, data_key=None) -> pd.DataFrame:
+    """Evaluates each rule and returns violations as a DataFrame with JSON‑safe row_context."""
+    return detect_policy_violations_with_bitmap(df, rules, data_key)[0]
+
+@cached_per_frame
+def expand_row_context(violations_df: pd.DataFrame) -> pd.DataFrame:
+    """Parses the JSON row_context strings back into columns, keeping the policy description first (parsed once per frame)."""
+    if violations_df is None or violations_df.empty:
+        return pd.DataFrame(columns=["description"])
+    # A row that breaks several rules repeats the same context string; parse each distinct one once
+    codes, uniques = pd.factorize(violations_df["row_context"], use_na_sentinel=False)
+    records = [pyjson.loads(s) if isinstance(s, str) else {} for s in uniques]
+    expanded = pd.DataFrame.from_records(records).take(codes)
+    expanded.index = violations_df.index
+    expanded.insert(0, "description", violations_df["description"])
+    return expanded
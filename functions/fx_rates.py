@@ -0,0 +1,119 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from functions.data_loader import as_of_date
+from functions.ftp_pricing import normalised_codes
+
+# === CONFIG ===
+FX_CSV = os.path.join("input_data", "fx_rates.csv")   # AS_OF_DATE, ISO_CURRENCY_CD, RATE
+FX_COLUMNS = ["AS_OF_DATE", "ISO_CURRENCY_CD", "RATE"]  # RATE = units of REPORTING_CURRENCY per unit of currency
+REPORTING_CURRENCY = "USD"
+CURRENCY_COLUMN = "ISO_CURRENCY_CD"
+AMOUNT_COLUMNS = ["AVG_BOOK_BAL_LCY", "CUR_PAR_BAL_LCY", "NET_TP_AMOUNT", "ACCRUED_INTEREST_LCY"]
+CONVERTED_SUFFIX = "_RPT"       # AVG_BOOK_BAL_LCY -> AVG_BOOK_BAL_LCY_RPT, in REPORTING_CURRENCY
+FX_CACHE_SIZE = 16              # (file, as-of date) rate tables kept in memory
+# Question words that ask for amounts in the reporting currency
+REPORTING_WORDS = {"reporting", "converted", "fx", "equivalent"}
+
+_TABLES = OrderedDict()         # (abs path, mtime, as-of date) -> Series of rates by currency
+_TABLES_LOCK = threading.Lock()
+_CONVERTED = re.compile(r"\b(\w+)" + re.escape(CONVERTED_SUFFIX) + r"\b")
+
+
+def converted_name(col: str) -> str:
+    return f"{col}{CONVERTED_SUFFIX}"
+
+
+def converted_columns_in(text: str) -> list:
+    """Converted column names (e.g. NET_TP_AMOUNT_RPT) referenced in a rule column, condition or question."""
+    return list(dict.fromkeys(m.group(0) for m in _CONVERTED.finditer(text or "")))
+
+
+def table_version(path: str = FX_CSV):
+    """Changes whenever the rate file does (None if it does not exist); part of cache keys for converted results."""
+    return (os.path.abspath(path), os.path.getmtime(path)) if os.path.exists(path) else None
+
+
+# --- rate tables ---
+def load_fx_rates(path: str = FX_CSV) -> pd.DataFrame:
+    """All rows of the rate file, normalised: AS_OF_DATE as dates, upper-case currencies, numeric RATE."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"FX rate file '{path}' not found.")
+    rates = pd.read_csv(path)
+    missing = [c for c in FX_COLUMNS if c not in rates]
+    if missing:
+        raise ValueError(f"FX rate file is missing column(s): {', '.join(missing)}.")
+    rates = rates[FX_COLUMNS].copy()
+    rates["AS_OF_DATE"] = pd.to_datetime(rates["AS_OF_DATE"], errors="coerce")
+    rates["ISO_CURRENCY_CD"] = rates["ISO_CURRENCY_CD"].astype(str).str.strip().str.upper()
+    rates["RATE"] = pd.to_numeric(rates["RATE"], errors="coerce")
+    return rates.dropna().sort_values(["ISO_CURRENCY_CD", "AS_OF_DATE"]).reset_index(drop=True)
+
+
+def rate_table(as_of=None, path: str = FX_CSV) -> pd.Series:
+    """
+    Rate per currency for one as-of date: each currency's latest rate on or before it. Cached per
+    (file, mtime, date), so the file is read once per date until it changes. The reporting currency is 1.
+    """
+    day = pd.Timestamp(as_of or as_of_date(None)).normalize()
+    version = table_version(path)
+    key = (*(version or (os.path.abspath(path), None)), day)
+    with _TABLES_LOCK:
+        table = _TABLES.get(key)
+        if table is not None:
+            _TABLES.move_to_end(key)
+            return table
+    rates = load_fx_rates(path)
+    table = rates[rates["AS_OF_DATE"] <= day].groupby("ISO_CURRENCY_CD")["RATE"].last()
+    table[REPORTING_CURRENCY] = 1.0
+    with _TABLES_LOCK:
+        _TABLES[key] = table
+        while len(_TABLES) > FX_CACHE_SIZE:
+            _TABLES.popitem(last=False)
+    return table
+
+
+def rates_for(currencies, as_of=None, path: str = FX_CSV) -> np.ndarray:
+    """Rates aligned with a list of distinct currency codes (NaN where the table has none)."""
+    currencies = pd.Index(currencies).astype(str).str.strip().str.upper()
+    return rate_table(as_of, path).reindex(currencies).to_numpy(dtype=float)
+
+
+def fx_factors(df: pd.DataFrame, as_of=None, path: str = FX_CSV) -> np.ndarray:
+    """Per-row rate to the reporting currency: one lookup per distinct currency, gathered by integer code."""
+    codes, currencies = normalised_codes(df[CURRENCY_COLUMN])
+    return rates_for(currencies, as_of or as_of_date(df), path)[codes]
+
+
+def missing_currencies(currencies, as_of=None, path: str = FX_CSV) -> list:
+    currencies = pd.Index(currencies)
+    return sorted(currencies[np.isnan(rates_for(currencies, as_of, path))].astype(str))
+
+
+def with_converted(df: pd.DataFrame, names, as_of=None, path: str = FX_CSV) -> pd.DataFrame:
+    """
+    df plus the requested converted columns (names like NET_TP_AMOUNT_RPT) that it does not have yet.
+    Only those columns are computed, from one set of per-row factors; rows whose currency has no rate get
+    NaN. Returns df itself when there is nothing to add.
+    """
+    todo = [n for n in dict.fromkeys(names) if n not in df.columns]
+    sources = {n: n[:-len(CONVERTED_SUFFIX)] for n in todo if n.endswith(CONVERTED_SUFFIX)}
+    unknown = [n for n in todo if sources.get(n) not in df.columns]
+    if unknown:
+        raise ValueError(f"Cannot convert {', '.join(unknown)}: no such amount column in the data.")
+    if not todo:
+        return df
+    factors = fx_factors(df, as_of, path)
+    out = df.copy(deep=False)           # existing columns are shared, not copied
+    for name, src in sources.items():
+        out[name] = pd.to_numeric(df[src], errors="coerce").to_numpy(dtype=float) * factors
+    return out
+
+
+def wants_reporting_currency(question: str) -> bool:
+    """True when a question asks for converted amounts (reporting/FX wording or a converted column name)."""
+    words = set(re.split(r"[^a-z0-9]+", (question or "").lower()))
+    return bool(words & REPORTING_WORDS) or bool(converted_columns_in(question))
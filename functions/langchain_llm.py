@@ -5,11 +5,28 @@ import streamlit as st
 from langchain_community.chat_models.oci_generative_ai import ChatOCIGenAI
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
+from concurrent.futures import ThreadPoolExecutor
+from functions.prompt_builder import build_violations_payload
+from functions.ftp_rules import expand_row_context
+from functions.analytics_router import route_question, route_rule_sets, policy_counts
+from functions.safe_query import (
+    QUERY_SPEC_INSTRUCTIONS, query_frames, describe_schema,
+    parse_query_spec, validate_query_spec, run_query_spec,
+)
+from functions.prompt_builder import CHARS_PER_TOKEN, estimate_tokens, select_prompt_columns
+from functions.account_index import lookup_account
+from functions.policy_registry import get_registry
+from functions.violation_index import relevant_rows
+from functions.llm_metrics import track_llm_call, mark_first_token, set_completion, set_metrics_log
+from functions.llm_resilience import configure_resilience, resilient_invoke, resilient_stream
 
 
 import os
 import stat
+import hashlib
 import pathlib
+import threading
+from collections import OrderedDict
 import urllib.parse
 import streamlit as st
 from typing import Optional
@@ -19,25 +36,42 @@ from langchain_core.messages import HumanMessage, SystemMessage
 # ---------- Secrets/env helpers ----------
 def _get(name: str, required: bool = True, default=None):
     """Fetch from st.secrets (preferred) then environment."""
-    val = st.secrets.get(name) if hasattr(st, "secrets") else None
+    try:
+        val = st.secrets.get(name) if hasattr(st, "secrets") else None
+    except Exception:
+        val = None  # no secrets.toml (e.g. headless runs): fall back to env
     if val is None or str(val).strip() == "":
         val = os.getenv(name, default)
     if required and (val is None or str(val).strip() == ""):
         raise RuntimeError(f"Missing required secret/env: {name}")
     return val
 
-MODEL_ID         = _get("OCI_MODEL_ID")
-SERVICE_ENDPOINT = _get("OCI_ENDPOINT")
-COMPARTMENT_OCID = _get("OCI_COMPARTMENT_OCID")
+# "oci" (default) or "fake" for the local stand-in model (load tests, offline development)
+LLM_BACKEND      = str(_get("LLM_BACKEND", required=False, default="oci")).strip().lower()
+
+if LLM_BACKEND == "oci":
+    MODEL_ID         = _get("OCI_MODEL_ID")
+    SERVICE_ENDPOINT = _get("OCI_ENDPOINT")
+    COMPARTMENT_OCID = _get("OCI_COMPARTMENT_OCID")
 
-TENANCY_OCID     = _get("OCI_TENANCY_OCID")
-USER_OCID        = _get("OCI_USER_OCID")
-FINGERPRINT      = _get("OCI_FINGERPRINT")
-PRIVATE_KEY_PEM  = _get("OCI_PRIVATE_KEY")   # full PEM string from secrets
-PASSPHRASE       = _get("OCI_PASSPHRASE", required=False, default=None)
+    TENANCY_OCID     = _get("OCI_TENANCY_OCID")
+    USER_OCID        = _get("OCI_USER_OCID")
+    FINGERPRINT      = _get("OCI_FINGERPRINT")
+    PRIVATE_KEY_PEM  = _get("OCI_PRIVATE_KEY")   # full PEM string from secrets
+    PASSPHRASE       = _get("OCI_PASSPHRASE", required=False, default=None)
 
 LLM_TEMPERATURE  = float(_get("LLM_TEMPERATURE", required=False, default="0.0"))
 LLM_MAX_TOKENS   = int(_get("LLM_MAX_TOKENS", required=False, default=800))
+LLM_PROMPT_TOKEN_BUDGET = int(_get("LLM_PROMPT_TOKEN_BUDGET", required=False, default=3000))
+LLM_MAX_CONCURRENCY = int(_get("LLM_MAX_CONCURRENCY", required=False, default=4))
+LLM_MAP_MAX_CHUNKS = int(_get("LLM_MAP_MAX_CHUNKS", required=False, default=32))   # map calls per map-reduce answer
+LLM_CACHE_SIZE = int(_get("LLM_CACHE_SIZE", required=False, default=128))
+set_metrics_log(_get("LLM_METRICS_LOG", required=False, default=None))
+configure_resilience(
+    timeout_s=_get("LLM_TIMEOUT_S", required=False, default=60),
+    max_retries=_get("LLM_MAX_RETRIES", required=False, default=2),
+    max_in_flight=_get("LLM_MAX_IN_FLIGHT", required=False, default=8),
+)
 
 
 # ---------- OCI config bootstrap (file-based, works locally & on Streamlit Cloud) ----------
@@ -84,38 +118,51 @@ def _ensure_oci_files(tenancy: str, user: str, fingerprint: str, pem: str, regio
     os.environ.setdefault("OCI_CONFIG_FILE", str(config_path))
     os.environ.setdefault("OCI_CONFIG_PROFILE", "DEFAULT")
 
-REGION = _infer_region_from_endpoint(SERVICE_ENDPOINT)
-_ensure_oci_files(
-    tenancy=TENANCY_OCID,
-    user=USER_OCID,
-    fingerprint=FINGERPRINT,
-    pem=PRIVATE_KEY_PEM,
-    region=REGION,
-    passphrase=PASSPHRASE,
-)
+if LLM_BACKEND == "oci":
+    REGION = _infer_region_from_endpoint(SERVICE_ENDPOINT)
+    _ensure_oci_files(
+        tenancy=TENANCY_OCID,
+        user=USER_OCID,
+        fingerprint=FINGERPRINT,
+        pem=PRIVATE_KEY_PEM,
+        region=REGION,
+        passphrase=PASSPHRASE,
+    )
 
-# ---------- Initialize LLM (only accepted fields) ----------
-# ChatOCIGenAI validates inputs via Pydantic and does NOT accept signer/tenancy/user/etc. directly.
-# It will pick credentials up from ~/.oci/config we just wrote.
-llm = ChatOCIGenAI(
-    model_id=MODEL_ID,
-    service_endpoint=SERVICE_ENDPOINT,
-    compartment_id=COMPARTMENT_OCID,
-    model_kwargs={
-        "temperature": LLM_TEMPERATURE,
-        "max_tokens": LLM_MAX_TOKENS,
-    },
-)
+    # ---------- Initialize LLM (only accepted fields) ----------
+    # ChatOCIGenAI validates inputs via Pydantic and does NOT accept signer/tenancy/user/etc. directly.
+    # It will pick credentials up from ~/.oci/config we just wrote.
+    llm = ChatOCIGenAI(
+        model_id=MODEL_ID,
+        service_endpoint=SERVICE_ENDPOINT,
+        compartment_id=COMPARTMENT_OCID,
+        model_kwargs={
+            "temperature": LLM_TEMPERATURE,
+            "max_tokens": LLM_MAX_TOKENS,
+        },
+    )
+elif LLM_BACKEND == "fake":
+    from functions.fake_llm import FakeChatModel
+    llm = FakeChatModel(
+        latency_s=float(_get("FAKE_LLM_LATENCY_S", required=False, default=0.5)),
+        failure_rate=float(_get("FAKE_LLM_FAILURE_RATE", required=False, default=0.0)),
+    )
+else:
+    raise RuntimeError(f"Unknown LLM_BACKEND: {LLM_BACKEND} (expected 'oci' or 'fake')")
 
 # ---------- Simple query function your pages import ----------
 def query_llm(prompt: str, system_prompt: Optional[str] = None) -> str:
-    if system_prompt and system_prompt.strip():
-        messages = [SystemMessage(content=system_prompt), HumanMessage(content=prompt)]
-        resp = llm.invoke(messages)
-    else:
-        resp = llm.invoke(prompt)
-    # resp is an AIMessage; return text content
-    return getattr(resp, "content", str(resp))
+    with track_llm_call("raw", (system_prompt or "") + prompt) as rec:
+        on_retry = lambda _e: rec.__setitem__("retries", rec["retries"] + 1)
+        if system_prompt and system_prompt.strip():
+            messages = [SystemMessage(content=system_prompt), HumanMessage(content=prompt)]
+            resp = resilient_invoke(llm, messages, on_retry)
+        else:
+            resp = resilient_invoke(llm, prompt, on_retry)
+        # resp is an AIMessage; return text content
+        text = getattr(resp, "content", str(resp))
+        set_completion(rec, text, getattr(resp, "usage_metadata", None))
+    return text
 
 
 
@@ -130,15 +177,13 @@ def query_llm(prompt: str, system_prompt: Optional[str] = None) -> str:
 
 
 
-# === Load authoritative FTP policies (JSON-driven scope) ===
-FTP_SCOPE_AVAILABLE = True
-try:
-    with open("ftp_policies.json") as f:
-        _ftp_policies = json.load(f)
-    FTP_POLICY_DESCRIPTIONS = {p["description"] for p in _ftp_policies if "description" in p}
-except Exception:
-    FTP_SCOPE_AVAILABLE = False
-    FTP_POLICY_DESCRIPTIONS = set()
+# === Authoritative FTP policies (JSON-driven scope) ===
+# Read through the policy registry, the same source detection uses, so edits apply without a restart
+def ftp_policy_descriptions() -> set:
+    try:
+        return get_registry().descriptions()
+    except Exception:
+        return set()
 
 # === Prompt ===
 template = """
@@ -156,6 +201,7 @@ Truncation status:
 
 Rules:
 - Treat each row in the violations list as a violation/anomaly.
+- Policy counts and rollups in the violations data cover all rows; sample rows are examples only, never totals.
 - If total_count_all > 0, you must NOT say there are no anomalies.
 - If a scoped section is provided and scoped_total > 0, focus on those. If scoped_total == 0, state that explicitly.
 - Do not infer or invent policies, counts, or anomalies beyond the provided data.
@@ -181,6 +227,116 @@ prompt = PromptTemplate(
 )
 chain = LLMChain(llm=llm, prompt=prompt)
 
+# === Map-reduce prompts (full coverage when violations exceed one prompt) ===
+map_template = """
+You are a financial data analyst reviewing one slice of FTP policy violations.
+
+Slice: {chunk_label}
+Rows in this slice: {chunk_count} (of {total_count_all} violations in total)
+
+Truncation status:
+{truncation_note}
+
+Violations Data:
+{violations}
+
+Question:
+{question}
+
+Report ONLY what this slice shows that is relevant to the question: counts, affected segments and notable rows.
+Do not infer or invent data. Be brief.
+"""
+map_prompt = PromptTemplate(
+    input_variables=["chunk_label", "chunk_count", "total_count_all", "truncation_note", "violations", "question"],
+    template=map_template
+)
+map_chain = LLMChain(llm=llm, prompt=map_prompt)
+
+reduce_template = """
+You are a financial data analyst.
+
+The partial findings below come from disjoint slices that together cover ALL {total_count_all} violations.
+
+Global per-policy counts:
+{policy_counts_all}
+
+Partial findings:
+{partials}
+
+Question:
+{question}
+
+Combine the findings into one concise, specific answer. Use the global counts for totals.
+Do not infer or invent policies, counts, or anomalies beyond the provided data.
+"""
+reduce_prompt = PromptTemplate(
+    input_variables=["total_count_all", "policy_counts_all", "partials", "question"],
+    template=reduce_template
+)
+reduce_chain = LLMChain(llm=llm, prompt=reduce_prompt)
+
+# === Schema-only planning prompts (question -> whitelisted local query) ===
+plan_template = """
+You translate questions about FTP data into a query that runs locally. You see only the schema, never the data.
+
+{schema}
+
+{instructions}
+
+Question:
+{question}
+"""
+plan_prompt = PromptTemplate(input_variables=["schema", "instructions", "question"], template=plan_template)
+plan_chain = LLMChain(llm=llm, prompt=plan_prompt)
+
+result_template = """
+You are a financial data analyst.
+
+A query was run locally against the full data to answer the question below.
+Query: {query_spec}
+
+Result ({result_note}):
+{result}
+
+Question:
+{question}
+
+Answer based ONLY on the result above. Be concise and specific.
+"""
+result_prompt = PromptTemplate(input_variables=["query_spec", "result_note", "result", "question"], template=result_template)
+result_chain = LLMChain(llm=llm, prompt=result_prompt)
+
+# === Single-account explanation prompt ===
+account_template = """
+You are a financial data analyst explaining the FTP policy position of {key_column} = {account_key}.
+
+Book rows for this key: {book_count}
+{book_rows}
+
+Policy violations for this key: {violation_count}
+By policy:
+{policy_counts}
+
+Truncation status:
+{truncation_note}
+
+Violations Data:
+{violations}
+
+Question:
+{question}
+
+Explain, based ONLY on the rows above, which policies this account breaks and which field values cause it.
+Do not infer or invent data. Be concise and specific.
+"""
+account_prompt = PromptTemplate(
+    input_variables=["key_column", "account_key", "book_count", "book_rows", "violation_count",
+                     "policy_counts", "truncation_note", "violations", "question"],
+    template=account_template
+)
+account_chain = LLMChain(llm=llm, prompt=account_prompt)
+ACCOUNT_BOOK_ROWS = 20  # book rows of the account shown to the LLM
+
 # --- Patterns ---
 COUNT_TOTAL_PAT       = re.compile(r"\b(how\s+many|number\s+of)\b.*\bviolation", re.IGNORECASE)
 COUNT_PER_POLICY_PAT  = re.compile(r"(each|per\s+policy|by\s+policy)", re.IGNORECASE)
@@ -201,10 +357,310 @@ def inject_white_text_css():
 def white_subheader(text: str):
     st.markdown(f"<h3 style='color: white; margin-bottom: 0;'>{text}</h3>", unsafe_allow_html=True)
 
-def query_llm(violations_df, question, max_violations=None, as_streamlit=False):
+# === Instrumented LLM calls (metrics + small response cache) ===
+_RESPONSE_CACHE = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+def _cache_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _cache_get(text: str):
+    with _CACHE_LOCK:
+        key = _cache_key(text)
+        if key in _RESPONSE_CACHE:
+            _RESPONSE_CACHE.move_to_end(key)
+            return _RESPONSE_CACHE[key]
+    return None
+
+def _cache_put(text: str, answer: str):
+    if LLM_CACHE_SIZE <= 0:
+        return
+    with _CACHE_LOCK:
+        _RESPONSE_CACHE[_cache_key(text)] = answer
+        while len(_RESPONSE_CACHE) > LLM_CACHE_SIZE:
+            _RESPONSE_CACHE.popitem(last=False)
+
+def _count_retry(rec: dict):
+    return lambda _exc: rec.__setitem__("retries", rec["retries"] + 1)
+
+def _run_chain(answer_chain, inputs: dict, kind: str, fallback: Optional[str] = None) -> str:
+    """
+    Runs one prompt through the chain's model with metrics, response caching and the resilient
+    call layer. If the model stays unavailable, returns `fallback` when given, else raises.
+    """
+    text = answer_chain.prompt.format(**inputs)
+    cached = _cache_get(text)
+    if cached is not None:
+        with track_llm_call(kind, text, cache_hit=True) as rec:
+            set_completion(rec, cached)
+        return cached
+    try:
+        with track_llm_call(kind, text) as rec:
+            resp = resilient_invoke(answer_chain.llm, text, on_retry=_count_retry(rec))
+            answer = getattr(resp, "content", str(resp))
+            set_completion(rec, answer, getattr(resp, "usage_metadata", None))
+    except Exception:
+        if fallback is None:
+            raise
+        return fallback
+    _cache_put(text, answer)
+    return answer
+
+def _stream_answer(inputs: dict, answer_chain=None, kind: str = "answer", fallback: Optional[str] = None):
+    """
+    Yields answer text as the model produces it. If streaming fails before any output (circuit open
+    or retries exhausted), yields `fallback` when given, else raises.
+    """
+    answer_chain = answer_chain or chain
+    text = answer_chain.prompt.format(**inputs)
+    cached = _cache_get(text)
+    if cached is not None:
+        with track_llm_call(kind, text, cache_hit=True) as rec:
+            set_completion(rec, cached)
+        yield cached
+        return
+    started = False
+    parts = []
+    try:
+        with track_llm_call(kind, text) as rec:
+            for chunk in resilient_stream(answer_chain.llm, text, on_retry=_count_retry(rec)):
+                piece = getattr(chunk, "content", str(chunk))
+                if piece:
+                    mark_first_token(rec)
+                    started = True
+                    parts.append(piece)
+                    yield piece
+            set_completion(rec, "".join(parts))
+    except Exception:
+        # resilient_stream already spent the retry budget before the first chunk; don't retry again
+        if started or fallback is None:
+            raise
+        yield fallback
+        return
+    _cache_put(text, "".join(parts))
+
+def _deterministic_summary(total_count_all, policy_counts_all_str, scoped_section="") -> str:
+    """Answer used when the LLM is unavailable (circuit open or retries exhausted)."""
+    scoped = f"\n{scoped_section}" if scoped_section else ""
+    return (
+        "LLM unavailable — showing the deterministic summary instead.\n"
+        f"Anomalies/violations detected: {total_count_all}\nBy policy:\n{policy_counts_all_str}{scoped}"
+    )
+
+def _rows_per_chunk(violations_df, question, token_budget):
+    """Rows whose compact CSV fills about half the token budget; the rest is left for the prompt and aggregates."""
+    sample = expand_row_context(violations_df.head(200))
+    columns = select_prompt_columns(sample, question)
+    per_row = estimate_tokens(sample[columns].to_csv(index=False, header=False)) / max(len(sample), 1) + 1
+    return max(1, int(token_budget * 0.5 // per_row))
+
+def _split_violations(violations_df, chunk_by="policy", max_rows_per_chunk=200, max_chunks=None):
+    """
+    Splits violations into (label, frame) chunks, one per policy or segment value, capped at max_rows_per_chunk rows.
+    At most max_chunks chunks are made: beyond that the smallest groups are merged and chunks grow instead.
+    An unknown chunk_by column falls back to plain row chunks.
+    """
+    max_chunks = max(1, max_chunks or LLM_MAP_MAX_CHUNKS)
+    if chunk_by == "policy":
+        name, keys = "policy", violations_df["description"]
+    else:
+        expanded = expand_row_context(violations_df)
+        if chunk_by in expanded:
+            name, keys = chunk_by, expanded[chunk_by].astype(str)
+        else:
+            print(f"⚠️ Column '{chunk_by}' not in the violations; chunking by rows instead.")
+            name, keys = "rows", pd.Series("all", index=violations_df.index)
+    groups = [(f"{name} = {key}" if name != "rows" else "rows", grp)
+              for key, grp in violations_df.groupby(keys, sort=False)]
+    if len(groups) > max_chunks:
+        groups.sort(key=lambda g: len(g[1]), reverse=True)
+        rest = groups[max_chunks - 1:]
+        merged = pd.concat([grp for _, grp in rest])
+        groups = groups[:max_chunks - 1] + [(f"{name} = {len(rest)} other values", merged)]
+
+    parts = [-(-len(grp) // max_rows_per_chunk) for _, grp in groups]
+    if sum(parts) > max_chunks:
+        # One chunk per group, the spare chunks shared out by group size
+        spare, total = max_chunks - len(groups), len(violations_df)
+        parts = [min(p, 1 + int(spare * len(grp) / total)) for p, (_, grp) in zip(parts, groups)]
+    chunks = []
+    for (label, grp), n_parts in zip(groups, parts):
+        size = -(-len(grp) // n_parts)
+        for n, start in enumerate(range(0, len(grp), size)):
+            part_label = f"{label} (part {n + 1} of {n_parts})" if n_parts > 1 else label
+            chunks.append((part_label, grp.iloc[start:start + size]))
+    return chunks
+
+def _reduce_partials(partials, inputs, token_budget, pool):
+    """
+    Joined partial findings that fit token_budget. While they do not, batches of partials that fit
+    are reduced to one summary each (a level of a reduce tree), so the final prompt stays bounded
+    however many chunks were mapped. Each partial is cut to half the budget, so every batch holds
+    at least two and each level at least halves the count.
+    """
+    max_chars = token_budget * CHARS_PER_TOKEN // 2
+    texts = [f"[{label}]\n{text.strip()[:max_chars]}" for label, text in partials]
+    level = 0
+    while len(texts) > 1 and estimate_tokens("\n\n".join(texts)) > token_budget:
+        level += 1
+        batches, current = [], []
+        for text in texts:
+            if current and estimate_tokens("\n\n".join(current + [text])) > token_budget:
+                batches.append(current)
+                current = []
+            current.append(text)
+        batches.append(current)
+
+        def _reduce(batch):
+            joined = "\n\n".join(batch)
+            return _run_chain(reduce_chain, {**inputs, "partials": joined}, "reduce", fallback=joined[:max_chars])
+
+        summaries = list(pool.map(_reduce, batches))
+        texts = [f"[level {level} summary {i + 1} of {len(batches)}]\n{text.strip()[:max_chars]}"
+                 for i, text in enumerate(summaries)]
+    return "\n\n".join(texts)
+
+def query_llm_map_reduce(violations_df, question, chunk_by="policy", max_concurrency=None,
+                         token_budget=None, max_rows_per_chunk=None, policy_counts_all=None, stream=False,
+                         max_chunks=None):
+    """
+    Summarizes every violation chunk concurrently (at most max_concurrency LLM calls in flight),
+    then reduces the partial findings into one answer. Covers all rows instead of truncating.
+    Chunks are sized from the token budget (unless max_rows_per_chunk is given) and capped at
+    max_chunks; partials that outgrow the budget are reduced hierarchically before the final call.
+    """
+    total_count_all = len(violations_df)
+    if policy_counts_all is None:
+        policy_counts_all = (
+            violations_df['description'].value_counts()
+            .rename_axis('Policy').reset_index(name='Count')
+            .to_string(index=False)
+        )
+    token_budget = token_budget or LLM_PROMPT_TOKEN_BUDGET
+    max_rows_per_chunk = max_rows_per_chunk or _rows_per_chunk(violations_df, question, token_budget)
+
+    def _map(chunk):
+        label, chunk_df = chunk
+        violations_str, truncation_note = build_violations_payload(chunk_df, question, token_budget=token_budget)
+        return label, _run_chain(map_chain, {
+            "chunk_label": label,
+            "chunk_count": len(chunk_df),
+            "total_count_all": total_count_all,
+            "truncation_note": truncation_note,
+            "violations": violations_str,
+            "question": question,
+        }, "map", fallback=f"(No LLM summary available for this slice of {len(chunk_df)} violations.)")
+
+    chunks = _split_violations(violations_df, chunk_by, max_rows_per_chunk, max_chunks)
+    inputs = {
+        "total_count_all": total_count_all,
+        "policy_counts_all": policy_counts_all,
+        "question": question,
+    }
+    with ThreadPoolExecutor(max_workers=max_concurrency or LLM_MAX_CONCURRENCY) as pool:
+        partials = list(pool.map(_map, chunks))
+        inputs["partials"] = _reduce_partials(partials, inputs, token_budget, pool)
+
+    fallback = _deterministic_summary(total_count_all, policy_counts_all)
+    if stream:
+        return _stream_answer(inputs, reduce_chain, "reduce", fallback)
+    return _run_chain(reduce_chain, inputs, "reduce", fallback)
+
+def query_llm_via_schema(violations_df, question, book_df=None, summarize=True, token_budget=None, stream=False):
+    """
+    Sends only the frame schemas to the LLM, runs the whitelisted query it returns locally,
+    and optionally summarizes the result with a small second prompt.
+    Returns (query_spec, result_df, answer); answer is None when summarize is False.
+    Raises ValueError if the LLM's query does not pass validation.
+    """
+    frames = query_frames(violations_df, book_df)
+    plan = _run_chain(plan_chain, {
+        "schema": describe_schema(frames),
+        "instructions": QUERY_SPEC_INSTRUCTIONS,
+        "question": question,
+    }, "plan")
+    spec = validate_query_spec(parse_query_spec(plan), frames)
+    result_df = run_query_spec(spec, frames)
+    if not summarize:
+        return spec, result_df, None
+
+    budget = token_budget or LLM_PROMPT_TOKEN_BUDGET
+    result_str = result_df.to_csv(index=False)
+    shown = len(result_df)
+    while shown > 1 and estimate_tokens(result_str) > budget:
+        shown = shown // 2
+        result_str = result_df.head(shown).to_csv(index=False)
+    result_note = f"{len(result_df)} rows" + (f", first {shown} shown" if shown < len(result_df) else "")
+    inputs = {
+        "query_spec": json.dumps(spec),
+        "result_note": result_note,
+        "result": result_str,
+        "question": question,
+    }
+    fallback = f"LLM unavailable — the local query returned {len(result_df)} rows:\n{result_df.head(20).to_string(index=False)}"
+    if stream:
+        answer = _stream_answer(inputs, result_chain, "result", fallback)
+    else:
+        answer = _run_chain(result_chain, inputs, "result", fallback)
+    return spec, result_df, answer
+
+def explain_account(violations_df, account, book_df=None, question=None, column=None, token_budget=None, stream=False):
+    """
+    Explains one account's (or customer's) violations, sending the LLM only that key's rows,
+    found through the account index. Accounts without violations are answered without the LLM.
+    """
+    found = lookup_account(account, book_df=book_df, violations_df=violations_df, column=column)
+    label = f"{found['column']} {found['key']}"
+    book_rows = found["book"] if found["book"] is not None else pd.DataFrame()
+    account_violations = violations_df.loc[found["violations"].index] if len(found["violations"]) else None
+    if account_violations is None:
+        if book_rows.empty:
+            return f"No book rows or violations found for {label}."
+        return f"{label}: {len(book_rows)} book rows, no policy violations."
+
+    question = question or f"Why does {label} violate FTP policies?"
+    counts = account_violations["description"].value_counts().rename_axis("Policy").reset_index(name="Count")
+    violations_str, truncation_note = build_violations_payload(
+        account_violations, question, token_budget=token_budget or LLM_PROMPT_TOKEN_BUDGET,
+    )
+    if book_rows.empty:
+        book_str = "(book not supplied)"
+    else:
+        # Identifiers plus the columns the account's violated rules test
+        cols = [c for c in select_prompt_columns(found["violations"], question) if c in book_rows]
+        book_str = book_rows[cols].head(ACCOUNT_BOOK_ROWS).to_csv(index=False)
+        if len(book_rows) > ACCOUNT_BOOK_ROWS:
+            book_str += f"(first {ACCOUNT_BOOK_ROWS} of {len(book_rows)} rows shown)\n"
+    inputs = {
+        "key_column": found["column"],
+        "account_key": found["key"],
+        "book_count": len(book_rows),
+        "book_rows": book_str,
+        "violation_count": len(account_violations),
+        "policy_counts": counts.to_string(index=False),
+        "truncation_note": truncation_note,
+        "violations": violations_str,
+        "question": question,
+    }
+    fallback = _deterministic_summary(len(account_violations), inputs["policy_counts"])
+    if stream:
+        return _stream_answer(inputs, account_chain, "account", fallback)
+    return _run_chain(account_chain, inputs, "account", fallback)
+
+def query_llm(violations_df, question, max_violations=None, as_streamlit=False, token_budget=None, stream=False,
+              map_reduce=False, chunk_by="policy", local_query=False, book_df=None, auto_table=True,
+              bitmap=None):
     """
     Deterministic for counts, anomalies, and scoped (FTP) queries using JSON-driven scope.
-    LLM for narrative, with injected global and scoped counts.
+    LLM for narrative, with injected global and scoped counts. The violations section of the
+    prompt is compacted to fit token_budget (defaults to LLM_PROMPT_TOKEN_BUDGET).
+    With stream=True the LLM narrative is returned as a generator of text chunks;
+    deterministic answers are always plain strings. With map_reduce=True the narrative
+    covers every violation via query_llm_map_reduce instead of a single compacted prompt.
+    With local_query=True the LLM only plans a query over the violations/book schema, which
+    runs locally (query_llm_via_schema); invalid plans fall back to the compacted prompt.
+    auto_table=False keeps plain-text answers for table/list-row questions (headless callers).
+    With the detection bitmap and book_df, multi-rule questions are answered by bit operations (route_rule_sets).
     """
     if violations_df is None or violations_df.empty:
         return "No violations found."
@@ -212,28 +668,26 @@ def query_llm(violations_df, question, max_violations=None, as_streamlit=False):
     q_lower = question.lower()
 
     # Auto-enable table mode for table or list-rows hints
-    if TABLE_HINT_PAT.search(q_lower) or LIST_ROWS_PAT.search(q_lower):
+    if auto_table and (TABLE_HINT_PAT.search(q_lower) or LIST_ROWS_PAT.search(q_lower)):
         as_streamlit = True
     if as_streamlit:
         inject_white_text_css()
 
     # --- Global counts ---
     total_count_all = len(violations_df)
-    per_policy_all = (
-        violations_df['description'].value_counts()
-        .rename_axis('Policy').reset_index(name='Count')
-        .sort_values(by="Count", ascending=False)
-    )
+    per_policy_all = policy_counts(violations_df)
     policy_counts_all_str = per_policy_all.to_string(index=False)
 
     # --- Optional FTP scope ---
     scoped_df = violations_df
     scope_applied = False
     scope_note = ""
+    ftp_descriptions = set()
     if FTP_HINT_PAT.search(q_lower):
-        if FTP_SCOPE_AVAILABLE and FTP_POLICY_DESCRIPTIONS:
+        ftp_descriptions = ftp_policy_descriptions()
+        if ftp_descriptions:
             scope_applied = True
-            scoped_df = violations_df[violations_df['description'].isin(FTP_POLICY_DESCRIPTIONS)]
+            scoped_df = violations_df[violations_df['description'].isin(ftp_descriptions)]
             # Short-circuit if scope doesn't reduce the set
             if scoped_df.shape[0] == violations_df.shape[0]:
                 scope_applied = False
@@ -248,6 +702,16 @@ def query_llm(violations_df, question, max_violations=None, as_streamlit=False):
         if scope_applied and not scoped_df.empty else "—"
     )
 
+    # --- Multi-rule set questions answered from the detection bitmap ---
+    rule_sets = route_rule_sets(bitmap, book_df, question)
+    if rule_sets is not None:
+        title, result_df = rule_sets
+        if as_streamlit:
+            white_subheader(title)
+            st.dataframe(result_df, use_container_width=True)
+            return ""
+        return f"{title}\n{result_df.to_string(index=False)}"
+
     # --- Full table branch for "which entries/rows" ---
     if LIST_ROWS_PAT.search(q_lower):
         df_to_show = scoped_df if scope_applied else violations_df
@@ -260,6 +724,21 @@ def query_llm(violations_df, question, max_violations=None, as_streamlit=False):
             return ""
         return f"Violating entries:\n{df_to_show.to_string(index=False)}"
 
+    # --- Aggregate questions answered from the precomputed cube ---
+    routed = route_question(
+        violations_df, question,
+        policy_scope=ftp_descriptions if scope_applied else None,
+    )
+    if routed is not None:
+        title, result_df = routed
+        if as_streamlit:
+            white_subheader(title)
+            if scope_note:
+                st.caption(scope_note)
+            st.dataframe(result_df, use_container_width=True)
+            return ""
+        return f"{title}\n{result_df.to_string(index=False)}"
+
     # --- Instant factual answers ---
     if COUNT_TOTAL_PAT.search(q_lower) and not COUNT_PER_POLICY_PAT.search(q_lower):
         if as_streamlit:
@@ -309,26 +788,44 @@ def query_llm(violations_df, question, max_violations=None, as_streamlit=False):
 
     # --- LLM narrative ---
     df_for_prompt = scoped_df if scope_applied else violations_df
-    truncated = False
-    if max_violations is not None and max_violations < len(df_for_prompt):
-        df_for_prompt = df_for_prompt.head(max_violations)
-        truncated = True
-
-    violations_str = df_for_prompt.to_string(index=False)
+    if local_query:
+        try:
+            spec, result_df, answer = query_llm_via_schema(
+                df_for_prompt, question, book_df=book_df, token_budget=token_budget, stream=stream,
+            )
+            if as_streamlit:
+                white_subheader(f"Local query result: {len(result_df)} rows")
+                st.caption(json.dumps(spec))
+                st.dataframe(result_df, use_container_width=True)
+            return answer
+        except Exception as e:
+            # Rejected plans and unavailable models both fall back to the compacted prompt
+            scope_note = f"{scope_note} Local query unavailable ({e}); answered from compacted violations.".strip()
+    if map_reduce:
+        return query_llm_map_reduce(
+            df_for_prompt, question, chunk_by=chunk_by, token_budget=token_budget,
+            policy_counts_all=policy_counts_all_str, stream=stream,
+        )
+    violations_str, truncation_note = build_violations_payload(
+        df_for_prompt, question,
+        token_budget=token_budget or LLM_PROMPT_TOKEN_BUDGET,
+        max_rows=max_violations,
+        relevant=relevant_rows(df_for_prompt, question),
+    )
     scoped_section = (
         f"Scoped to FTP policies from ftp_policies.json:\nscoped_total: {scoped_total}\nscoped per-policy counts:\n{per_policy_scoped_str}"
         if scope_applied else f"No scoped filter applied.{(' ' + scope_note) if scope_note else ''}"
     )
-    truncation_note = (
-        f"YES — showing first {len(df_for_prompt)} of {scoped_total if scope_applied else total_count_all} rows (max_violations={max_violations})."
-        if truncated else "NO — all rows included."
-    )
 
-    return chain.run({
+    inputs = {
         "violations": violations_str,
         "question": question,
         "total_count_all": total_count_all,
         "policy_counts_all": policy_counts_all_str,
         "scoped_section": scoped_section,
         "truncation_note": truncation_note,
-    })
+    }
+    fallback = _deterministic_summary(total_count_all, policy_counts_all_str, scoped_section if scope_applied else "")
+    if stream:
+        return _stream_answer(inputs, fallback=fallback)
+    return _run_chain(chain, inputs, "answer", fallback)
@@ -0,0 +1,128 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from functions.prompt_builder import estimate_tokens
+
+# === CONFIG ===
+METRICS_WINDOW = 1000   # most recent calls kept in memory
+PERCENTILES = (50, 90, 99)
+
+_LOCK = threading.Lock()
+_CALLS = deque(maxlen=METRICS_WINDOW)
+_LOG_PATH = None
+
+
+def set_metrics_log(path):
+    """Appends every finished call as one JSON line to path (None disables)."""
+    global _LOG_PATH
+    _LOG_PATH = path or None
+
+
+@contextmanager
+def track_llm_call(kind: str, prompt_text: str = "", cache_hit: bool = False):
+    """
+    Times one LLM call and records it when the block exits, including on error.
+    The yielded dict can be updated: mark_first_token(), set_completion(), rec["retries"] += 1.
+    """
+    rec = {
+        "kind": kind,
+        "started_at": time.time(),
+        "prompt_chars": len(prompt_text),
+        "prompt_tokens": estimate_tokens(prompt_text),
+        "completion_chars": 0,
+        "completion_tokens": 0,
+        "ttft_s": None,
+        "latency_s": None,
+        "cache_hit": cache_hit,
+        "retries": 0,
+        "error": None,
+    }
+    t0 = time.perf_counter()
+    rec["_t0"] = t0
+    try:
+        yield rec
+    except Exception as e:
+        rec["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        rec["latency_s"] = time.perf_counter() - t0
+        if rec["ttft_s"] is None and rec["error"] is None:
+            rec["ttft_s"] = rec["latency_s"]  # non-streaming: first token arrives with the answer
+        del rec["_t0"]
+        _record(rec)
+
+
+def mark_first_token(rec: dict):
+    if rec["ttft_s"] is None:
+        rec["ttft_s"] = time.perf_counter() - rec["_t0"]
+
+
+def set_completion(rec: dict, text: str, usage: dict = None):
+    """Stores completion size; uses provider token usage when the response carries it."""
+    rec["completion_chars"] = len(text or "")
+    rec["completion_tokens"] = estimate_tokens(text or "")
+    if usage:
+        rec["prompt_tokens"] = usage.get("input_tokens", rec["prompt_tokens"])
+        rec["completion_tokens"] = usage.get("output_tokens", rec["completion_tokens"])
+
+
+def _record(rec: dict):
+    with _LOCK:
+        _CALLS.append(rec)
+        if _LOG_PATH:
+            with open(_LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec) + "\n")
+
+
+def metrics_frame() -> pd.DataFrame:
+    """Recent calls as a DataFrame, oldest first."""
+    with _LOCK:
+        return pd.DataFrame(list(_CALLS))
+
+
+def _percentiles(values) -> dict:
+    values = [v for v in values if v is not None]
+    if not values:
+        return {f"p{p}": None for p in PERCENTILES}
+    return {f"p{p}": float(np.percentile(values, p)) for p in PERCENTILES}
+
+
+def metrics_summary(kind: str = None) -> dict:
+    """Call counts, error/cache-hit rates and latency/TTFT/token percentiles over the recent window."""
+    df = metrics_frame()
+    if not df.empty and kind is not None:
+        df = df[df["kind"] == kind]
+    if df.empty:
+        return {"calls": 0}
+    live = df[~df["cache_hit"]]
+    return {
+        "calls": len(df),
+        "errors": int(df["error"].notna().sum()),
+        "error_rate": float(df["error"].notna().mean()),
+        "cache_hit_rate": float(df["cache_hit"].mean()),
+        "retries": int(df["retries"].sum()),
+        "latency_s": _percentiles(live["latency_s"]),
+        "ttft_s": _percentiles(live["ttft_s"]),
+        "prompt_tokens": _percentiles(df["prompt_tokens"]),
+        "completion_tokens": _percentiles(df["completion_tokens"]),
+    }
+
+
+def export_metrics(path: str) -> int:
+    """Appends the in-memory window to a JSON-lines file; returns the number of records written."""
+    df = metrics_frame()
+    if df.empty:
+        return 0
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    df.to_json(path, orient="records", lines=True, mode="a")
+    return len(df)
+
+
+def reset_metrics():
+    with _LOCK:
+        _CALLS.clear()
@@ -0,0 +1,209 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+# === CONFIG (override with configure_resilience) ===
+TIMEOUT_S = 60.0            # deadline per attempt (first token when streaming)
+MAX_RETRIES = 2             # retries after the first attempt
+BACKOFF_BASE_S = 0.5
+BACKOFF_MAX_S = 8.0
+MAX_IN_FLIGHT = 4           # process-wide concurrent LLM calls
+BREAKER_FAILURES = 5        # consecutive failed calls that open the circuit
+BREAKER_RECOVERY_S = 30.0   # how long the circuit stays open before a trial call
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class LLMTimeoutError(TimeoutError):
+    """The model (or a free call slot) did not respond before the deadline."""
+
+
+class CircuitOpenError(RuntimeError):
+    """Calls are short-circuited after repeated failures; callers should fall back."""
+
+
+class CircuitBreaker:
+    """Closed -> open after `failure_threshold` consecutive failures -> half-open trial after `recovery_s`."""
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURES, recovery_s: float = BREAKER_RECOVERY_S,
+                 clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.recovery_s = recovery_s
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if self._clock() - self._opened_at >= self.recovery_s else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._clock() - self._opened_at >= self.recovery_s and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._failures >= self.failure_threshold or self._opened_at is not None:
+                self._opened_at = self._clock()
+
+
+_SEMAPHORE = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+_BREAKER = CircuitBreaker()
+_EXECUTOR = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-call")
+
+
+def configure_resilience(timeout_s=None, max_retries=None, backoff_base_s=None, backoff_max_s=None,
+                         max_in_flight=None, breaker_failures=None, breaker_recovery_s=None):
+    """Overrides the module defaults; resets the semaphore and breaker when their settings change."""
+    global TIMEOUT_S, MAX_RETRIES, BACKOFF_BASE_S, BACKOFF_MAX_S, MAX_IN_FLIGHT, _SEMAPHORE, _BREAKER
+    TIMEOUT_S = float(timeout_s) if timeout_s is not None else TIMEOUT_S
+    MAX_RETRIES = int(max_retries) if max_retries is not None else MAX_RETRIES
+    BACKOFF_BASE_S = float(backoff_base_s) if backoff_base_s is not None else BACKOFF_BASE_S
+    BACKOFF_MAX_S = float(backoff_max_s) if backoff_max_s is not None else BACKOFF_MAX_S
+    if max_in_flight is not None:
+        MAX_IN_FLIGHT = int(max_in_flight)
+        _SEMAPHORE = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+    if breaker_failures is not None or breaker_recovery_s is not None:
+        _BREAKER = CircuitBreaker(
+            failure_threshold=int(breaker_failures or _BREAKER.failure_threshold),
+            recovery_s=float(breaker_recovery_s if breaker_recovery_s is not None else _BREAKER.recovery_s),
+        )
+
+
+def circuit_state() -> str:
+    return _BREAKER.state
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Timeouts, connection problems, throttling and 5xx responses are worth retrying."""
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(exc, "status", None) or getattr(exc, "status_code", None)
+    if status in RETRYABLE_STATUS:
+        return True
+    name = type(exc).__name__.lower()
+    return "timeout" in name or "connection" in name
+
+
+def _retrying(on_retry=None):
+    def _before_sleep(state):
+        if on_retry:
+            on_retry(state.outcome.exception())
+    return Retrying(
+        stop=stop_after_attempt(MAX_RETRIES + 1),
+        wait=wait_random_exponential(multiplier=BACKOFF_BASE_S, max=BACKOFF_MAX_S),
+        retry=retry_if_exception(is_retryable),
+        before_sleep=_before_sleep,
+        reraise=True,
+    )
+
+
+def _acquire_slot(semaphore, deadline: float):
+    if not semaphore.acquire(timeout=max(deadline - time.monotonic(), 0)):
+        raise LLMTimeoutError("No free LLM call slot before the deadline.")
+
+
+def _invoke_once(model, text):
+    semaphore = _SEMAPHORE
+    deadline = time.monotonic() + TIMEOUT_S
+    _acquire_slot(semaphore, deadline)
+    # The slot is released when the call really finishes, even if we stop waiting for it
+    future = _EXECUTOR.submit(model.invoke, text)
+    future.add_done_callback(lambda _f: semaphore.release())
+    try:
+        return future.result(timeout=max(deadline - time.monotonic(), 0))
+    except FutureTimeout:
+        raise LLMTimeoutError(f"LLM call exceeded {TIMEOUT_S:g}s deadline.")
+
+
+def resilient_invoke(model, text, on_retry=None):
+    """model.invoke(text) with a per-attempt deadline, jittered retries, the process-wide slot limit and the breaker."""
+    if not _BREAKER.allow():
+        raise CircuitOpenError("LLM circuit is open after repeated failures.")
+    try:
+        result = _retrying(on_retry)(_invoke_once, model, text)
+    except Exception:
+        _BREAKER.record_failure()
+        raise
+    _BREAKER.record_success()
+    return result
+
+
+def _open_stream(model, text):
+    """Starts model.stream(text) on a worker; returns (queue, first_item) once the first chunk arrives."""
+    semaphore = _SEMAPHORE
+    deadline = time.monotonic() + TIMEOUT_S
+    _acquire_slot(semaphore, deadline)
+    q = queue.Queue()
+    done = object()
+
+    def _pump():
+        try:
+            for chunk in model.stream(text):
+                q.put(("chunk", chunk))
+            q.put(("end", done))
+        except Exception as e:
+            q.put(("error", e))
+        finally:
+            semaphore.release()
+
+    _EXECUTOR.submit(_pump)
+    try:
+        first = q.get(timeout=max(deadline - time.monotonic(), 0))
+    except queue.Empty:
+        raise LLMTimeoutError(f"No first token within {TIMEOUT_S:g}s.")
+    if first[0] == "error":
+        raise first[1]
+    return q, first
+
+
+def resilient_stream(model, text, on_retry=None):
+    """
+    Streams model output. Deadline and retries apply until the first chunk; after that each
+    chunk must arrive within the deadline. Shares the slot limit and breaker with resilient_invoke.
+    """
+    if not _BREAKER.allow():
+        raise CircuitOpenError("LLM circuit is open after repeated failures.")
+    try:
+        q, item = _retrying(on_retry)(_open_stream, model, text)
+    except Exception:
+        _BREAKER.record_failure()
+        raise
+    while True:
+        kind, payload = item
+        if kind == "end":
+            _BREAKER.record_success()
+            return
+        if kind == "error":
+            _BREAKER.record_failure()
+            raise payload
+        try:
+            yield payload
+        except GeneratorExit:
+            # Consumer stopped early; the model was answering, so don't leave a half-open trial hanging
+            _BREAKER.record_success()
+            raise
+        try:
+            item = q.get(timeout=TIMEOUT_S)
+        except queue.Empty:
+            _BREAKER.record_failure()
+            raise LLMTimeoutError(f"LLM stream stalled for more than {TIMEOUT_S:g}s.")
@@ -0,0 +1,161 @@
+import threading
+import time
+import numpy as np
+import pandas as pd
+from functions.data_loader import as_of_date
+from functions.fx_rates import rates_for
+
+# === CONFIG ===
+HIERARCHY = ["LEGAL_ENTITY_CODE", "ORG_UNIT_CODE", "BRANCH_CODE"]     # drill path
+CUBE_DIMENSIONS = HIERARCHY + ["ISO_CURRENCY_CD", "PRODUCT_CODE"]
+MEASURES = ["ROWS", "BALANCE", "ABS_BALANCE", "RATE_X_BALANCE", "NET_TP_AMOUNT"]   # all additive
+AMOUNT_MEASURES = ["BALANCE", "ABS_BALANCE", "RATE_X_BALANCE", "NET_TP_AMOUNT"]      # scaled by FX rates
+MISSING = "(blank)"
+
+_CUBES = {}                      # source key (e.g. file path) -> PnlCube
+_CUBES_LOCK = threading.Lock()
+
+
+def _project(df: pd.DataFrame) -> pd.DataFrame:
+    """Cube dimensions as strings plus per-row measure contributions and a content hash per row."""
+    rows = pd.DataFrame(index=pd.RangeIndex(len(df)))
+    for col in CUBE_DIMENSIONS:
+        values = df[col] if col in df else pd.Series(np.nan, index=df.index)
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+        labels = pd.Index(uniques.astype(str)).str.strip().where(pd.notna(uniques), MISSING)
+        rows[col] = np.asarray(labels)[codes]
+    num = lambda col: pd.to_numeric(df[col], errors="coerce").fillna(0.0).to_numpy(dtype=float) if col in df \
+        else np.zeros(len(df))
+    balance = num("AVG_BOOK_BAL_LCY")
+    rows["ROWS"] = 1
+    rows["BALANCE"] = balance
+    rows["ABS_BALANCE"] = np.abs(balance)
+    rows["RATE_X_BALANCE"] = np.abs(balance) * num("TRANSFER_RATE")
+    rows["NET_TP_AMOUNT"] = num("NET_TP_AMOUNT")
+    # Identical rows are told apart by their occurrence number, so the diff works as a multiset difference
+    hashes = pd.util.hash_pandas_object(rows[CUBE_DIMENSIONS + MEASURES[1:]], index=False).to_numpy()
+    occurrence = pd.Series(hashes).groupby(hashes, sort=False).cumcount().to_numpy(dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        rows["ROW_KEY"] = hashes + occurrence * np.uint64(0x9E3779B97F4A7C15)
+    return rows
+
+
+def _aggregate(rows: pd.DataFrame) -> pd.DataFrame:
+    return rows.groupby(CUBE_DIMENSIONS, sort=False)[MEASURES].sum()
+
+
+def with_rates(frame: pd.DataFrame) -> pd.DataFrame:
+    """Adds WTD_TRANSFER_RATE (|balance|-weighted TRANSFER_RATE) to an aggregate of MEASURES."""
+    frame = frame.copy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frame["WTD_TRANSFER_RATE"] = np.where(frame["ABS_BALANCE"] > 0, frame["RATE_X_BALANCE"] / frame["ABS_BALANCE"], np.nan)
+    return frame
+
+
+class PnlCube:
+    """
+    Balances, NET_TP_AMOUNT and balance-weighted transfer rates pre-aggregated over CUBE_DIMENSIONS.
+    Built with one groupby; a new snapshot is applied as a row-hash diff against the previous one,
+    so only added, removed or changed rows are aggregated. Roll-ups and drill-downs run on the cube.
+    """
+
+    def __init__(self, df: pd.DataFrame = None, snapshot_key=None):
+        self.cells = pd.DataFrame(columns=MEASURES, index=pd.MultiIndex.from_tuples([], names=CUBE_DIMENSIONS))
+        self.rows = _project(pd.DataFrame())
+        self.snapshot_key = None
+        self.as_of = None
+        self.last_update = {}
+        if df is not None:
+            self.build(df, snapshot_key)
+
+    def build(self, df: pd.DataFrame, snapshot_key=None):
+        t0 = time.perf_counter()
+        self.rows = _project(df)
+        self.cells = _aggregate(self.rows)
+        self.snapshot_key = snapshot_key
+        self.as_of = as_of_date(df)
+        self.last_update = {"mode": "build", "rows": len(df), "added": len(df), "removed": 0,
+                            "seconds": round(time.perf_counter() - t0, 4)}
+        return self
+
+    def update(self, df: pd.DataFrame, snapshot_key=None):
+        """
+        Moves the cube to a new snapshot. Rows whose content hash disappeared are subtracted, new ones
+        added (a changed row is both); cells that end up with no rows are dropped.
+        """
+        t0 = time.perf_counter()
+        new_rows = _project(df)
+        old_keys = pd.Index(self.rows["ROW_KEY"])
+        new_keys = pd.Index(new_rows["ROW_KEY"])
+        removed = self.rows[~old_keys.isin(new_keys)]
+        added = new_rows[~new_keys.isin(old_keys)]
+
+        cells = self.cells
+        if len(removed):
+            cells = cells.sub(_aggregate(removed), fill_value=0)
+        if len(added):
+            cells = cells.add(_aggregate(added), fill_value=0)
+        self.cells = cells[cells["ROWS"] > 0]
+        self.rows = new_rows
+        self.snapshot_key = snapshot_key
+        self.as_of = as_of_date(df)
+        self.last_update = {"mode": "update", "rows": len(df), "added": len(added), "removed": len(removed),
+                            "seconds": round(time.perf_counter() - t0, 4)}
+        return self
+
+    # --- queries ---
+    def in_reporting_currency(self, cells: pd.DataFrame = None) -> pd.DataFrame:
+        """
+        Cells with amounts converted at the cube's as-of FX rates (one rate per distinct currency,
+        gathered by code). Currencies without a rate get NaN amounts.
+        """
+        cells = self.cells if cells is None else cells
+        codes, currencies = pd.factorize(cells.index.get_level_values("ISO_CURRENCY_CD"))
+        factors = rates_for(currencies, self.as_of)[codes]
+        return cells.assign(**{m: cells[m].to_numpy(dtype=float) * factors for m in AMOUNT_MEASURES})
+
+    def rollup(self, levels=None, filters: dict = None, reporting: bool = False) -> pd.DataFrame:
+        """
+        Measures summed to the given dimensions (the whole book when none), after restricting
+        dimensions to the values in filters, with WTD_TRANSFER_RATE. reporting=True converts amounts
+        to the reporting currency first (only the filtered cells).
+        """
+        cells = self.cells
+        for dim, value in (filters or {}).items():
+            cells = cells[cells.index.get_level_values(dim) == str(value)]
+        if reporting:
+            cells = self.in_reporting_currency(cells)
+        levels = list(levels or [])
+        if levels:
+            out = cells.groupby(level=levels, sort=True)[MEASURES].sum(min_count=1)
+        else:
+            out = cells[MEASURES].sum(min_count=1).to_frame("TOTAL").T
+        out["ROWS"] = out["ROWS"].astype(int)
+        return with_rates(out).drop(columns=["ABS_BALANCE", "RATE_X_BALANCE"]).reset_index()
+
+    def drill(self, path: dict = None, by=None, reporting: bool = False) -> pd.DataFrame:
+        """Next HIERARCHY level below path (e.g. {"LEGAL_ENTITY_CODE": "MB_CDAE"}), optionally split by more dimensions."""
+        path = path or {}
+        depth = next((i for i, level in enumerate(HIERARCHY) if level not in path), len(HIERARCHY))
+        levels = HIERARCHY[:depth + 1] if depth < len(HIERARCHY) else list(HIERARCHY)
+        return self.rollup(levels + [b for b in (by or []) if b not in levels], path, reporting)
+
+    def values(self, dim: str, filters: dict = None) -> list:
+        cells = self.cells
+        for d, value in (filters or {}).items():
+            cells = cells[cells.index.get_level_values(d) == str(value)]
+        return sorted(cells.index.get_level_values(dim).unique())
+
+
+def get_cube(source, df: pd.DataFrame, snapshot_key=None) -> PnlCube:
+    """
+    The cube for a source (e.g. a file path), moved to df when snapshot_key changed: incrementally
+    from the previous snapshot of that source, or built on first use.
+    """
+    with _CUBES_LOCK:
+        cube = _CUBES.get(source)
+        if cube is None:
+            cube = _CUBES[source] = PnlCube(df, snapshot_key)
+        elif cube.snapshot_key != snapshot_key:
+            cube.update(df, snapshot_key)
+        return cube
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# === CONFIG ===
+POLICY_JSON = os.path.join("functions", "ftp_policies.json")   # machine-checked rules
+POLICY_TEXT = os.path.join("functions", "ftp_policies.txt")    # textual guidance for the LLM
+POLL_INTERVAL_S = 2.0   # files are stat'ed at most this often
+
+
+def rule_key(rule: dict) -> str:
+    """Stable hash of one rule; changes when its column, condition or description does."""
+    canonical = json.dumps(rule, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def _stamp(path: str):
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+
+class PolicyRegistry:
+    """
+    Loads the policy files once and reloads them when their mtime/size changes (checked at most every
+    poll_interval_s, on access). Conditions are compiled once per distinct condition string; on reload only
+    new conditions are compiled and listeners are told which rule keys were added and removed.
+    """
+
+    def __init__(self, json_path: str = POLICY_JSON, text_path: str = POLICY_TEXT,
+                 poll_interval_s: float = POLL_INTERVAL_S):
+        self.json_path = json_path
+        self.text_path = text_path
+        self.poll_interval_s = poll_interval_s
+        self._lock = threading.RLock()
+        self._stamps = {}
+        self._checked_at = None
+        self._rules = []
+        self._keys = []
+        self._text = None
+        self._compiled = {}
+        self._listeners = []
+
+    # --- change detection ---
+    def refresh(self, force: bool = False) -> bool:
+        """Reloads changed files; returns True when the rules or guidance text changed."""
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._checked_at is not None and now - self._checked_at < self.poll_interval_s:
+                return False
+            self._checked_at = now
+            stamps = {p: _stamp(p) for p in (self.json_path, self.text_path)}
+            if not force and stamps == self._stamps:
+                return False
+            changed_json = force or stamps[self.json_path] != self._stamps.get(self.json_path, "unset")
+            self._stamps = stamps
+            if stamps[self.text_path] is not None:
+                with open(self.text_path, "r", encoding="utf-8") as f:
+                    self._text = f.read()
+            else:
+                self._text = None
+            if not changed_json:
+                return True
+            return self._reload_rules()
+
+    def _reload_rules(self) -> bool:
+        rules = []
+        if os.path.exists(self.json_path):
+            with open(self.json_path, "r", encoding="utf-8") as f:
+                rules = json.load(f)
+        rules = [r for r in rules if r.get("enabled", True)]    # "enabled": false ships a rule switched off
+        keys = [rule_key(r) for r in rules]
+        added, removed = set(keys) - set(self._keys), set(self._keys) - set(keys)
+        self._rules, self._keys = rules, keys
+        # Drop compiled conditions no rule uses any more; new ones compile lazily
+        live = {r.get("condition") for r in rules}
+        self._compiled = {c: code for c, code in self._compiled.items() if c in live}
+        if added or removed:
+            for listener in list(self._listeners):
+                listener(added, removed)
+        return True
+
+    def on_change(self, listener):
+        """listener(added_keys, removed_keys) runs after every reload that changed the rule set."""
+        with self._lock:
+            self._listeners.append(listener)
+
+    # --- accessors ---
+    def rules(self) -> list:
+        self.refresh()
+        with self._lock:
+            return [dict(r) for r in self._rules]
+
+    def rule_keys(self) -> list:
+        self.refresh()
+        with self._lock:
+            return list(self._keys)
+
+    def descriptions(self) -> set:
+        return {r["description"] for r in self.rules() if "description" in r}
+
+    def policy_text(self):
+        """Contents of the guidance text file, or None when it does not exist."""
+        self.refresh()
+        with self._lock:
+            return self._text
+
+    def compiled(self, condition: str):
+        """Code object for a condition; conditions that don't parse are returned as-is so eval reports the error."""
+        with self._lock:
+            code = self._compiled.get(condition)
+            if code is None:
+                try:
+                    code = compile(condition, "<rule>", "eval")
+                except SyntaxError:
+                    code = condition
+                self._compiled[condition] = code
+            return code
+
+
+_REGISTRIES = {}
+_REGISTRIES_LOCK = threading.Lock()
+
+
+def get_registry(json_path: str = POLICY_JSON, text_path: str = POLICY_TEXT) -> PolicyRegistry:
+    """One registry per policy file in this process."""
+    key = (os.path.abspath(json_path), os.path.abspath(text_path))
+    with _REGISTRIES_LOCK:
+        if key not in _REGISTRIES:
+            _REGISTRIES[key] = PolicyRegistry(json_path, text_path)
+        return _REGISTRIES[key]
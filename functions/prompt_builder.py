@@ -0,0 +1,170 @@
+import math
+import re
+import pandas as pd
+from functions.ftp_rules import load_rules, expand_row_context
+from functions.fx_rates import (
+    AMOUNT_COLUMNS, CONVERTED_SUFFIX, CURRENCY_COLUMN, converted_columns_in, converted_name,
+    wants_reporting_currency, with_converted,
+)
+
+# === CONFIG ===
+CHARS_PER_TOKEN = 4          # rough estimate; good enough for budgeting
+DEFAULT_TOKEN_BUDGET = 3000
+SEGMENT_COLUMNS = ["ISO_CURRENCY_CD", "PRODUCT_CODE", "ORG_UNIT_CODE", "BRANCH_CODE", "LEGAL_ENTITY_CODE"]
+CORE_COLUMNS = ["ACCOUNT_NUMBER_MASKED", "ISO_CURRENCY_CD", "PRODUCT_CODE"]
+TOP_SEGMENT_VALUES = 5
+# Words that say nothing about which column a question is about
+_GENERIC_WORDS = {"cd", "code", "codes", "date", "lcy", "masked", "rate", "type", "no", "s"}
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 chars per token) used to fit prompts into a budget."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def column_words(col: str) -> set:
+    """Meaningful lowercase words of a column name, e.g. TRANSFER_RATE -> {'transfer'}."""
+    return {w for w in re.split(r"[^a-z0-9]+", col.lower()) if w and w not in _GENERIC_WORDS}
+
+
+def select_prompt_columns(expanded: pd.DataFrame, question: str, rules: list = None) -> list:
+    """Columns worth sending: identifiers, the columns the violated rules test, and columns the question names."""
+    rules = load_rules() if rules is None else rules
+    q_words = set(re.split(r"[^a-z0-9]+", question.lower()))
+    present = set(expanded["description"].unique()) if "description" in expanded else set()
+
+    wanted = list(CORE_COLUMNS)
+    wanted += [r["column"] for r in rules if r.get("column") and r.get("description") in present]
+    for col in expanded.columns:
+        words = column_words(col)
+        if words and words <= q_words:
+            wanted.append(col)
+    return [c for c in dict.fromkeys(wanted) if c in expanded.columns and c != "description"]
+
+
+def add_reporting_amounts(expanded: pd.DataFrame, rows: pd.DataFrame, question: str) -> pd.DataFrame:
+    """
+    Reporting-currency versions of the amount columns being sent (all amount columns if none are), plus any
+    converted column the question names. Computed only for questions that ask for converted amounts.
+    """
+    if not wants_reporting_currency(question) or CURRENCY_COLUMN not in expanded:
+        return rows
+    amounts = [c for c in rows.columns if c in AMOUNT_COLUMNS] or [c for c in AMOUNT_COLUMNS if c in expanded]
+    names = [converted_name(c) for c in amounts]
+    names += [n for n in converted_columns_in(question) if n[:-len(CONVERTED_SUFFIX)] in expanded]
+    try:
+        converted = with_converted(expanded, names)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ FX conversion unavailable: {e}")
+        return rows
+    return rows.assign(**{n: converted[n] for n in dict.fromkeys(names)})
+
+
+def _policy_aggregates(expanded: pd.DataFrame, policy_ids: dict) -> str:
+    counts = expanded["description"].value_counts()
+    lines = ["Policy legend and aggregates (cover ALL violations):"]
+    for desc, n in counts.items():
+        accounts = ""
+        if "ACCOUNT_NUMBER_MASKED" in expanded:
+            n_acc = expanded.loc[expanded["description"] == desc, "ACCOUNT_NUMBER_MASKED"].nunique()
+            accounts = f", distinct accounts={n_acc}"
+        lines.append(f"{policy_ids[desc]}: {desc} | count={n}{accounts}")
+    return "\n".join(lines)
+
+
+def _segment_rollups(expanded: pd.DataFrame, policy_ids: dict) -> str:
+    lines = ["Per-segment rollups (cover ALL violations; top values per policy):"]
+    groups = dict(tuple(expanded.groupby("description", sort=False)))
+    for col in SEGMENT_COLUMNS:
+        if col not in expanded:
+            continue
+        for desc in policy_ids:
+            grp = groups[desc]
+            vc = grp[col].astype(str).value_counts()
+            top = ", ".join(f"{k}={v}" for k, v in vc.head(TOP_SEGMENT_VALUES).items())
+            more = f" (+{len(vc) - TOP_SEGMENT_VALUES} more values)" if len(vc) > TOP_SEGMENT_VALUES else ""
+            lines.append(f"{policy_ids[desc]} by {col}: {top}{more}")
+    return "\n".join(lines)
+
+
+def _stratified_order(expanded: pd.DataFrame) -> pd.Index:
+    """Row order that round-robins across policies, each policy listing its most diverse rows first."""
+    segs = [c for c in SEGMENT_COLUMNS if c in expanded]
+    per_policy = []
+    for _, grp in expanded.groupby("description", sort=False):
+        if segs:
+            first = grp.drop_duplicates(subset=segs)
+            ordered = first.index.append(grp.index.difference(first.index, sort=False))
+        else:
+            ordered = grp.index
+        per_policy.append(list(ordered))
+    order = []
+    for i in range(max((len(p) for p in per_policy), default=0)):
+        order.extend(p[i] for p in per_policy if i < len(p))
+    return pd.Index(order)
+
+
+def build_violations_payload(violations_df: pd.DataFrame, question: str, token_budget: int = None,
+                             max_rows: int = None, rules: list = None, relevant: pd.Index = None):
+    """
+    Compacts violations into a prompt section that fits token_budget.
+    Returns (payload_text, truncation_note). Aggregates always cover every row;
+    sample rows start with the `relevant` index labels (best first), then are added
+    round-robin per policy until the budget is used.
+    """
+    token_budget = token_budget or DEFAULT_TOKEN_BUDGET
+    expanded = expand_row_context(violations_df)
+    total = len(expanded)
+    policy_ids = {d: f"P{i + 1}" for i, d in enumerate(expanded["description"].value_counts().index)}
+
+    columns = select_prompt_columns(expanded, question, rules)
+    rows = add_reporting_amounts(expanded, expanded[columns].copy(), question)
+    columns = list(rows.columns)
+    rows.insert(0, "policy", expanded["description"].map(policy_ids))
+
+    header = _policy_aggregates(expanded, policy_ids)
+    rollups = _segment_rollups(expanded, policy_ids)
+
+    # Small sets go in whole (minus unneeded columns), without rollups
+    full_rows = rows.to_csv(index=False)
+    if (max_rows is None or max_rows >= total) and estimate_tokens(header + full_rows) <= token_budget:
+        note = f"NO — all {total} rows included (columns limited to: {', '.join(columns)})."
+        return f"{header}\n\nRows (CSV):\n{full_rows}", note
+
+    # Keep rollups only while they leave room for rows
+    sections = header
+    has_rollups = estimate_tokens(header + rollups) <= token_budget * 0.6
+    if has_rollups:
+        sections = f"{header}\n\n{rollups}"
+
+    sample_header = rows.head(0).to_csv(index=False)
+    lines_budget = token_budget - estimate_tokens(sections) - estimate_tokens(sample_header) - 40
+    # Every row costs at least one token, so never serialize more rows than the budget allows
+    order = _stratified_order(expanded)
+    if relevant is not None and len(relevant):
+        relevant = relevant[relevant.isin(expanded.index)]
+        order = relevant.append(order[~order.isin(relevant)])
+    order = order[:max(lines_budget, 0)]
+    if max_rows is not None:
+        order = order[:max_rows]
+    sample_lines = []
+    used = 0
+    for line in rows.loc[order].to_csv(index=False, header=False).splitlines():
+        cost = estimate_tokens(line) + 1
+        if used + cost > lines_budget:
+            break
+        sample_lines.append(line)
+        used += cost
+
+    shown = len(sample_lines)
+    n_relevant = min(shown, len(relevant)) if relevant is not None else 0
+    sample_label = "stratified by policy"
+    if n_relevant:
+        sample_label = f"first {n_relevant} most relevant to the question, then stratified by policy"
+    payload = f"{sections}\n\nSample rows (CSV, {sample_label}):\n{sample_header}" + "\n".join(sample_lines)
+    limit = f"max_violations={max_rows}" if max_rows is not None and max_rows < total else f"a ~{token_budget}-token budget"
+    covered = "policy counts and segment rollups" if has_rollups else "policy counts"
+    note = (f"YES — sample shows {shown} of {total} rows (limited by {limit}); "
+            f"{covered} above cover all {total} rows. "
+            f"Columns limited to: {', '.join(columns)}.")
+    return payload, note
@@ -0,0 +1,306 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from functions.ftp_pricing import normalised_codes, term_components
+from functions.ftp_rules import _make_row_context
+
+# === CONFIG ===
+CATEGORICAL_FEATURES = ["PRODUCT_CODE", "BEHAVIOUR_TYPE_CD", "ADJUSTABLE_TYPE", "AMORTIZATION_TYPE", "ISO_CURRENCY_CD"]
+NUMERIC_FEATURES = ["LOG_ORIGINAL_TERM", "LOG_REMAINING_TERM", "LOG_REPRICE_TERM", "HAS_REPRICE", "NO_ORIGINAL_TERM"]
+TARGETS = ("TRANSFER_RATE", "NET_TP_RATE")
+RIDGE_ALPHA = 1.0               # L2 penalty on every coefficient except the intercept
+FIT_CHUNK_ROWS = 32_768         # rows expanded to a dense design block at a time
+FEATURE_CACHE_SIZE = 8          # books whose encoded features are kept in memory
+MODEL_DIR = os.path.join("output", "models")
+RESIDUAL_BPS = 100.0            # |actual - predicted| above this is reported as an anomaly
+
+_FEATURES = OrderedDict()       # data key -> encoded features
+_FEATURES_LOCK = threading.Lock()
+
+
+def frame_fingerprint(df: pd.DataFrame) -> str:
+    """Content hash of the columns the features are built from."""
+    used = [c for c in CATEGORICAL_FEATURES + ["AS_OF_DATE", "ORIGINATION_DATE", "MATURITY_DATE",
+            "NEXT_REPRICE_DATE", "REPRICE_FREQ", "REPRICE_FREQ_MULT"] if c in df]
+    hashed = pd.util.hash_pandas_object(df[used], index=False).to_numpy()
+    return hashlib.sha256(hashed.tobytes()).hexdigest()
+
+
+def snapshot_id(key) -> str:
+    """Canonical string for a snapshot key: tuples and lists (as after a JSON round-trip) give the same id."""
+    if isinstance(key, str) and len(key) == 64 and all(c in "0123456789abcdef" for c in key):
+        return key
+    return hashlib.sha256(json.dumps(key, default=str, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def training_snapshot(df: pd.DataFrame, target: str) -> str:
+    """Snapshot id from the book's content: the feature columns and the target values."""
+    y = pd.to_numeric(df[target], errors="coerce").to_numpy(dtype=float)
+    return snapshot_id([frame_fingerprint(df), target, hashlib.sha256(y.tobytes()).hexdigest()])
+
+
+# --- features ---
+def build_features(df: pd.DataFrame, data_key=None, cache: bool = True) -> dict:
+    """
+    Model inputs for a book, independent of any model: factorised categorical columns
+    ({column: (codes, values as strings)}) and the numeric term features. Cached per data key
+    (the frame's content fingerprint when none is given), so retraining and scoring the same book
+    don't rebuild them. cache=False skips the fingerprint and the cache, e.g. for one-off scoring chunks.
+    """
+    key = data_key if data_key is not None or not cache else frame_fingerprint(df)
+    with _FEATURES_LOCK:
+        if cache and key in _FEATURES:
+            _FEATURES.move_to_end(key)
+            return _FEATURES[key]
+
+    categorical = {}
+    for col in CATEGORICAL_FEATURES:
+        # Missing values become their own "NAN" category
+        codes, names = normalised_codes(df[col] if col in df else pd.Series("", index=df.index))
+        categorical[col] = (codes.astype(np.int32), names)
+    terms = term_components(df)
+    original, remaining, reprice = terms["original"], terms["remaining"], terms["reprice"]
+    numeric = np.column_stack([
+        np.log1p(np.nan_to_num(original)),
+        np.log1p(np.nan_to_num(remaining)),
+        np.log1p(np.nan_to_num(reprice)),
+        ~np.isnan(reprice),
+        np.isnan(original),
+    ]).astype(float)
+    features = {"key": key, "n_rows": len(df), "categorical": categorical, "numeric": numeric}
+
+    if not cache:
+        return features
+    with _FEATURES_LOCK:
+        _FEATURES[key] = features
+        while len(_FEATURES) > FEATURE_CACHE_SIZE:
+            _FEATURES.popitem(last=False)
+    return features
+
+
+# --- model ---
+class RateModel:
+    """
+    Ridge regression of one rate column on one-hot categorical codes and term features, fitted from
+    accumulated normal equations (XᵀX, Xᵀy). New snapshots only add their own XᵀX/Xᵀy, so retraining
+    costs one pass over the new rows; categories first seen in a later snapshot get new coefficients.
+    """
+
+    def __init__(self, target: str = "TRANSFER_RATE", alpha: float = RIDGE_ALPHA):
+        if target not in TARGETS:
+            raise ValueError(f"Unknown target '{target}'; expected one of {', '.join(TARGETS)}.")
+        self.target = target
+        self.alpha = alpha
+        self.vocab = {col: pd.Index([], dtype=object) for col in CATEGORICAL_FEATURES}
+        self.xtx = np.zeros((self.n_features, self.n_features))
+        self.xty = np.zeros(self.n_features)
+        self.n_rows = 0
+        self.snapshots = []          # data keys already folded in
+        self.coef = np.zeros(self.n_features)
+
+    # --- layout ---
+    @property
+    def n_features(self) -> int:
+        return 1 + sum(len(v) for v in self.vocab.values()) + len(NUMERIC_FEATURES)
+
+    def feature_names(self) -> list:
+        names = ["INTERCEPT"]
+        for col, values in self.vocab.items():
+            names += [f"{col}={v}" for v in values]
+        return names + NUMERIC_FEATURES
+
+    def _grow_vocab(self, features: dict):
+        """Adds unseen categories; existing coefficients keep their positions within each block."""
+        old_n = self.n_features
+        old_slices = self._slices()
+        for col, (_codes, uniques) in features["categorical"].items():
+            new = uniques.difference(self.vocab[col], sort=False)
+            if len(new):
+                self.vocab[col] = self.vocab[col].append(new)
+        if self.n_features == old_n:
+            return
+        # Scatter the old normal equations into the new layout; new categories start with zero rows/columns
+        new_slices = self._slices()
+        mapping = np.concatenate([np.arange(new_slices[name].start, new_slices[name].start + (s.stop - s.start))
+                                  for name, s in old_slices.items()])
+        xtx = np.zeros((self.n_features, self.n_features))
+        xty = np.zeros(self.n_features)
+        coef = np.zeros(self.n_features)
+        xtx[np.ix_(mapping, mapping)] = self.xtx
+        xty[mapping] = self.xty
+        coef[mapping] = self.coef
+        self.xtx, self.xty, self.coef = xtx, xty, coef
+
+    def _slices(self) -> dict:
+        slices, start = {"INTERCEPT": slice(0, 1)}, 1
+        for col, values in self.vocab.items():
+            slices[col] = slice(start, start + len(values))
+            start += len(values)
+        slices["NUMERIC"] = slice(start, start + len(NUMERIC_FEATURES))
+        return slices
+
+    def _columns(self, features: dict) -> dict:
+        """Column in the design matrix of every row's category (-1 for categories the model hasn't seen)."""
+        slices = self._slices()
+        columns = {}
+        for col, (codes, uniques) in features["categorical"].items():
+            position = self.vocab[col].get_indexer(uniques)
+            mapped = np.where(position >= 0, position + slices[col].start, -1)
+            columns[col] = np.where(codes >= 0, mapped[codes], -1)
+        return columns
+
+    def _design(self, columns: dict, numeric: np.ndarray, rows: slice) -> np.ndarray:
+        block = np.zeros((len(numeric[rows]), self.n_features))
+        block[:, 0] = 1.0
+        index = np.arange(block.shape[0])
+        for cols in columns.values():
+            c = cols[rows]
+            seen = c >= 0
+            block[index[seen], c[seen]] = 1.0
+        block[:, self._slices()["NUMERIC"]] = numeric[rows]
+        return block
+
+    # --- training ---
+    def partial_fit(self, features: dict, y: np.ndarray, decay: float = 1.0, snapshot=None):
+        """
+        Folds one snapshot into the normal equations and re-solves. Rows with a missing target are
+        skipped; a snapshot whose data key was already folded in is ignored. decay < 1 down-weights
+        what was learnt from earlier snapshots. snapshot identifies the data (default: the features' key).
+        """
+        snapshot = snapshot_id(features["key"] if snapshot is None else snapshot)
+        if snapshot in self.snapshots:
+            return self
+        self._grow_vocab(features)
+        y = np.asarray(y, dtype=float)
+        keep = ~np.isnan(y)
+        columns = {col: c[keep] for col, c in self._columns(features).items()}
+        numeric, y = features["numeric"][keep], y[keep]
+        self.xtx *= decay
+        self.xty *= decay
+        for start in range(0, len(y), FIT_CHUNK_ROWS):
+            rows = slice(start, start + FIT_CHUNK_ROWS)
+            block = self._design(columns, numeric, rows)
+            self.xtx += block.T @ block
+            self.xty += block.T @ y[rows]
+        self.n_rows += len(y)
+        self.snapshots.append(snapshot)
+        self._solve()
+        return self
+
+    def _solve(self):
+        penalty = np.full(self.n_features, self.alpha)
+        penalty[0] = 0.0
+        self.coef = np.linalg.solve(self.xtx + np.diag(penalty) + 1e-9 * np.eye(self.n_features), self.xty)
+
+    # --- prediction ---
+    def predict(self, features: dict) -> np.ndarray:
+        """Sum of looked-up category coefficients plus the numeric terms; no dense design matrix."""
+        columns = self._columns(features)
+        coef = np.append(self.coef, 0.0)           # index -1 (unseen category) contributes nothing
+        pred = np.full(features["n_rows"], self.coef[0])
+        for cols in columns.values():
+            pred += coef[cols]
+        return pred + features["numeric"] @ self.coef[self._slices()["NUMERIC"]]
+
+    # --- persistence ---
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        meta = {"target": self.target, "alpha": self.alpha, "n_rows": self.n_rows, "snapshots": self.snapshots,
+                "vocab": {col: [str(v) for v in values] for col, values in self.vocab.items()}}
+        with open(path, "wb") as f:
+            np.savez(f, xtx=self.xtx, xty=self.xty, coef=self.coef, meta=np.array(json.dumps(meta)))
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            model = cls(meta["target"], meta["alpha"])
+            model.vocab = {col: pd.Index(values, dtype=object) for col, values in meta["vocab"].items()}
+            model.n_rows, model.snapshots = meta["n_rows"], [snapshot_id(k) for k in meta["snapshots"]]
+            model.xtx, model.xty, model.coef = data["xtx"], data["xty"], data["coef"]
+        return model
+
+
+def model_path(target: str = "TRANSFER_RATE") -> str:
+    return os.path.join(MODEL_DIR, f"{target.lower()}.npz")
+
+
+def _metrics(actual: np.ndarray, predicted: np.ndarray) -> dict:
+    keep = ~np.isnan(actual)
+    err = actual[keep] - predicted[keep]
+    if not len(err):
+        return {"rmse": np.nan, "mae": np.nan, "r2": np.nan}
+    ss_tot = float(((actual[keep] - actual[keep].mean()) ** 2).sum())
+    return {
+        "rmse": float(np.sqrt((err ** 2).mean())),
+        "mae": float(np.abs(err).mean()),
+        "r2": 1 - float((err ** 2).sum()) / ss_tot if ss_tot else np.nan,
+    }
+
+
+def train_rate_model(df: pd.DataFrame, target: str = "TRANSFER_RATE", model: RateModel = None, data_key=None,
+                     holdout: float = 0.2, alpha: float = RIDGE_ALPHA, decay: float = 1.0, seed: int = 0):
+    """
+    Trains a new model (or retrains model on this snapshot) and reports timings and fit quality.
+    A random holdout share of rows is kept out of training and used for the reported error, unless
+    holdout is 0. A book whose content the model was already trained on is not folded in again,
+    whatever the holdout or seed. Returns (model, report).
+    """
+    t0 = time.perf_counter()
+    features = build_features(df, data_key)
+    t_features = time.perf_counter() - t0
+
+    y = pd.to_numeric(df[target], errors="coerce").to_numpy(dtype=float)
+    test = np.random.default_rng(seed).random(len(df)) < holdout if holdout else np.zeros(len(df), dtype=bool)
+    y_train = np.where(test, np.nan, y)
+    model = model or RateModel(target, alpha)
+    if model.target != target:
+        raise ValueError(f"Model predicts {model.target}, not {target}.")
+    snapshot = training_snapshot(df, target)
+    already_trained = snapshot in model.snapshots
+
+    t1 = time.perf_counter()
+    model.partial_fit(features, y_train, decay, snapshot=snapshot)
+    t_fit = time.perf_counter() - t1
+    predicted = model.predict(features)
+    rows = int((~np.isnan(y_train)).sum())
+    report = {
+        "target": target,
+        "rows": len(df),
+        "train_rows": rows,
+        "holdout_rows": int(test.sum()),
+        "model_rows": model.n_rows,
+        "snapshots": len(model.snapshots),
+        "already_trained": already_trained,
+        "features": model.n_features,
+        "feature_seconds": round(t_features, 4),
+        "fit_seconds": round(t_fit, 4),
+        "rows_per_second": round(rows / t_fit) if t_fit > 0 else None,
+        "train": _metrics(y_train, predicted),
+        "holdout": _metrics(np.where(test, y, np.nan), predicted) if test.any() else None,
+    }
+    return model, report
+
+
+def residual_anomalies(df: pd.DataFrame, model: RateModel, data_key=None, threshold_bps: float = RESIDUAL_BPS) -> pd.DataFrame:
+    """
+    Rows whose rate is more than threshold_bps away from the model, in the violations format
+    (description, row_context) so they can join the policy violation list.
+    """
+    predicted = model.predict(build_features(df, data_key))
+    actual = pd.to_numeric(df[model.target], errors="coerce").to_numpy(dtype=float)
+    residual_bps = (actual - predicted) * 100
+    positions = np.flatnonzero(np.abs(residual_bps) > threshold_bps)
+    description = f"{model.target} deviates from the rate model by more than {threshold_bps:g} bps"
+    rows = []
+    for pos in positions[np.argsort(-np.abs(residual_bps[positions]), kind="stable")]:
+        context = _make_row_context(df.iloc[pos])
+        context["MODEL_RATE"] = round(float(predicted[pos]), 6)
+        context["RESIDUAL_BPS"] = round(float(residual_bps[pos]), 2)
+        rows.append({"description": description, "row_context": json.dumps(context, ensure_ascii=False)})
+    return pd.DataFrame(rows, columns=["description", "row_context"])
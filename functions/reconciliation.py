@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+from functions.data_loader import as_of_date
+from functions.ftp_pricing import normalised_codes
+
+# === CONFIG ===
+RULE_TYPE = "reconciliation"          # "type" of reconciliation rules in ftp_policies.json
+# Day-count denominator by "ENTITY/CCY", "ENTITY" or "CCY" (most specific key wins), else "default"
+DAY_COUNT_BASIS = {"default": 360, "GBP": 365, "HKD": 365, "SGD": 365, "INR": 365, "ZAR": 365, "INVICTUS": 365}
+TOLERANCE_BPS = 0.01                  # net_tp_rate: allowed |difference| in basis points
+AMOUNT_ABS_TOLERANCE = 1.0            # net_tp_amount: allowed |difference| in LCY ...
+AMOUNT_REL_TOLERANCE = 0.005          # ... or as a share of the expected amount, whichever is larger
+ROLLUP_COLUMNS = ["ORG_UNIT_CODE", "LEGAL_ENTITY_CODE"]
+
+
+def _num(df: pd.DataFrame, col: str, fill=None) -> np.ndarray:
+    values = pd.to_numeric(df[col], errors="coerce")
+    return (values.fillna(fill) if fill is not None else values).to_numpy(dtype=float)
+
+
+def day_count_basis(df: pd.DataFrame, basis: dict = None) -> np.ndarray:
+    """
+    Day-count denominator per row: the basis for LEGAL_ENTITY_CODE/ISO_CURRENCY_CD, else for the entity,
+    else for the currency, else the default (ACT/360). Looked up once per distinct entity × currency pair.
+    """
+    basis = {str(k).strip().upper(): v for k, v in {**DAY_COUNT_BASIS, **(basis or {})}.items()}
+    default = basis["DEFAULT"]
+    blank = (np.zeros(len(df), dtype=np.intp), pd.Index([""]))
+    entity_codes, entities = normalised_codes(df["LEGAL_ENTITY_CODE"]) if "LEGAL_ENTITY_CODE" in df else blank
+    currency_codes, currencies = normalised_codes(df["ISO_CURRENCY_CD"]) if "ISO_CURRENCY_CD" in df else blank
+    pairs = entity_codes * len(currencies) + currency_codes
+    pair_codes, distinct = pd.factorize(pairs)
+    values = []
+    for pair in distinct:
+        entity, currency = entities[pair // len(currencies)], currencies[pair % len(currencies)]
+        keys = (f"{entity}/{currency}", entity, currency)
+        values.append(next((basis[k] for k in keys if k in basis), default))
+    return np.array(values, dtype=float)[pair_codes]
+
+
+def accrual_days(df: pd.DataFrame, rule: dict) -> np.ndarray:
+    """Days accrued in the period: rule["accrual_days"] if numeric, else the days in the as-of month."""
+    days = rule.get("accrual_days", "month")
+    if days != "month":
+        return np.full(len(df), float(days))
+    return np.full(len(df), float(pd.Timestamp(as_of_date(df)).days_in_month))
+
+
+# --- checks: (df, rule) -> (expected, actual, break mask) ---
+def check_net_tp_rate(df: pd.DataFrame, rule: dict):
+    """NET_TP_RATE = TRANSFER_RATE + LIQUIDITY_PREMIUM_RATE (missing components count as 0)."""
+    expected = _num(df, "TRANSFER_RATE", 0.0) + _num(df, "LIQUIDITY_PREMIUM_RATE", 0.0)
+    actual = _num(df, "NET_TP_RATE")
+    tolerance = rule.get("tolerance_bps", TOLERANCE_BPS) / 100
+    return expected, actual, ~(np.abs(actual - expected) <= tolerance)
+
+
+def check_net_tp_amount(df: pd.DataFrame, rule: dict):
+    """NET_TP_AMOUNT = AVG_BOOK_BAL_LCY × NET_TP_RATE / 100 × accrual days / day-count basis."""
+    expected = (_num(df, "AVG_BOOK_BAL_LCY", 0.0) * _num(df, "NET_TP_RATE", 0.0) / 100
+                * accrual_days(df, rule) / day_count_basis(df, rule.get("day_count")))
+    actual = _num(df, "NET_TP_AMOUNT")
+    tolerance = np.maximum(rule.get("abs_tolerance", AMOUNT_ABS_TOLERANCE),
+                           rule.get("rel_tolerance", AMOUNT_REL_TOLERANCE) * np.abs(expected))
+    return expected, actual, ~(np.abs(actual - expected) <= tolerance)
+
+
+RECONCILIATION_CHECKS = {
+    "net_tp_rate": (check_net_tp_rate, ["NET_TP_RATE", "TRANSFER_RATE"]),
+    "net_tp_amount": (check_net_tp_amount, ["NET_TP_AMOUNT", "AVG_BOOK_BAL_LCY", "NET_TP_RATE"]),
+}
+
+
+def is_reconciliation(rule: dict) -> bool:
+    return rule.get("type") == RULE_TYPE
+
+
+def required_columns(rule: dict) -> list:
+    check = RECONCILIATION_CHECKS.get(rule.get("check"))
+    return check[1] if check else []
+
+
+def evaluate_reconciliation(df: pd.DataFrame, rule: dict):
+    """Vectorised counterpart of the row-wise rule evaluation: (violated mask, error mask, {position: message})."""
+    check = RECONCILIATION_CHECKS.get(rule.get("check"))
+    if check is None:
+        message = f"Error evaluating rule: unknown reconciliation check '{rule.get('check')}'"
+        return np.zeros(len(df), dtype=bool), np.ones(len(df), dtype=bool), dict.fromkeys(range(len(df)), message)
+    _expected, _actual, breaks = check[0](df, rule)
+    return breaks, np.zeros(len(df), dtype=bool), {}
+
+
+def reconciliation_breaks(df: pd.DataFrame, rules: list, key_columns=None) -> pd.DataFrame:
+    """
+    One row per break: Check, Policy, Expected, Actual, Difference and the rollup/key columns.
+    Unknown checks and rules whose columns are missing are skipped.
+    """
+    key_columns = [c for c in (key_columns or ROLLUP_COLUMNS + ["ACCOUNT_NUMBER_MASKED", "ISO_CURRENCY_CD"]) if c in df]
+    frames = []
+    for rule in rules:
+        check = RECONCILIATION_CHECKS.get(rule.get("check")) if is_reconciliation(rule) else None
+        if check is None or any(c not in df for c in check[1]):
+            continue
+        expected, actual, breaks = check[0](df, rule)
+        positions = np.flatnonzero(breaks)
+        frame = df.iloc[positions][key_columns].reset_index(drop=True)
+        frame.insert(0, "Check", rule["check"])
+        frame.insert(1, "Policy", rule.get("description", rule["check"]))
+        frame["Expected"] = expected[positions]
+        frame["Actual"] = actual[positions]
+        frame["Difference"] = actual[positions] - expected[positions]
+        frame.index = positions
+        frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=["Check", "Policy", *key_columns, "Expected", "Actual", "Difference"])
+    return pd.concat(frames)
+
+
+def reconciliation_summary(df: pd.DataFrame, rules: list, by=None) -> pd.DataFrame:
+    """
+    Breaks rolled up by ORG_UNIT_CODE / LEGAL_ENTITY_CODE per check: Rows, Breaks, Break rate,
+    Total |difference| and Max |difference|. Each check is one vectorised pass plus one bincount.
+    """
+    by = [c for c in (by or ROLLUP_COLUMNS) if c in df]
+    if by:
+        codes = df.groupby(by, dropna=False, sort=True).ngroup().to_numpy()
+        groups = df[by].drop_duplicates().sort_values(by).reset_index(drop=True)
+    else:
+        codes, groups = np.zeros(len(df), dtype=np.intp), pd.DataFrame(index=[0])
+    rows = np.bincount(codes, minlength=len(groups))
+    frames = []
+    for rule in rules:
+        check = RECONCILIATION_CHECKS.get(rule.get("check")) if is_reconciliation(rule) else None
+        if check is None or any(c not in df for c in check[1]):
+            continue
+        expected, actual, breaks = check[0](df, rule)
+        diff = np.where(breaks, np.abs(np.nan_to_num(actual) - expected), 0.0)
+        frame = groups.copy()
+        frame.insert(0, "Check", rule["check"])
+        frame["Rows"] = rows
+        frame["Breaks"] = np.bincount(codes, weights=breaks, minlength=len(groups)).astype(int)
+        frame["Break rate"] = (frame["Breaks"] / np.maximum(rows, 1)).round(4)
+        frame["Total |difference|"] = np.bincount(codes, weights=diff, minlength=len(groups))
+        max_diff = np.zeros(len(groups))
+        np.maximum.at(max_diff, codes, diff)
+        frame["Max |difference|"] = max_diff
+        frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=["Check", *by, "Rows", "Breaks", "Break rate", "Total |difference|", "Max |difference|"])
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,156 @@
+import io
+import pandas as pd
+from functions.ftp_rules import expand_row_context
+from functions.analytics_router import build_violation_cube, policy_counts
+
+# === CONFIG ===
+EXPORT_CHUNK_ROWS = 50_000      # violations expanded and written per chunk
+EXCEL_MAX_ROWS = 1_048_575      # data rows per sheet (the header takes one)
+EXPORT_FORMATS = {
+    "csv": ("csv", "text/csv"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+    "xlsx": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+REPORTS = ("violations", "policy_summary", "segment_summary")
+
+
+def iter_violation_chunks(violations_df: pd.DataFrame, chunk_rows: int = EXPORT_CHUNK_ROWS, expand: bool = True):
+    """
+    Yields the violations in slices of chunk_rows. With expand=True row_context is parsed into
+    columns one slice at a time; every chunk carries the first chunk's columns so writers see one schema.
+    """
+    columns = None
+    for start in range(0, len(violations_df), chunk_rows):
+        chunk = violations_df.iloc[start:start + chunk_rows]
+        if expand:
+            chunk = expand_row_context(chunk)
+            if columns is None:
+                columns = list(chunk.columns)
+            chunk = chunk.reindex(columns=columns)
+        yield chunk
+
+
+def _report_chunks(violations_df: pd.DataFrame, report: str, chunk_rows: int, expand: bool):
+    if report == "violations":
+        return iter_violation_chunks(violations_df, chunk_rows, expand)
+    if report == "policy_summary":
+        return iter([policy_counts(violations_df)])
+    if report == "segment_summary":
+        return iter([build_violation_cube(violations_df)])
+    raise ValueError(f"Unknown report '{report}'; expected one of {', '.join(REPORTS)}.")
+
+
+def iter_csv(chunks):
+    """Yields UTF-8 CSV text block by block (header with the first block)."""
+    for i, chunk in enumerate(chunks):
+        yield chunk.to_csv(index=False, header=i == 0).encode("utf-8")
+
+
+def write_csv(chunks, dest):
+    for block in iter_csv(chunks):
+        dest.write(block)
+
+
+def write_parquet(chunks, dest):
+    """
+    One row group per chunk through a single ParquetWriter; object columns are written as strings.
+    The schema comes from the first chunk and later chunks are cast to it: values that are not
+    numbers in a numeric column are written as nulls, with a warning.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = schema = None
+    try:
+        for chunk in chunks:
+            if schema is None:
+                fields = []
+                for col, dtype in chunk.dtypes.items():
+                    if pd.api.types.is_bool_dtype(dtype):
+                        fields.append(pa.field(str(col), pa.bool_()))
+                    elif pd.api.types.is_numeric_dtype(dtype):
+                        fields.append(pa.field(str(col), pa.float64()))  # ints with gaps in later chunks
+                    else:
+                        fields.append(pa.field(str(col), pa.string()))
+                schema = pa.schema(fields)
+                writer = pq.ParquetWriter(dest, schema)
+            frame = chunk.copy()
+            frame.columns = [str(c) for c in frame.columns]
+            for field in schema:
+                if field.name not in frame:
+                    frame[field.name] = None
+                values = frame[field.name]
+                if pa.types.is_string(field.type):
+                    frame[field.name] = values.astype(str).where(values.notna(), None)
+                elif pa.types.is_floating(field.type) and not pd.api.types.is_numeric_dtype(values):
+                    numeric = pd.to_numeric(values, errors="coerce")
+                    lost = int(numeric.isna().sum() - values.isna().sum())
+                    if lost:
+                        print(f"⚠️ Parquet export: {lost} non-numeric value(s) in '{field.name}' written as null.")
+                    frame[field.name] = numeric.astype(float)
+                elif pa.types.is_boolean(field.type) and not pd.api.types.is_bool_dtype(values):
+                    frame[field.name] = values.where(values.isin([True, False]), None).astype(object)
+            frame = frame[schema.names]
+            writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def write_excel(sheets: dict, dest):
+    """
+    sheets: name -> iterable of DataFrame chunks. Rows are streamed into a write-only workbook,
+    continuing on '<name> (2)', '<name> (3)', ... when a sheet reaches Excel's row limit.
+    """
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    for name, chunks in sheets.items():
+        ws, part, rows, header = None, 1, 0, None
+        for chunk in chunks:
+            if header is None:
+                header = [str(c) for c in chunk.columns]
+            # NaN -> empty cell; tolist() turns numpy scalars into Python values
+            values = chunk.astype(object).where(chunk.notna(), None).to_numpy().tolist()
+            for row in values:
+                if ws is None or rows >= EXCEL_MAX_ROWS:
+                    ws = wb.create_sheet(name if part == 1 else f"{name} ({part})")
+                    ws.append(header)
+                    part, rows = part + 1, 0
+                ws.append(row)
+                rows += 1
+        if ws is None:
+            wb.create_sheet(name).append(header or [])
+    wb.save(dest)
+
+
+def export_report(violations_df: pd.DataFrame, dest, fmt: str = "csv", report: str = "violations",
+                  chunk_rows: int = EXPORT_CHUNK_ROWS, expand: bool = True):
+    """
+    Writes one report (violations, policy_summary or segment_summary) to dest, a path or binary file object.
+    Excel exports always contain all three reports as sheets.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'; expected one of {', '.join(EXPORT_FORMATS)}.")
+    if fmt == "xlsx":
+        write_excel({
+            "Violations": iter_violation_chunks(violations_df, chunk_rows, expand),
+            "Per policy": [policy_counts(violations_df)],
+            "By segment": [build_violation_cube(violations_df)],
+        }, dest)
+        return
+    chunks = _report_chunks(violations_df, report, chunk_rows, expand)
+    if fmt == "parquet":
+        write_parquet(chunks, dest)
+    elif isinstance(dest, (str, bytes)) or hasattr(dest, "__fspath__"):
+        with open(dest, "wb") as f:
+            write_csv(chunks, f)
+    else:
+        write_csv(chunks, dest)
+
+
+def export_bytes(violations_df: pd.DataFrame, fmt: str = "csv", report: str = "violations", **kwargs) -> bytes:
+    """export_report into memory, e.g. for st.download_button."""
+    buf = io.BytesIO()
+    export_report(violations_df, buf, fmt, report, **kwargs)
+    return buf.getvalue()
@@ -0,0 +1,177 @@
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timezone
+import pandas as pd
+from functions.data_loader import as_of_date
+from functions.ftp_rules import expand_row_context
+
+# === CONFIG ===
+DEFAULT_STORE = os.path.join("output", "results.db")
+ACCOUNT_COLUMN = "ACCOUNT_NUMBER_MASKED"
+# Segment name -> violations column stored with every violation
+SEGMENT_COLUMNS = {
+    "currency": "ISO_CURRENCY_CD",
+    "product": "PRODUCT_CODE",
+    "branch": "BRANCH_CODE",
+    "org_unit": "ORG_UNIT_CODE",
+    "legal_entity": "LEGAL_ENTITY_CODE",
+}
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    run_id        INTEGER PRIMARY KEY,
+    input_sha256  TEXT NOT NULL,
+    rules_version TEXT NOT NULL,
+    as_of_date    TEXT NOT NULL,
+    source        TEXT,
+    rows          INTEGER,
+    violations    INTEGER,
+    created_at    TEXT NOT NULL,
+    UNIQUE (input_sha256, rules_version)
+);
+CREATE INDEX IF NOT EXISTS runs_as_of_source ON runs (as_of_date, source, run_id);
+CREATE TABLE IF NOT EXISTS violations (
+    run_id  INTEGER NOT NULL REFERENCES runs (run_id),
+    policy  TEXT NOT NULL,
+    account TEXT,
+    {", ".join(f"{name} TEXT" for name in SEGMENT_COLUMNS)}
+);
+CREATE INDEX IF NOT EXISTS violations_policy ON violations (policy, run_id);
+CREATE INDEX IF NOT EXISTS violations_account ON violations (account, policy, run_id);
+"""
+# One run per input and as-of date: the latest recorded (e.g. after a rules change). Different
+# books with the same as-of date each keep their run.
+_LATEST_RUNS_VIEW = """CREATE VIEW latest_runs AS
+    SELECT r.* FROM runs r
+    WHERE r.run_id = (SELECT MAX(run_id) FROM runs WHERE as_of_date = r.as_of_date AND source IS r.source)"""
+
+
+def connect(path: str = DEFAULT_STORE) -> sqlite3.Connection:
+    """Opens (and creates) the store; safe to call from several processes."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")  # readers don't block the writer
+    conn.executescript(_SCHEMA)
+    view = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'view' AND name = 'latest_runs'").fetchone()
+    if view is None or view[0] != _LATEST_RUNS_VIEW:
+        # Created here, or replaced in stores made when the view kept one run per as-of date
+        with conn:
+            conn.execute("DROP VIEW IF EXISTS latest_runs")
+            conn.execute(_LATEST_RUNS_VIEW)
+    return conn
+
+
+def source_key(path: str) -> str:
+    """
+    The source recorded for a book: its real absolute path, so the batch job, the API and relative or
+    symlinked spellings of one file share a key (latest_runs keeps one run per source and as-of date).
+    """
+    return os.path.realpath(path)
+
+
+def record_run(path: str, violations_df: pd.DataFrame, book_df: pd.DataFrame, input_sha256: str,
+               rules_ver: str, source: str = None) -> int:
+    """
+    Appends one detection run and its violations; returns the run_id. source should come from source_key().
+    Runs are never updated: recording the same contents and rules version again returns the existing run.
+    """
+    expanded = expand_row_context(violations_df)
+    records = pd.DataFrame({
+        "policy": expanded["description"],
+        "account": expanded.get(ACCOUNT_COLUMN),
+        **{name: expanded.get(col) for name, col in SEGMENT_COLUMNS.items()},
+    })
+    # Codes are stored as text so '101' from one workbook matches 101 from another
+    records = records.astype(str).where(records.notna(), None)
+
+    with closing(connect(path)) as conn, conn:
+        existing = conn.execute(
+            "SELECT run_id FROM runs WHERE input_sha256 = ? AND rules_version = ?", (input_sha256, rules_ver)
+        ).fetchone()
+        if existing:
+            return existing[0]
+        cur = conn.execute(
+            "INSERT INTO runs (input_sha256, rules_version, as_of_date, source, rows, violations, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (input_sha256, rules_ver, as_of_date(book_df), source,
+             None if book_df is None else len(book_df), len(violations_df),
+             datetime.now(timezone.utc).isoformat()),
+        )
+        run_id = cur.lastrowid
+        columns = ["policy", "account", *SEGMENT_COLUMNS]
+        conn.executemany(
+            f"INSERT INTO violations (run_id, {', '.join(columns)}) VALUES (?, {', '.join('?' * len(columns))})",
+            ((run_id, *row) for row in records[columns].itertuples(index=False, name=None)),
+        )
+    return run_id
+
+
+def has_run(path: str, input_sha256: str, rules_ver: str) -> bool:
+    """True when the store already holds a run for these contents and rules version."""
+    if not os.path.exists(path):
+        return False
+    with closing(connect(path)) as conn:
+        return conn.execute(
+            "SELECT 1 FROM runs WHERE input_sha256 = ? AND rules_version = ?", (input_sha256, rules_ver)
+        ).fetchone() is not None
+
+
+def list_runs(path: str = DEFAULT_STORE) -> pd.DataFrame:
+    with closing(connect(path)) as conn:
+        return pd.read_sql_query("SELECT * FROM runs ORDER BY as_of_date, run_id", conn)
+
+
+def policy_trend(path: str = DEFAULT_STORE, policy: str = None, segment: str = None) -> pd.DataFrame:
+    """
+    Violation counts per as-of date and policy (optionally also per segment, e.g. 'currency'),
+    summed over the latest run of each input for that date. policy matches descriptions containing it, e.g. 'TRANSFER_RATE'.
+    """
+    if segment is not None and segment not in SEGMENT_COLUMNS:
+        raise ValueError(f"Unknown segment '{segment}'; expected one of {', '.join(SEGMENT_COLUMNS)}.")
+    group = ["r.as_of_date", "v.policy"] + ([f"v.{segment}"] if segment else [])
+    where, params = "", []
+    if policy:
+        where, params = "WHERE v.policy LIKE ?", [f"%{policy}%"]
+    sql = (
+        f"SELECT {', '.join(group)}, COUNT(*) AS Count FROM latest_runs r "
+        f"JOIN violations v ON v.run_id = r.run_id {where} "
+        f"GROUP BY {', '.join(group)} ORDER BY {', '.join(group)}"
+    )
+    with closing(connect(path)) as conn:
+        return pd.read_sql_query(sql, conn, params=params)
+
+
+def account_history(path: str = DEFAULT_STORE, account: str = None, policy: str = None) -> pd.DataFrame:
+    """
+    First seen / last seen / resolved per account and policy across the latest run of each input and as-of date.
+    resolved_on is the first later as-of date on which a source the account was last seen in no longer
+    had it breaking the policy (None if still open); runs of other books don't resolve it.
+    """
+    where, params = [], []
+    if account:
+        where.append("v.account = ?")
+        params.append(str(account))
+    if policy:
+        where.append("v.policy LIKE ?")
+        params.append(f"%{policy}%")
+    sql = f"""
+        WITH hits AS (
+            SELECT v.account, v.policy, r.as_of_date, r.source
+            FROM latest_runs r JOIN violations v ON v.run_id = r.run_id
+            {"WHERE " + " AND ".join(where) if where else ""}
+        ), seen AS (
+            SELECT account, policy, MIN(as_of_date) AS first_seen, MAX(as_of_date) AS last_seen,
+                   COUNT(DISTINCT as_of_date) AS runs_seen
+            FROM hits GROUP BY account, policy
+        )
+        SELECT s.*, (
+            SELECT MIN(l.as_of_date) FROM latest_runs l
+            WHERE l.as_of_date > s.last_seen AND EXISTS (
+                SELECT 1 FROM hits h WHERE h.account IS s.account AND h.policy = s.policy
+                AND h.as_of_date = s.last_seen AND h.source IS l.source)
+        ) AS resolved_on
+        FROM seen s ORDER BY s.account, s.policy
+    """
+    with closing(connect(path)) as conn:
+        return pd.read_sql_query(sql, conn, params=params)
@@ -0,0 +1,249 @@
+import json
+import re
+import pandas as pd
+from functions.ftp_rules import expand_row_context
+
+# === CONFIG ===
+FILTER_OPS = ["==", "!=", ">", ">=", "<", "<=", "in", "not in", "isna", "notna", "contains"]
+AGG_FUNCS = ["count", "sum", "mean", "min", "max", "nunique"]
+MAX_LIMIT = 1000
+SPEC_KEYS = {"frame", "filters", "group_by", "aggregations", "select", "sort_by", "limit"}
+SCHEMA_EXAMPLE_VALUES = 6
+
+QUERY_SPEC_INSTRUCTIONS = f"""Return ONLY a JSON object with these keys (omit the ones you do not need):
+  "frame": the frame name to query
+  "filters": [{{"column": <column>, "op": one of {FILTER_OPS}, "value": <value or list of values>}}]
+  "group_by": [<column>, ...]
+  "aggregations": [{{"column": <column or "*">, "func": one of {AGG_FUNCS}, "as": <result name>}}]
+  "select": [<column>, ...]  (only without group_by)
+  "sort_by": [{{"column": <column or aggregation name>, "descending": true or false}}]
+  "limit": <integer, at most {MAX_LIMIT}>
+Filters are combined with AND. Dates are compared as ISO strings such as "2025-06-30"."""
+
+
+def query_frames(violations_df: pd.DataFrame, book_df: pd.DataFrame = None) -> dict:
+    """Frames a local query may touch: violations (row_context expanded) and optionally the book."""
+    frames = {"violations": expand_row_context(violations_df)}
+    if book_df is not None:
+        frames["book"] = book_df
+    return frames
+
+
+def describe_schema(frames: dict) -> str:
+    """Column names, dtypes and a few example values per frame — no data rows."""
+    lines = []
+    for name, frame in frames.items():
+        lines.append(f'Frame "{name}" ({len(frame)} rows):')
+        for col in frame.columns:
+            values = frame[col].dropna().astype(str).unique()[:SCHEMA_EXAMPLE_VALUES]
+            examples = ", ".join(v[:100] for v in values)
+            lines.append(f"  - {col} ({frame[col].dtype}): e.g. {examples}")
+    return "\n".join(lines)
+
+
+def parse_query_spec(text: str) -> dict:
+    """Extracts the JSON query object from an LLM reply (tolerates code fences and surrounding prose)."""
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if not match:
+        raise ValueError("LLM reply does not contain a JSON query.")
+    try:
+        spec = json.loads(match.group(0))
+    except json.JSONDecodeError as e:
+        raise ValueError(f"LLM reply is not valid JSON: {e}")
+    if not isinstance(spec, dict):
+        raise ValueError("Query must be a JSON object.")
+    return spec
+
+
+def _list_of(spec: dict, key: str, kind=None) -> list:
+    value = spec.get(key, [])
+    if not isinstance(value, list) or (kind is not None and not all(isinstance(v, kind) for v in value)):
+        what = "objects" if kind is dict else "strings" if kind is str else "values"
+        raise ValueError(f"'{key}' must be a list of {what}.")
+    return value
+
+
+def _is_date_column(series: pd.Series) -> bool:
+    return pd.api.types.is_datetime64_any_dtype(series) or str(series.name).upper().endswith("_DATE")
+
+
+def _check_value(series: pd.Series, op: str, value):
+    """Comparison value checked against the column dtype; numeric strings are coerced for numeric columns."""
+    if value is None or isinstance(value, (dict, list)):
+        raise ValueError(f"Operator '{op}' needs a scalar value.")
+    if _is_date_column(series) and isinstance(value, str):
+        if pd.isna(pd.to_datetime(value, errors="coerce")):
+            raise ValueError(f"'{value}' is not a date for column '{series.name}'.")
+        return value
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        if isinstance(value, bool):
+            raise ValueError(f"Column '{series.name}' is numeric; got a boolean.")
+        if isinstance(value, str):
+            try:
+                return float(value)
+            except ValueError:
+                raise ValueError(f"Column '{series.name}' is numeric; got '{value}'.")
+    return value
+
+
+def _check_aggregation(series: pd.Series, func: str):
+    """sum/mean need a numeric column; min/max a numeric, date or text one (count and nunique take any)."""
+    numeric = pd.api.types.is_numeric_dtype(series) and not _is_date_column(series)
+    if func in ("sum", "mean") and not numeric:
+        raise ValueError(f"Cannot {func} column '{series.name}': it is not numeric.")
+    if func in ("min", "max") and not (numeric or _is_date_column(series) or series.dtype == object
+                                       or pd.api.types.is_string_dtype(series)):
+        raise ValueError(f"Cannot take the {func} of column '{series.name}' ({series.dtype}).")
+
+
+def _aggregable(series: pd.Series, func: str) -> pd.Series:
+    """min/max of dates compare as timestamps and of text columns as text (they may mix numbers and strings)."""
+    if func not in ("min", "max") or (pd.api.types.is_numeric_dtype(series) and not _is_date_column(series)):
+        return series
+    if _is_date_column(series):
+        return pd.to_datetime(series, errors="coerce")
+    return series.astype(str).where(series.notna())
+
+
+def _agg_name(agg: dict) -> str:
+    return agg.get("as") or f"{agg['func']}_{agg['column']}".replace("*", "rows")
+
+
+def validate_query_spec(spec: dict, frames: dict) -> dict:
+    """
+    Checks every key, type, column, operator, function and filter value against the whitelist and the
+    column dtypes; raises ValueError otherwise. Returns the spec with defaults and coerced filter values.
+    """
+    unknown = set(spec) - SPEC_KEYS
+    if unknown:
+        raise ValueError(f"Unsupported query keys: {sorted(unknown)}")
+    frame_name = spec.get("frame", "violations")
+    if not isinstance(frame_name, str) or frame_name not in frames:
+        raise ValueError(f"Unknown frame '{frame_name}'. Allowed: {list(frames)}")
+    frame = frames[frame_name]
+    columns = set(frame.columns)
+
+    def _check_col(col, extra=()):
+        if not isinstance(col, str) or (col not in columns and col not in extra):
+            raise ValueError(f"Unknown column '{col}' in frame '{frame_name}'.")
+
+    filters = []
+    for f in _list_of(spec, "filters", dict):
+        _check_col(f.get("column"))
+        op = f.get("op")
+        if op not in FILTER_OPS:
+            raise ValueError(f"Unsupported filter operator '{op}'.")
+        value = f.get("value")
+        if op in ("in", "not in"):
+            if not isinstance(value, list) or any(isinstance(v, (dict, list)) for v in value):
+                raise ValueError(f"Operator '{op}' needs a list of scalar values.")
+        elif op in ("==", "!=", ">", ">=", "<", "<=", "contains"):
+            value = _check_value(frame[f["column"]], op, value)
+        filters.append({**f, "value": value})
+    group_by = _list_of(spec, "group_by")
+    for col in group_by:
+        _check_col(col)
+    agg_names = []
+    for agg in _list_of(spec, "aggregations", dict):
+        if agg.get("func") not in AGG_FUNCS:
+            raise ValueError(f"Unsupported aggregation '{agg.get('func')}'.")
+        if agg.get("column") != "*":
+            _check_col(agg.get("column"))
+            _check_aggregation(frame[agg["column"]], agg["func"])
+        elif agg["func"] != "count":
+            raise ValueError("Only count can be applied to '*'.")
+        if agg.get("as") is not None and not isinstance(agg["as"], str):
+            raise ValueError("Aggregation names ('as') must be strings.")
+        name = _agg_name(agg)
+        if name in agg_names or name in group_by:
+            raise ValueError(f"Aggregation name '{name}' is used twice or clashes with a group_by column.")
+        agg_names.append(name)
+    for col in _list_of(spec, "select"):
+        _check_col(col)
+    for s in _list_of(spec, "sort_by", dict):
+        _check_col(s.get("column"), extra=agg_names)
+        if not isinstance(s.get("descending", False), bool):
+            raise ValueError("'descending' must be true or false.")
+    limit = spec.get("limit", MAX_LIMIT)
+    if isinstance(limit, bool) or not isinstance(limit, int) or not 0 < limit <= MAX_LIMIT:
+        raise ValueError(f"limit must be an integer between 1 and {MAX_LIMIT}.")
+    return {**spec, "frame": frame_name, "filters": filters, "limit": limit}
+
+
+def _comparable(series: pd.Series, value):
+    """Dates arrive as ISO strings; compare them as timestamps when the column holds dates."""
+    if _is_date_column(series) and isinstance(value, str):
+        return pd.to_datetime(series, errors="coerce"), pd.to_datetime(value, errors="coerce")
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and not pd.api.types.is_numeric_dtype(series):
+        return pd.to_numeric(series, errors="coerce"), value
+    if isinstance(value, str) and series.dtype == object:
+        # Text columns may hold numbers or NaN next to strings; compare the non-missing values as text
+        return series.astype(str).where(series.notna()), value
+    return series, value
+
+
+def run_query_spec(spec: dict, frames: dict) -> pd.DataFrame:
+    """Executes a validated spec with vectorized pandas operations."""
+    df = frames[spec["frame"]]
+    mask = pd.Series(True, index=df.index)
+    for f in spec.get("filters", []):
+        col, op, value = f["column"], f["op"], f.get("value")
+        series = df[col]
+        if op == "isna":
+            mask &= series.isna()
+        elif op == "notna":
+            mask &= series.notna()
+        elif op == "in":
+            mask &= series.astype(str).isin([str(v) for v in value])
+        elif op == "not in":
+            mask &= ~series.astype(str).isin([str(v) for v in value])
+        elif op == "contains":
+            mask &= series.astype(str).str.contains(str(value), case=False, regex=False, na=False)
+        else:
+            left, right = _comparable(series, value)
+            if op in ("==", "!=") and left.dtype == object:
+                left, right = left.astype(str), str(right)
+            try:
+                mask &= {
+                    "==": left.__eq__, "!=": left.__ne__, ">": left.__gt__,
+                    ">=": left.__ge__, "<": left.__lt__, "<=": left.__le__,
+                }[op](right).fillna(False).astype(bool)
+            except TypeError as e:
+                raise ValueError(f"Cannot compare column '{col}' with {value!r}: {e}")
+    result = df[mask]
+
+    aggs = spec.get("aggregations", [])
+    group_by = spec.get("group_by", [])
+    if group_by or aggs:
+        aggs = aggs or [{"column": "*", "func": "count", "as": "count"}]
+        named = {}
+        result = result.copy(deep=False)    # min/max columns are replaced by comparable versions below
+        for agg in aggs:
+            name = _agg_name(agg)
+            col = group_by[0] if agg["column"] == "*" and group_by else agg["column"]
+            if agg["column"] == "*":
+                named[name] = pd.NamedAgg(column=col if group_by else result.columns[0], aggfunc="size")
+            else:
+                if col not in group_by:
+                    result[col] = _aggregable(result[col], agg["func"])
+                named[name] = pd.NamedAgg(column=col, aggfunc=agg["func"])
+        try:
+            if group_by:
+                result = result.groupby(group_by, dropna=False).agg(**named).reset_index()
+            else:
+                result = pd.DataFrame({
+                    name: [len(result) if a.aggfunc == "size" else result[a.column].dropna().agg(a.aggfunc)]
+                    for name, a in named.items()
+                })
+        except TypeError as e:
+            raise ValueError(f"Cannot aggregate: {e}")
+    elif spec.get("select"):
+        result = result[spec["select"]]
+
+    sort_by = [s for s in spec.get("sort_by", []) if s["column"] in result.columns]
+    if sort_by:
+        result = result.sort_values(
+            by=[s["column"] for s in sort_by],
+            ascending=[not s.get("descending", False) for s in sort_by],
+        )
+    return result.head(spec["limit"]).reset_index(drop=True)
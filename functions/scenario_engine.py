@@ -0,0 +1,152 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from functions.ftp_pricing import normalised_codes, pricing_terms
+from functions.reconciliation import accrual_days, day_count_basis
+
+# === CONFIG ===
+# Shocks in bps by tenor (months), linearly interpolated and flat beyond the ends; "currencies" limits a shock
+SCENARIOS = [
+    {"name": "Base", "tenor_bps": {0: 0}},
+    {"name": "Parallel +50bp", "tenor_bps": {0: 50}},
+    {"name": "Parallel -50bp", "tenor_bps": {0: -50}},
+    {"name": "Parallel +100bp", "tenor_bps": {0: 100}},
+    {"name": "Steepener", "tenor_bps": {1: -25, 12: 0, 120: 50}},
+    {"name": "Flattener", "tenor_bps": {1: 25, 12: 0, 120: -50}},
+]
+SEGMENT_COLUMNS = ["ISO_CURRENCY_CD", "ORG_UNIT_CODE", "LEGAL_ENTITY_CODE", "PRODUCT_CODE", "BRANCH_CODE"]
+RESULT_COLUMNS = ["Scenario", "Segment", "Balance", "Base NET_TP_AMOUNT", "Scenario NET_TP_AMOUNT", "Change",
+                  "Wtd transfer rate"]
+
+_BOOK = None                    # worker: {name: read-only array view on the shared block}
+_SHM = None                     # worker: keeps the shared block mapped
+
+
+def prepare_book(df: pd.DataFrame, method: str = "auto", segments=SEGMENT_COLUMNS):
+    """
+    The numeric columns scenarios need, computed once: pricing term, currency code, balance, base transfer
+    rate, liquidity premium, accrual factor (days / day-count basis) and one code array per segment column.
+    Missing rates count as 0, as in the net_tp_rate reconciliation. Returns (arrays, labels), where labels
+    maps currencies and each segment column to the values behind its codes.
+    """
+    terms, _used = pricing_terms(df, method)
+    ccy_codes, currencies = normalised_codes(df["ISO_CURRENCY_CD"])
+    num = lambda col: pd.to_numeric(df[col], errors="coerce").fillna(0.0).to_numpy(dtype=float) if col in df \
+        else np.zeros(len(df))
+    arrays = {
+        "term": np.nan_to_num(terms, nan=0.0),
+        "currency": ccy_codes.astype(np.int32),
+        "balance": num("AVG_BOOK_BAL_LCY"),
+        "transfer_rate": num("TRANSFER_RATE"),
+        "liquidity_premium": num("LIQUIDITY_PREMIUM_RATE"),
+        "accrual": accrual_days(df, {}) / day_count_basis(df),
+    }
+    labels = {"currency": currencies}
+    for col in segments:
+        if col in df:
+            codes, values = normalised_codes(df[col])
+            arrays[f"segment:{col}"] = codes.astype(np.int32)
+            labels[col] = values
+    return arrays, labels
+
+
+def scenario_shock(book: dict, labels: dict, scenario: dict) -> np.ndarray:
+    """Shock in percentage points per instrument at its pricing term (0 outside the scenario's currencies)."""
+    points = sorted((float(t), float(b)) for t, b in scenario.get("tenor_bps", {0: 0}).items())
+    tenors, bps = zip(*points)
+    shock = np.interp(book["term"], tenors, bps) / 100
+    currencies = scenario.get("currencies")
+    if currencies:
+        wanted = labels["currency"].isin([str(c).strip().upper() for c in currencies])
+        shock = np.where(wanted[book["currency"]], shock, 0.0)
+    return shock
+
+
+def evaluate_scenario(book: dict, labels: dict, scenario: dict, segment: str) -> pd.DataFrame:
+    """Per-segment balance, base and shocked NET_TP_AMOUNT and the balance-weighted shocked transfer rate."""
+    base_rate = book["transfer_rate"] + book["liquidity_premium"]
+    transfer = book["transfer_rate"] + scenario_shock(book, labels, scenario)
+    factor = book["balance"] * book["accrual"] / 100
+    base_amount = factor * base_rate
+    amount = factor * (transfer + book["liquidity_premium"])
+
+    codes = book[f"segment:{segment}"]
+    n = len(labels[segment])
+    balance = np.bincount(codes, weights=book["balance"], minlength=n)
+    abs_balance = np.bincount(codes, weights=np.abs(book["balance"]), minlength=n)
+    base_total = np.bincount(codes, weights=base_amount, minlength=n)
+    total = np.bincount(codes, weights=amount, minlength=n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weighted = np.bincount(codes, weights=np.abs(book["balance"]) * transfer, minlength=n) / abs_balance
+    return pd.DataFrame({
+        "Scenario": scenario["name"],
+        "Segment": np.asarray(labels[segment]),
+        "Balance": balance,
+        "Base NET_TP_AMOUNT": base_total,
+        "Scenario NET_TP_AMOUNT": total,
+        "Change": total - base_total,
+        "Wtd transfer rate": weighted,
+    }, columns=RESULT_COLUMNS)
+
+
+# --- shared memory ---
+def _to_shared(arrays: dict):
+    """Copies the arrays into one shared block; returns (block, layout of name -> (offset, dtype, length))."""
+    layout, offset = {}, 0
+    for name, values in arrays.items():
+        offset = -(-offset // 8) * 8
+        layout[name] = (offset, values.dtype.str, len(values))
+        offset += values.nbytes
+    block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for name, values in arrays.items():
+        start, dtype, length = layout[name]
+        np.ndarray(length, dtype=dtype, buffer=block.buf, offset=start)[:] = values
+    return block, layout
+
+
+def _attach(name: str, layout: dict):
+    global _BOOK, _SHM
+    _SHM = shared_memory.SharedMemory(name=name)
+    _BOOK = {}
+    for key, (start, dtype, length) in layout.items():
+        view = np.ndarray(length, dtype=dtype, buffer=_SHM.buf, offset=start)
+        view.flags.writeable = False
+        _BOOK[key] = view
+
+
+def _worker_scenario(labels: dict, scenario: dict, segment: str) -> pd.DataFrame:
+    return evaluate_scenario(_BOOK, labels, scenario, segment)
+
+
+def run_scenarios(df: pd.DataFrame, scenarios: list = None, segment: str = "ISO_CURRENCY_CD",
+                  method: str = "auto", workers: int = None) -> pd.DataFrame:
+    """
+    Evaluates every scenario against the book and returns RESULT_COLUMNS per scenario × segment.
+    With workers > 1 the prepared book is placed in shared memory once and each worker process
+    maps it read-only; only scenario definitions and per-segment results cross process boundaries.
+    """
+    scenarios = scenarios or SCENARIOS
+    if segment not in df:
+        raise ValueError(f"Unknown segment column '{segment}'.")
+    book, labels = prepare_book(df, method, [segment])
+    workers = min(workers or os.cpu_count() or 1, len(scenarios))
+    if workers <= 1:
+        frames = [evaluate_scenario(book, labels, s, segment) for s in scenarios]
+    else:
+        block, layout = _to_shared(book)
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_attach, initargs=(block.name, layout)) as pool:
+                frames = list(pool.map(_worker_scenario, [labels] * len(scenarios), scenarios,
+                                       [segment] * len(scenarios)))
+        finally:
+            block.close()
+            block.unlink()
+    return pd.concat(frames, ignore_index=True)
+
+
+def scenario_totals(results: pd.DataFrame) -> pd.DataFrame:
+    """Book-level NET_TP_AMOUNT and change per scenario, in scenario order."""
+    totals = results.groupby("Scenario", sort=False)[["Base NET_TP_AMOUNT", "Scenario NET_TP_AMOUNT", "Change"]].sum()
+    return totals.reset_index()
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+# === CONFIG ===
+WORD_BITS = 64
+
+
+def pack_mask(mask) -> np.ndarray:
+    """Boolean row mask -> uint64 words; bit i of word w is row position 64*w + i."""
+    mask = np.asarray(mask, dtype=bool)
+    padded = np.zeros(-(-len(mask) // WORD_BITS) * WORD_BITS, dtype=bool)
+    padded[:len(mask)] = mask
+    return np.packbits(padded, bitorder="little").view("<u8").astype(np.uint64)
+
+
+def unpack_bits(words: np.ndarray, n_rows: int) -> np.ndarray:
+    """uint64 words -> boolean mask over the first n_rows positions."""
+    as_bytes = np.ascontiguousarray(words, dtype="<u8").view(np.uint8)
+    return np.unpackbits(as_bytes, bitorder="little", count=n_rows).astype(bool)
+
+
+class ViolationBitmap:
+    """
+    Rules × rows bit matrix produced by detection. Set queries across rules are word-level
+    AND/OR over uint64 arrays; results are row positions into the book that was checked.
+    Rules can be named by index, description or the column they test (e.g. "MATURITY_DATE").
+    """
+
+    def __init__(self, rules: list, violated: np.ndarray, errors: np.ndarray, n_rows: int):
+        self.rules = rules              # evaluated rules, in matrix row order
+        self.violated = violated        # (rules, words) uint64: condition was true
+        self.errors = errors            # (rules, words) uint64: condition raised
+        self.n_rows = n_rows
+        self._codes = {}                # column -> (codes, unique values as strings) of the joined book
+
+    @classmethod
+    def from_masks(cls, rules: list, violated_masks: list, error_masks: list, n_rows: int):
+        n_words = -(-n_rows // WORD_BITS)
+        def _stack(masks):
+            return np.vstack([pack_mask(m) for m in masks]) if masks else np.zeros((0, n_words), dtype=np.uint64)
+        return cls(rules, _stack(violated_masks), _stack(error_masks), n_rows)
+
+    @property
+    def nbytes(self) -> int:
+        return self.violated.nbytes + self.errors.nbytes
+
+    def rule_index(self, rule) -> int:
+        if isinstance(rule, (int, np.integer)):
+            if not 0 <= rule < len(self.rules):
+                raise KeyError(f"No rule at index {rule}.")
+            return int(rule)
+        for i, r in enumerate(self.rules):
+            if rule in (r.get("description"), r.get("column")):
+                return i
+        raise KeyError(f"Unknown rule '{rule}'.")
+
+    def rule_bits(self, rule) -> np.ndarray:
+        return self.violated[self.rule_index(rule)]
+
+    def all_of(self, *rules) -> np.ndarray:
+        """Rows violating every given rule."""
+        return np.bitwise_and.reduce([self.rule_bits(r) for r in rules]) if rules else self.empty()
+
+    def any_of(self, *rules) -> np.ndarray:
+        """Rows violating at least one of the given rules (all rules when none are given)."""
+        rows = [self.rule_bits(r) for r in rules] if rules else list(self.violated)
+        return np.bitwise_or.reduce(rows) if rows else self.empty()
+
+    def empty(self) -> np.ndarray:
+        return np.zeros(-(-self.n_rows // WORD_BITS), dtype=np.uint64)
+
+    def invert(self, bits: np.ndarray) -> np.ndarray:
+        """Complement within the book's rows (padding bits stay clear)."""
+        return ~bits & pack_mask(np.ones(self.n_rows, dtype=bool))
+
+    def column_bits(self, book_df: pd.DataFrame, column: str, values) -> np.ndarray:
+        """Rows whose book column is one of values; compared as strings, like the violation cube."""
+        if len(book_df) != self.n_rows:
+            raise ValueError(f"Book has {len(book_df)} rows; the bitmap was built over {self.n_rows}.")
+        values = [values] if isinstance(values, str) or not hasattr(values, "__iter__") else values
+        if column not in self._codes:
+            # Factorised once per column; each query then only compares integer codes
+            codes, uniques = pd.factorize(book_df[column])
+            self._codes[column] = (codes, pd.Index(uniques.astype(str)))
+        codes, uniques = self._codes[column]
+        wanted = np.flatnonzero(uniques.isin([str(v) for v in values]))
+        return pack_mask(np.isin(codes, wanted))
+
+    @staticmethod
+    def count(bits: np.ndarray) -> int:
+        return int(np.bitwise_count(bits).sum())
+
+    def counts(self) -> pd.DataFrame:
+        """Violating rows per rule (Policy, Count), in rule order."""
+        return pd.DataFrame({
+            "Policy": [r.get("description", "No description") for r in self.rules],
+            "Count": np.bitwise_count(self.violated).sum(axis=1).astype(int),
+        })
+
+    def positions(self, bits: np.ndarray) -> np.ndarray:
+        return np.flatnonzero(unpack_bits(bits, self.n_rows))
+
+    def select(self, book_df: pd.DataFrame, bits: np.ndarray, columns=None) -> pd.DataFrame:
+        """Book rows (optionally only some columns) selected by bits."""
+        rows = book_df.iloc[self.positions(bits)]
+        return rows if columns is None else rows[columns]
@@ -0,0 +1,100 @@
+import math
+import re
+import numpy as np
+import pandas as pd
+from functions.frame_cache import cached_per_frame
+from functions.ftp_rules import expand_row_context
+
+# === CONFIG ===
+# Exact-match (inverted) indexes on code columns
+CODE_COLUMNS = [
+    "ACCOUNT_NUMBER_MASKED", "CUSTOMER_CODE_MASKED", "ISO_CURRENCY_CD", "PRODUCT_CODE",
+    "BRANCH_CODE", "ORG_UNIT_CODE", "LEGAL_ENTITY_CODE", "GL_ACCOUNT_CODE", "COMMON_COA_CODE",
+]
+# TF-IDF over free-text columns
+TEXT_COLUMNS = ["description", "PRODUCT_NAME", "INSTRUMENT_TYPE", "ADJUSTABLE_TYPE", "AMORTIZATION_TYPE"]
+CODE_MATCH_WEIGHT = 10.0  # a named code outweighs any amount of text similarity
+_STOPWORDS = {
+    "the", "a", "an", "of", "in", "on", "for", "to", "and", "or", "is", "are", "be", "must", "not",
+    "what", "which", "show", "me", "with", "by", "per", "any", "all", "why", "how", "do", "does",
+}
+_TOKEN_PAT = re.compile(r"[a-z0-9]+")
+
+
+def _tokens(text: str) -> list:
+    return [t for t in _TOKEN_PAT.findall(str(text).lower()) if t not in _STOPWORDS and len(t) > 1]
+
+
+def code_positions(values: pd.Series) -> dict:
+    """{trimmed upper-case code: row positions}; missing and blank values are left out."""
+    keys = values.astype(str).str.strip().str.upper()
+    keys = keys.where(values.notna() & (keys != ""))
+    return keys.groupby(keys, sort=False).indices
+
+
+def _build_text_field(values: pd.Series, n_rows: int) -> dict:
+    """TF-IDF over the distinct strings of one column; rows point at their string via codes."""
+    codes, uniques = pd.factorize(values.astype(str), sort=False)
+    per_string = [_tokens(u) for u in uniques]
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    doc_freq = {}
+    for sid, toks in enumerate(per_string):
+        for tok in set(toks):
+            doc_freq[tok] = doc_freq.get(tok, 0) + counts[sid]
+    postings = {}
+    for sid, toks in enumerate(per_string):
+        if not toks:
+            continue
+        norm = math.sqrt(len(toks))
+        for tok in set(toks):
+            tf = toks.count(tok) / norm
+            idf = math.log((1 + n_rows) / (1 + doc_freq[tok])) + 1.0
+            postings.setdefault(tok, []).append((sid, tf * idf))
+    return {"codes": codes, "n_strings": len(uniques), "postings": postings}
+
+
+@cached_per_frame
+def build_violation_index(violations_df: pd.DataFrame) -> dict:
+    """Inverted indexes on code columns plus TF-IDF over text columns, built once per violations frame."""
+    expanded = expand_row_context(violations_df)
+    index = {"labels": expanded.index, "codes": {}, "text": {}}
+    for col in CODE_COLUMNS:
+        if col in expanded:
+            index["codes"][col] = code_positions(expanded[col])
+    for col in TEXT_COLUMNS:
+        if col in expanded:
+            index["text"][col] = _build_text_field(expanded[col], len(expanded))
+    return index
+
+
+def score_rows(violations_df: pd.DataFrame, question: str) -> np.ndarray:
+    """Relevance score per violation row (positional) for the question; 0 means unrelated."""
+    index = build_violation_index(violations_df)
+    scores = np.zeros(len(index["labels"]), dtype=np.float64)
+    raw_tokens = {t.upper() for t in re.findall(r"[A-Za-z0-9_\-]+", question)}
+    for col, postings in index["codes"].items():
+        for tok in raw_tokens:
+            positions = postings.get(tok)
+            if positions is not None:
+                scores[positions] += CODE_MATCH_WEIGHT
+    q_tokens = _tokens(question)
+    for field in index["text"].values():
+        string_scores = np.zeros(field["n_strings"] + 1)  # last slot catches missing values (code -1)
+        for tok in q_tokens:
+            for sid, weight in field["postings"].get(tok, ()):
+                string_scores[sid] += weight
+        if string_scores.any():
+            scores += string_scores[field["codes"]]
+    return scores
+
+
+def relevant_rows(violations_df: pd.DataFrame, question: str, limit: int = 500) -> pd.Index:
+    """Index labels of the violations most relevant to the question, best first (empty if nothing matches)."""
+    if violations_df is None or violations_df.empty:
+        return pd.Index([])
+    scores = score_rows(violations_df, question)
+    hits = np.flatnonzero(scores > 0)
+    if len(hits) > limit:
+        hits = hits[np.argpartition(-scores[hits], limit - 1)[:limit]]
+    hits = hits[np.argsort(-scores[hits], kind="stable")]
+    return build_violation_index(violations_df)["labels"][hits]
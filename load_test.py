@@ -0,0 +1,196 @@
+"""
+Concurrent-session load test for the Analysis flow, run against the local fake LLM.
+
+Each simulated session does what one analyst's Streamlit session does: load the workbook,
+detect violations, click the suggested questions and ask a few custom ones. Sessions run as
+threads in one process, like Streamlit's script runners.
+
+    python load_test.py --sessions 20 --latency 0.8 --custom 3 --report load_report.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+SUGGESTED_QUESTIONS = [
+    "What are the anomalies in FTP rates?",
+    "How many violations/anomalies detected per policy category? - Provide a table",
+    "Which entries violate policy rules?",
+    "Which policies are being tested?",
+]
+CUSTOM_QUESTIONS = [
+    "Explain the main drivers of the violations",
+    "Which currencies are most affected and why?",
+    "Summarise the maturity date issues for management",
+    "What should we fix first to reduce violations?",
+    "Describe the missing transfer rate cases",
+    "violations per currency",
+    "top 5 branches",
+]
+
+
+def _rss_mb() -> float:
+    """Current resident set size (Linux /proc), falling back to peak RSS elsewhere."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _timed(timings: dict, stage: str, fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    if hasattr(result, "__next__"):  # streamed answers count until the last token
+        result = "".join(result)
+    timings.setdefault(stage, []).append(time.perf_counter() - t0)
+    return result
+
+
+def run_session(session_id: int, file_path: str, n_custom: int, stream: bool, seed: int) -> dict:
+    # Imported here so the fake backend is configured before langchain_llm loads
+    from functions.data_loader import load_client_data
+    from functions.ftp_rules import load_rules, detect_policy_violations
+    from functions.ftp_rules import expand_row_context
+    from functions.langchain_llm import query_llm
+
+    rng = random.Random(seed + session_id)
+    timings = {}
+    t0 = time.perf_counter()
+    df = _timed(timings, "load", load_client_data, file_path)
+    violations_df = _timed(timings, "detect", detect_policy_violations, df, load_rules())
+    for q in SUGGESTED_QUESTIONS:
+        _timed(timings, "suggested_question", query_llm, violations_df, q, stream=stream)
+    for q in rng.sample(CUSTOM_QUESTIONS, k=min(n_custom, len(CUSTOM_QUESTIONS))):
+        _timed(timings, "custom_question", query_llm, violations_df, f"{q} (session {session_id})", stream=stream)
+    timings["session"] = [time.perf_counter() - t0]
+
+    # What a Streamlit session keeps alive between reruns: the book, its violations and their parsed context
+    held = [df, violations_df, expand_row_context(violations_df)]
+    session_mb = sum(f.memory_usage(deep=True).sum() for f in held) / 2**20
+    return {"timings": timings, "session_state_mb": session_mb}
+
+
+def _percentiles(values) -> dict:
+    if not values:
+        return {}
+    arr = np.asarray(values)
+    return {
+        "n": len(arr),
+        "p50_s": float(np.percentile(arr, 50)),
+        "p90_s": float(np.percentile(arr, 90)),
+        "p99_s": float(np.percentile(arr, 99)),
+        "max_s": float(arr.max()),
+    }
+
+
+def run_load_test(sessions: int, file_path: str, n_custom: int = 3, ramp_s: float = 0.0,
+                  stream: bool = False, seed: int = 0) -> dict:
+    """Runs `sessions` concurrent sessions and returns per-stage percentiles, throughput and memory."""
+    from functions.llm_metrics import metrics_summary, reset_metrics
+
+    reset_metrics()
+    rss_start = _rss_mb()
+    rss_peak = [rss_start]
+    stop = threading.Event()
+
+    def _sample_rss():
+        while not stop.wait(0.1):
+            rss_peak[0] = max(rss_peak[0], _rss_mb())
+
+    sampler = threading.Thread(target=_sample_rss, daemon=True)
+    sampler.start()
+
+    def _start(i):
+        time.sleep(ramp_s * i / max(sessions, 1))
+        return run_session(i, file_path, n_custom, stream, seed)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        results = list(pool.map(_start, range(sessions)))
+    wall = time.perf_counter() - t0
+    stop.set()
+    sampler.join()
+
+    stages = {}
+    for r in results:
+        for stage, values in r["timings"].items():
+            stages.setdefault(stage, []).extend(values)
+    n_questions = len(stages.get("suggested_question", [])) + len(stages.get("custom_question", []))
+    return {
+        "sessions": sessions,
+        "wall_s": wall,
+        "throughput": {
+            "sessions_per_s": sessions / wall,
+            "questions_per_s": n_questions / wall,
+        },
+        "stages": {stage: _percentiles(values) for stage, values in stages.items()},
+        "memory": {
+            "rss_start_mb": rss_start,
+            "rss_peak_mb": rss_peak[0],
+            "rss_growth_per_session_mb": (rss_peak[0] - rss_start) / sessions,
+            "session_state_mb": float(np.mean([r["session_state_mb"] for r in results])),
+        },
+        "llm": metrics_summary(),
+    }
+
+
+def _print_report(report: dict):
+    print(f"\nSessions: {report['sessions']}  wall: {report['wall_s']:.1f}s  "
+          f"sessions/s: {report['throughput']['sessions_per_s']:.2f}  "
+          f"questions/s: {report['throughput']['questions_per_s']:.2f}")
+    print(f"{'stage':<20}{'n':>6}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for stage, p in report["stages"].items():
+        print(f"{stage:<20}{p['n']:>6}{p['p50_s']:>9.3f}s{p['p90_s']:>9.3f}s{p['p99_s']:>9.3f}s{p['max_s']:>9.3f}s")
+    mem = report["memory"]
+    print(f"RSS start {mem['rss_start_mb']:.0f} MB, peak {mem['rss_peak_mb']:.0f} MB, "
+          f"growth/session {mem['rss_growth_per_session_mb']:.1f} MB, "
+          f"session frames {mem['session_state_mb']:.1f} MB")
+    llm = report["llm"]
+    if llm.get("calls"):
+        print(f"LLM calls {llm['calls']}, errors {llm['errors']}, retries {llm['retries']}, "
+              f"p50 latency {llm['latency_s']['p50']:.2f}s, p90 {llm['latency_s']['p90']:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent Analysis sessions against a fake LLM.")
+    parser.add_argument("--sessions", type=int, default=10, help="concurrent sessions")
+    parser.add_argument("--file", default=os.path.join("input_data", "ClientFTPData.xlsx"))
+    parser.add_argument("--custom", type=int, default=3, help="custom questions per session")
+    parser.add_argument("--latency", type=float, default=0.8, help="fake LLM time to first token (s)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fake LLM failure probability")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="process-wide LLM call limit")
+    parser.add_argument("--ramp", type=float, default=0.0, help="seconds over which sessions start")
+    parser.add_argument("--stream", action="store_true", help="stream LLM answers")
+    parser.add_argument("--cache", action="store_true", help="keep the LLM response cache on")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", help="write the JSON report here")
+    args = parser.parse_args()
+
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["FAKE_LLM_LATENCY_S"] = str(args.latency)
+    os.environ["FAKE_LLM_FAILURE_RATE"] = str(args.failure_rate)
+    if args.max_in_flight:
+        os.environ["LLM_MAX_IN_FLIGHT"] = str(args.max_in_flight)
+    if not args.cache:
+        os.environ["LLM_CACHE_SIZE"] = "0"
+    # Streamlit calls outside a running app only log "missing ScriptRunContext" warnings
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+    report = run_load_test(args.sessions, args.file, args.custom, args.ramp, args.stream, args.seed)
+    _print_report(report)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
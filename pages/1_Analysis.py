@@ -1,11 +1,22 @@
 import streamlit as st
 import pandas as pd
 from functions.data_loader import load_client_data
-from functions.ftp_rules import load_rules, detect_policy_violations
-from functions.langchain_llm import query_llm
+from functions.ftp_rules import load_rules, detect_policy_violations_with_bitmap
+from functions.approx_detect import (
+    APPROX_MIN_ROWS, estimate_policy_violations, start_exact_detection, forget_exact_detection
+)
+from functions.langchain_llm import query_llm, explain_account
+from functions.account_index import account_keys, lookup_account, ACCOUNT_KEY_COLUMNS
+from functions.llm_metrics import metrics_summary, metrics_frame
+from functions.report_export import export_bytes, EXPORT_FORMATS, REPORTS
+from functions.reconciliation import is_reconciliation, reconciliation_summary, reconciliation_breaks
+from functions.pnl_cube import get_cube, HIERARCHY, CUBE_DIMENSIONS
+from functions.fx_rates import REPORTING_CURRENCY, FX_CSV, missing_currencies
 from PIL import Image
 import os
 import base64
+import itertools
+import json
 
 st.set_page_config(page_title="Analysis", page_icon="🟢", layout="wide")
 
@@ -204,6 +215,7 @@ except Exception as e:
 
 # --- Run Policy Violation Check ---
 violations_df = pd.DataFrame()
+detection_pending = False
 if df is not None:
     st.markdown(
         "<h3 style='color: white;'>🔍 Policy Violation Check</h3>",
@@ -211,14 +223,154 @@ if df is not None:
     )
 
     rules = load_rules()
-    violations_df = detect_policy_violations(df, rules)
+    # Reuse the violations frame across reruns so per-frame aggregates are built only once
+    detection_key = (file_path, os.path.getmtime(file_path), json.dumps(rules, sort_keys=True))
+    approx_first = st.sidebar.checkbox(
+        "Approximate first for large books", value=True,
+        help=f"Books with at least {APPROX_MIN_ROWS:,} rows show sampled estimates while the exact check runs."
+    )
+    if st.session_state.get("detection_key") != detection_key:
+        if approx_first and len(df) >= APPROX_MIN_ROWS:
+            # Estimate from a stratified sample now; the exact run continues in the background
+            if st.session_state.get("violation_estimate", (None,))[0] != detection_key:
+                st.session_state["violation_estimate"] = (detection_key, estimate_policy_violations(df, rules))
+            start_exact_detection(detection_key, df, rules, data_key=detection_key[:2])
+            detection_pending = True
+        else:
+            # Per-rule results are cached by (file, mtime): after a rule edit only the changed rules are re-evaluated
+            st.session_state["violations_df"], st.session_state["violation_bitmap"] = detect_policy_violations_with_bitmap(
+                df, rules, data_key=detection_key[:2]
+            )
+            st.session_state["detection_key"] = detection_key
+    if not detection_pending:
+        violations_df = st.session_state["violations_df"]
+        # Rate-model residual anomalies added on the Modelling page join the list for the same file
+        anomalies = st.session_state.get("model_anomalies")
+        if anomalies is not None and anomalies[0] == detection_key[:2]:
+            merged_key = (detection_key, anomalies[1])
+            if st.session_state.get("merged_violations", (None,))[0] != merged_key:
+                st.session_state["merged_violations"] = (
+                    merged_key, pd.concat([violations_df, anomalies[2]], ignore_index=True)
+                )
+            violations_df = st.session_state["merged_violations"][1]
 
-    if violations_df.empty:
+    if detection_pending:
+        estimate = st.session_state["violation_estimate"][1]
+        st.warning(
+            f"⏳ ESTIMATE from {int(estimate['Sampled'].max()):,} sampled rows (95% interval). "
+            "The exact check is running and will replace it automatically."
+        )
+        st.dataframe(estimate, use_container_width=True)
+
+        @st.fragment(run_every=2)
+        def _poll_exact_detection():
+            future = start_exact_detection(detection_key, df, rules, data_key=detection_key[:2])
+            if not future.done():
+                st.caption("Exact check in progress...")
+                return
+            if future.exception() is not None:
+                st.error(f"Exact check failed: {future.exception()}")
+                return
+            forget_exact_detection(detection_key)
+            st.session_state["violations_df"], st.session_state["violation_bitmap"] = future.result()
+            st.session_state["detection_key"] = detection_key
+            st.rerun()
+
+        _poll_exact_detection()
+    elif violations_df.empty:
         st.success("✅ No violations found in FTP data.")
     else:
-        st.error(f"⚠️ {len(violations_df)} violations detected.")
+        st.error(f"⚠️ {len(violations_df)} violations detected (exact).")
         st.dataframe(violations_df)
 
+        # --- Export (built on request, reused until the data or rules change) ---
+        with st.expander("⬇️ Export violations and summaries"):
+            col_fmt, col_report = st.columns(2)
+            export_fmt = col_fmt.selectbox("Format", list(EXPORT_FORMATS))
+            export_report_name = col_report.selectbox(
+                "Report", REPORTS, disabled=export_fmt == "xlsx",
+                help="Excel exports contain all reports as separate sheets."
+            )
+            export_key = (detection_key, export_fmt, "all" if export_fmt == "xlsx" else export_report_name)
+            if st.button("Prepare export"):
+                with st.spinner("Writing export..."):
+                    st.session_state["export"] = (export_key, export_bytes(violations_df, export_fmt, export_report_name))
+            prepared = st.session_state.get("export")
+            if prepared and prepared[0] == export_key:
+                ext, mime = EXPORT_FORMATS[export_fmt]
+                stem = "ftp_report" if export_fmt == "xlsx" else f"ftp_{export_report_name}"
+                st.download_button(f"Download {stem}.{ext}", prepared[1], file_name=f"{stem}.{ext}", mime=mime)
+
+        # --- Reconciliation breaks rolled up by org unit / legal entity ---
+        recon_rules = [r for r in rules if is_reconciliation(r)]
+        if recon_rules:
+            with st.expander("🧮 Reconciliation breaks by org unit / legal entity"):
+                if st.session_state.get("reconciliation", (None,))[0] != detection_key:
+                    st.session_state["reconciliation"] = (
+                        detection_key, reconciliation_summary(df, recon_rules), reconciliation_breaks(df, recon_rules)
+                    )
+                _, recon_summary, recon_breaks = st.session_state["reconciliation"]
+                only_breaks = st.checkbox("Only groups with breaks", value=True)
+                st.dataframe(recon_summary[recon_summary["Breaks"] > 0] if only_breaks else recon_summary,
+                             use_container_width=True)
+                st.dataframe(recon_breaks, use_container_width=True)
+
+        # --- Account drill-down (indexed lookup, no scrolling through the full table) ---
+        with st.expander("🔎 Account drill-down"):
+            key_column = st.radio("Look up by", ACCOUNT_KEY_COLUMNS, horizontal=True)
+            account = st.selectbox("Account / customer", account_keys(df, key_column), index=None,
+                                   placeholder="Type or pick a key...")
+            if account:
+                found = lookup_account(account, book_df=df, violations_df=violations_df, column=key_column)
+                st.write(f"Book rows: {len(found['book'])} · violations: {len(found['violations'])}")
+                st.dataframe(found["book"], use_container_width=True)
+                if not found["violations"].empty:
+                    st.dataframe(found["violations"], use_container_width=True)
+                if st.button("🧠 Explain this account"):
+                    try:
+                        with st.spinner("Thinking..."):
+                            explanation = explain_account(violations_df, account, book_df=df, column=key_column, stream=True)
+                            if not isinstance(explanation, str):
+                                explanation = itertools.chain([next(explanation, "")], explanation)
+                        if isinstance(explanation, str):
+                            st.write(explanation)
+                        else:
+                            st.write_stream(explanation)
+                    except Exception as e:
+                        st.error(f"LLM query failed: {e}")
+
+    # --- FTP P&L roll-up (cube kept per file, updated from the previous snapshot when the file changes) ---
+    with st.expander("📊 FTP P&L roll-up / drill-down"):
+        cube = get_cube(file_path, df, snapshot_key=detection_key[:2])
+        drill_cols = st.columns(len(HIERARCHY))
+        path = {}
+        for level, col in zip(HIERARCHY, drill_cols):
+            choice = col.selectbox(level, ["All"] + cube.values(level, path), key=f"pnl_{level}")
+            if choice == "All":
+                break
+            path[level] = choice
+        split_by = st.multiselect("Split by", [d for d in CUBE_DIMENSIONS if d not in HIERARCHY],
+                                  key="pnl_split_by")
+        reporting = st.checkbox(f"Amounts in {REPORTING_CURRENCY}", key="pnl_reporting",
+                                help=f"Converted at the book's as-of date with the rates in {FX_CSV}.")
+        if reporting:
+            try:
+                unconverted = missing_currencies(cube.values("ISO_CURRENCY_CD", path), cube.as_of)
+                if unconverted:
+                    st.warning(f"No FX rate for {', '.join(unconverted)}; their amounts are left out.")
+            except (OSError, ValueError) as e:
+                st.info(f"FX conversion unavailable: {e}")
+                reporting = False
+        totals = cube.rollup(filters=path, reporting=reporting).iloc[0]
+        m1, m2, m3 = st.columns(3)
+        m1.metric("Balance", f"{totals['BALANCE']:,.0f}")
+        m2.metric("NET_TP_AMOUNT", f"{totals['NET_TP_AMOUNT']:,.0f}")
+        m3.metric("Wtd transfer rate", f"{totals['WTD_TRANSFER_RATE']:.4f}")
+        st.dataframe(cube.drill(path, by=split_by, reporting=reporting), use_container_width=True)
+        update = cube.last_update
+        st.caption(f"Cube {update['mode']}: {update['added']:,} rows added, {update['removed']:,} removed "
+                   f"in {update['seconds']}s · {len(cube.cells):,} cells")
+
 # --- Suggested Questions ---
 st.markdown(
     "<h3 style='color: white; text-shadow: 1px 1px 3px rgba(0,0,0,0.6);'>💬 Ask a question about the data</h3>",
@@ -254,31 +406,95 @@ if not violations_df.empty:
         min_value=0, value=0, step=1
     )
     max_v = None if max_v == 0 else max_v
+    token_budget = st.sidebar.number_input(
+        "Prompt token budget for violations",
+        min_value=500, value=3000, step=500
+    )
+    stream_answers = st.sidebar.checkbox("Stream LLM answers", value=True)
+    answer_mode = st.sidebar.radio(
+        "LLM answer mode",
+        ["Compacted prompt", "Cover all violations (map-reduce)", "Schema only (local query)"]
+    )
+    map_reduce = answer_mode == "Cover all violations (map-reduce)"
+    local_query = answer_mode == "Schema only (local query)"
+    chunk_by = st.sidebar.selectbox(
+        "Split violations by",
+        ["policy", "ISO_CURRENCY_CD", "PRODUCT_CODE", "ORG_UNIT_CODE", "BRANCH_CODE"],
+        disabled=not map_reduce
+    )
 else:
     max_v = None
+    token_budget = None
+    stream_answers = False
+    map_reduce = False
+    local_query = False
+    chunk_by = "policy"
 
 # --- LLM response ---
 if "user_question" in st.session_state and df is not None:
     if violations_df.empty:
-        st.info("ℹ️ No violations to analyse.")
+        st.info("ℹ️ Exact check still running; questions are answered once it finishes." if detection_pending
+                else "ℹ️ No violations to analyse.")
     else:
         st.markdown(
             f"<p style='color: white;'><strong>You asked:</strong> {st.session_state['user_question']}</p>",
             unsafe_allow_html=True
         )
-        with st.spinner("Thinking..."):
-            try:
+        try:
+            with st.spinner("Thinking..."):
                 response = query_llm(
                     violations_df,
                     st.session_state["user_question"],
-                    max_violations=max_v
+                    max_violations=max_v,
+                    token_budget=token_budget,
+                    stream=stream_answers,
+                    map_reduce=map_reduce,
+                    chunk_by=chunk_by,
+                    local_query=local_query,
+                    book_df=df,
+                    bitmap=st.session_state.get("violation_bitmap"),
+                    as_streamlit=local_query
                 )
+                # Keep the spinner up only until the first streamed token arrives
+                if not isinstance(response, str):
+                    response = itertools.chain([next(response, "")], response)
+            if isinstance(response, str):
                 st.markdown(
                     f"<h3 style='color: white;'>🧠 LLM Responded</h3><div style='color: white;'>{response}</div>",
                     unsafe_allow_html=True
                 )
-            except Exception as e:
-                st.error(f"LLM query failed: {e}")
+            else:
+                st.markdown("<h3 style='color: white;'>🧠 LLM Responded</h3>", unsafe_allow_html=True)
+                answer_box = st.empty()
+                answer = ""
+                for token in response:
+                    answer += token
+                    answer_box.markdown(f"<div style='color: white;'>{answer}</div>", unsafe_allow_html=True)
+        except Exception as e:
+            st.error(f"LLM query failed: {e}")
+
+# --- Sidebar LLM diagnostics (process-wide, recent calls) ---
+with st.sidebar.expander("🩺 LLM diagnostics"):
+    summary = metrics_summary()
+    if summary["calls"] == 0:
+        st.caption("No LLM calls yet.")
+    else:
+        def _fmt(v, unit="s"):
+            return "—" if v is None else (f"{v:.2f}{unit}" if unit == "s" else f"{v:.0f}")
+        st.write(f"Calls: {summary['calls']} · errors: {summary['errors']} · retries: {summary['retries']}")
+        st.write(f"Cache hit rate: {summary['cache_hit_rate']:.0%}")
+        st.table(pd.DataFrame({
+            "latency": {k: _fmt(v) for k, v in summary["latency_s"].items()},
+            "first token": {k: _fmt(v) for k, v in summary["ttft_s"].items()},
+            "prompt tok": {k: _fmt(v, "") for k, v in summary["prompt_tokens"].items()},
+            "completion tok": {k: _fmt(v, "") for k, v in summary["completion_tokens"].items()},
+        }))
+        st.download_button(
+            "Export metrics (JSONL)",
+            metrics_frame().to_json(orient="records", lines=True),
+            file_name="llm_metrics.jsonl",
+            mime="application/json"
+        )
 
 # --- Sidebar footer logos ---
 left_logo = os.path.join("assets", "bank_logo_small.png")
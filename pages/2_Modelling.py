@@ -1,10 +1,18 @@
 import streamlit as st
 import pandas as pd
 from functions.data_loader import load_client_data
-from functions.ftp_rules import load_rules, detect_policy_violations
+from functions.ftp_rules import load_rules, detect_policy_violations, expand_row_context
 from functions.langchain_llm import query_llm
+from functions.ftp_pricing import (
+    CURVE_CSV, PRICING_METHODS, TOLERANCE_BPS, load_curves, normalise_curves, curves_from_book, price_book,
+    compare_to_file,
+)
+from functions.rate_model import TARGETS, RIDGE_ALPHA, RESIDUAL_BPS, RateModel, model_path, train_rate_model, residual_anomalies
+from functions.batch_scorer import SCORE_CHUNK_ROWS, score_file, scored_path
+from functions.scenario_engine import SCENARIOS, SEGMENT_COLUMNS, run_scenarios, scenario_totals
 from PIL import Image
 import os
+import time
 import base64
 
 st.set_page_config(page_title="Modelling", page_icon="🟠", layout="wide")
@@ -154,6 +162,189 @@ if st.sidebar.button("🟢 Go to Analysis"):
 st.title("🟠 Modelling Page")
 st.markdown("This page will host ML models to estimate FTP rates")
 
-# Placeholder for model results
+# --- Load Excel File ---
+file_path = "input_data/ClientFTPData.xlsx"
+try:
+    df = load_client_data(file_path)
+except Exception as e:
+    st.error(f"Failed to load data: {e}")
+    df = None
+
+# --- Transfer-pricing engine ---
+st.markdown("### 📈 Matched-Maturity Transfer Pricing")
+if df is not None:
+    curve_upload = st.file_uploader(
+        "Curve CSV (ISO_CURRENCY_CD, TENOR_MONTHS, RATE, optional LIQUIDITY_PREMIUM; rates in %)", type=["csv"]
+    )
+    try:
+        if curve_upload is not None:
+            curves = normalise_curves(pd.read_csv(curve_upload))
+            st.caption(f"Using the uploaded curves ({curves['ISO_CURRENCY_CD'].nunique()} currencies).")
+        elif os.path.exists(CURVE_CSV):
+            curves = load_curves(CURVE_CSV)
+            st.caption(f"Using {CURVE_CSV} ({curves['ISO_CURRENCY_CD'].nunique()} currencies).")
+        else:
+            curves = curves_from_book(df)
+            st.caption(
+                f"No curve file at {CURVE_CSV}: pricing against flat curves at each currency's median "
+                "TRANSFER_RATE, which only highlights outliers. Upload a curve for real pricing."
+            )
+    except Exception as e:
+        st.error(f"Failed to load curves: {e}")
+        curves = None
+
+    c1, c2 = st.columns(2)
+    method = c1.selectbox("Pricing term", PRICING_METHODS, index=0,
+                          help="auto: reprice term for adjustable/floating instruments, matched maturity otherwise")
+    tolerance = c2.number_input("Tolerance (bps)", min_value=0.0, value=TOLERANCE_BPS, step=5.0)
+
+    if curves is not None and not curves.empty:
+        t0 = time.perf_counter()
+        priced = price_book(df, curves, method)
+        elapsed = time.perf_counter() - t0
+        comparison = compare_to_file(df, priced, tolerance)
+
+        m1, m2, m3 = st.columns(3)
+        m1.metric("Instruments priced", f"{int(priced['MODEL_TRANSFER_RATE'].notna().sum()):,} / {len(df):,}")
+        m2.metric("Within tolerance", f"{int((priced['DIFF_BPS'].abs() <= tolerance).sum()):,}")
+        m3.metric("Pricing time", f"{elapsed * 1000:.0f} ms")
+
+        st.markdown("#### Model vs file TRANSFER_RATE by currency")
+        st.dataframe(comparison, use_container_width=True)
+
+        st.markdown("#### Largest differences")
+        key_cols = [c for c in ["ACCOUNT_NUMBER_MASKED", "ISO_CURRENCY_CD", "PRODUCT_CODE", "ADJUSTABLE_TYPE"] if c in df]
+        outliers = pd.concat([df[key_cols], priced], axis=1)
+        outliers = outliers.loc[priced["DIFF_BPS"].abs().sort_values(ascending=False).index].head(50)
+        st.dataframe(outliers, use_container_width=True)
+
+# --- Curve-shock scenarios ---
+st.markdown("### 🌪️ Curve-Shock Scenarios")
+if df is not None:
+    scenario_names = [s["name"] for s in SCENARIOS]
+    c1, c2 = st.columns(2)
+    chosen = c1.multiselect("Scenarios", scenario_names, default=scenario_names)
+    segment = c2.selectbox("Segment", [c for c in SEGMENT_COLUMNS if c in df])
+    c3, c4, c5 = st.columns(3)
+    custom_bps = c3.number_input("Custom parallel shift (bps)", value=0, step=25)
+    custom_ccys = c4.multiselect("Custom shift currencies (all if empty)", sorted(df["ISO_CURRENCY_CD"].dropna().astype(str).unique()))
+    scenario_workers = c5.number_input("Worker processes", min_value=1, max_value=os.cpu_count() or 1,
+                                       value=min(4, os.cpu_count() or 1), key="scenario_workers")
+    if st.button("Run scenarios"):
+        scenarios = [s for s in SCENARIOS if s["name"] in chosen]
+        if custom_bps:
+            custom = {"name": f"Custom {custom_bps:+d}bp" + (f" ({', '.join(custom_ccys)})" if custom_ccys else ""),
+                      "tenor_bps": {0: custom_bps}}
+            if custom_ccys:
+                custom["currencies"] = custom_ccys
+            scenarios.append(custom)
+        if scenarios:
+            t0 = time.perf_counter()
+            results = run_scenarios(df, scenarios, segment=segment, method=method, workers=int(scenario_workers))
+            st.session_state["scenarios"] = (segment, results, time.perf_counter() - t0)
+        else:
+            st.warning("Pick at least one scenario.")
+
+    ran = st.session_state.get("scenarios")
+    if ran:
+        ran_segment, results, elapsed = ran
+        st.caption(f"{results['Scenario'].nunique()} scenarios × {results['Segment'].nunique()} {ran_segment} values "
+                   f"in {elapsed:.2f} s · transfer rates shocked at the '{method}' pricing term")
+        totals = scenario_totals(results)
+        st.dataframe(totals, use_container_width=True)
+        st.bar_chart(totals.set_index("Scenario")["Change"])
+        st.markdown(f"#### Change in NET_TP_AMOUNT by scenario × {ran_segment}")
+        st.dataframe(results.pivot(index="Segment", columns="Scenario", values="Change")[totals["Scenario"]],
+                     use_container_width=True)
+        with st.expander("All scenario results"):
+            st.dataframe(results, use_container_width=True)
+
+# --- Rate model (ridge on categorical codes and term features) ---
 st.markdown("### 🔧 Model Output")
-st.info("Model integration coming soon.")
+if df is not None:
+    data_key = (file_path, os.path.getmtime(file_path))
+    c1, c2, c3 = st.columns(3)
+    target = c1.selectbox("Target rate", TARGETS)
+    holdout = c2.slider("Holdout share", 0.0, 0.5, 0.2, 0.05, help="Rows kept out of training to measure the error")
+    alpha = c3.number_input("Ridge penalty", min_value=0.0, value=RIDGE_ALPHA, step=0.5)
+
+    saved_path = model_path(target)
+    b1, b2 = st.columns(2)
+    train_new = b1.button("Train new model")
+    retrain = b2.button("Retrain saved model on this snapshot", disabled=not os.path.exists(saved_path),
+                        help="Adds this book to the saved model's normal equations; earlier snapshots are kept.")
+    if train_new or retrain:
+        try:
+            with st.spinner("Training..."):
+                base = RateModel.load(saved_path) if retrain else None
+                model, report = train_rate_model(df, target, model=base, data_key=data_key, holdout=holdout, alpha=alpha)
+                model.save(saved_path)
+            st.session_state["rate_model"] = (target, model, report)
+        except Exception as e:
+            st.error(f"Training failed: {e}")
+
+    trained = st.session_state.get("rate_model")
+    if trained is None or trained[0] != target:
+        st.info(f"No {target} model trained in this session yet.")
+    else:
+        _, model, report = trained
+        if report["already_trained"]:
+            st.info("The saved model already includes this book; it was not added again.")
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("Training rows", f"{report['train_rows']:,}", f"{report['snapshots']} snapshot(s)", delta_color="off")
+        m2.metric("Fit time", f"{report['fit_seconds'] * 1000:.0f} ms", f"{report['rows_per_second'] or 0:,} rows/s",
+                  delta_color="off")
+        quality = report["holdout"] or report["train"]
+        m3.metric("RMSE (holdout)" if report["holdout"] else "RMSE (train)", f"{quality['rmse']:.3f}")
+        m4.metric("R²", f"{quality['r2']:.3f}")
+        st.caption(f"{report['features']} features · feature build {report['feature_seconds'] * 1000:.0f} ms · saved to {saved_path}")
+
+        threshold = st.number_input("Flag residuals above (bps)", min_value=0.0, value=RESIDUAL_BPS, step=25.0)
+        anomalies = residual_anomalies(df, model, data_key=data_key, threshold_bps=threshold)
+        st.write(f"{len(anomalies)} instruments deviate from the model by more than {threshold:g} bps.")
+        if not anomalies.empty:
+            st.dataframe(expand_row_context(anomalies).head(200), use_container_width=True)
+            if st.button("➕ Add to the anomaly list on the Analysis page"):
+                st.session_state["model_anomalies"] = (data_key, (target, threshold, len(model.snapshots)), anomalies)
+                st.success("Added; they will appear with the policy violations.")
+
+# --- Batch scoring (streams a book through the saved model) ---
+st.markdown("### ⚡ Batch Scoring")
+books = sorted(
+    os.path.join("input_data", f) for f in os.listdir("input_data")
+    if f.lower().endswith((".xlsx", ".csv", ".parquet"))
+) if os.path.isdir("input_data") else []
+score_target = st.selectbox("Model", TARGETS, key="score_target")
+if not os.path.exists(model_path(score_target)):
+    st.info(f"Train and save a {score_target} model above to score books with it.")
+elif not books:
+    st.info("No books found in input_data.")
+else:
+    c1, c2, c3 = st.columns(3)
+    source = c1.selectbox("Book", books, index=books.index(file_path) if file_path in books else 0)
+    out_fmt = c2.selectbox("Output format", ["parquet", "csv"], help="Parquet is several times faster to write")
+    workers = c3.number_input("Worker processes", min_value=1, max_value=os.cpu_count() or 1, value=1)
+    if st.button("Score book"):
+        try:
+            with st.spinner("Scoring..."):
+                st.session_state["scoring"] = score_file(
+                    source, dest=scored_path(source, out_fmt), target=score_target,
+                    chunk_rows=SCORE_CHUNK_ROWS, workers=int(workers)
+                )
+        except Exception as e:
+            st.error(f"Scoring failed: {e}")
+
+    summary = st.session_state.get("scoring")
+    if summary and os.path.exists(summary["dest"]):
+        m1, m2, m3 = st.columns(3)
+        m1.metric("Rows scored", f"{summary['rows']:,}")
+        m2.metric("Time", f"{summary['seconds']:.2f} s")
+        m3.metric("Throughput", f"{summary['rows_per_second'] or 0:,} rows/s")
+        st.caption(f"Predictions and residuals written next to the source rows in {summary['dest']}")
+        if summary["dest"].endswith(".parquet"):
+            preview = pd.read_parquet(summary["dest"]).head(200)
+        else:
+            preview = pd.read_csv(summary["dest"], nrows=200)
+        st.dataframe(preview, use_container_width=True)
+        with open(summary["dest"], "rb") as f:
+            st.download_button("Download scored book", f.read(), file_name=os.path.basename(summary["dest"]))
@@ -0,0 +1,12 @@
+import os
+import sys
+
+# Tests run against the local stand-in model, from the repository root (paths in CONFIG blocks are relative)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("FAKE_LLM_LATENCY_S", "0")
+os.chdir(ROOT)
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+SAMPLE_BOOK = os.path.join("input_data", "ClientFTPData.xlsx")
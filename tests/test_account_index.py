@@ -0,0 +1,29 @@
+import json
+import numpy as np
+import pandas as pd
+from functions.account_index import account_keys, lookup_account
+
+
+def _book() -> pd.DataFrame:
+    return pd.DataFrame({
+        "ACCOUNT_NUMBER_MASKED": ["  abc123 ", "ABC123", np.nan, "", "0101XXXXX"],
+        "CUSTOMER_CODE_MASKED": ["c1", "c1", "c2", "c3", None],
+    })
+
+
+def test_picker_keys_are_stripped_and_leave_out_missing_values():
+    assert account_keys(_book()) == ["0101XXXXX", "ABC123"]
+    assert account_keys(_book(), "CUSTOMER_CODE_MASKED") == ["C1", "C2", "C3"]
+
+
+def test_padded_keys_match_in_the_book_and_the_violations():
+    book = _book()
+    violations = pd.DataFrame({
+        "description": ["TRANSFER_RATE must be present."] * 2,
+        "row_context": [json.dumps({"ACCOUNT_NUMBER_MASKED": " abc123"}), json.dumps({"ACCOUNT_NUMBER_MASKED": None})],
+    })
+    found = lookup_account("abc123  ", book, violations)
+    assert found["key"] == "ABC123"
+    assert found["book"].index.tolist() == [0, 1]
+    assert len(found["violations"]) == 1
+    assert lookup_account("nan", book, violations)["book"].empty
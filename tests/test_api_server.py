@@ -0,0 +1,127 @@
+import http.client
+import json
+import threading
+import pytest
+import api_server
+from conftest import SAMPLE_BOOK
+from functions import langchain_llm
+from functions.fake_llm import FakeChatModel, FakeLLMError
+
+
+class FailingMidStream(FakeChatModel):
+    """Streams one word, then fails."""
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        chunks = super()._stream(messages, stop, run_manager, **kwargs)
+        yield next(chunks)
+        raise FakeLLMError("Connection dropped", status=400)
+
+
+class RejectingModel(FakeChatModel):
+    """Fails every call with a non-retryable status."""
+
+    def _maybe_fail(self):
+        raise FakeLLMError("Bad request", status=400)
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    upload_dir = str(tmp_path_factory.mktemp("api_uploads"))
+    patch = pytest.MonkeyPatch()
+    patch.setattr(api_server, "UPLOAD_DIR", upload_dir)
+    patch.setattr(api_server, "DATA_ROOTS", ("input_data", upload_dir))
+    srv = api_server.make_server("127.0.0.1", 0, workers=1)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+    srv.RequestHandlerClass.state.pool.shutdown(cancel_futures=True)
+    patch.undo()
+
+
+def _request(server, method, path, body=None, headers=None):
+    conn = http.client.HTTPConnection(*server.server_address, timeout=120)
+    if isinstance(body, dict):
+        body, headers = json.dumps(body), {"Content-Type": "application/json", **(headers or {})}
+    conn.request(method, path, body=body, headers=headers or {})
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    return response.status, response.getheader("Content-Type"), data
+
+
+@pytest.fixture(scope="module")
+def dataset(server):
+    with open(SAMPLE_BOOK, "rb") as f:
+        status, _, data = _request(server, "POST", "/datasets?name=book.xlsx", f.read())
+    assert status == 201
+    return json.loads(data)
+
+
+def test_detect_on_an_upload(server, dataset):
+    assert dataset["name"] == "book.xlsx"
+    status, _, data = _request(server, "POST", f"/datasets/{dataset['id']}/detect?wait=1")
+    result = json.loads(data)
+    assert status == 200 and result["status"] == "done"
+    assert result["violations"] > 0
+    assert sum(p["Count"] for p in result["per_policy"]) == result["violations"]
+    status, _, data = _request(server, "GET", f"/datasets/{dataset['id']}/detect")
+    assert json.loads(data)["status"] == "done"
+
+
+def test_violations_are_paged(server, dataset):
+    status, content_type, data = _request(server, "GET", f"/datasets/{dataset['id']}/violations?offset=10&limit=5")
+    assert status == 200 and content_type == "application/x-ndjson"
+    rows = [json.loads(line) for line in data.decode("utf-8").splitlines()]
+    assert [r["row"] for r in rows] == [10, 11, 12, 13, 14]
+    assert all(isinstance(r["row_context"], dict) for r in rows)
+
+
+@pytest.mark.parametrize("query", ["limit=0", "limit=abc", "offset=-1"])
+def test_violations_reject_bad_paging(server, dataset, query):
+    status, _, data = _request(server, "GET", f"/datasets/{dataset['id']}/violations?{query}")
+    assert status == 400 and "error" in json.loads(data)
+
+
+@pytest.mark.parametrize("field, value", [
+    ("max_violations", 0), ("max_violations", True), ("token_budget", "100"), ("chunk_by", 5),
+])
+def test_ask_rejects_bad_limits(server, dataset, field, value):
+    status, _, data = _request(server, "POST", f"/datasets/{dataset['id']}/ask",
+                               {"question": "Which policies fail most?", field: value})
+    assert status == 400 and field in json.loads(data)["error"]
+
+
+def test_ask_answers_with_the_stub_model(server, dataset):
+    status, _, data = _request(server, "POST", f"/datasets/{dataset['id']}/ask",
+                               {"question": "Summarise the TRANSFER_RATE breaks for the API test."})
+    assert status == 200 and json.loads(data)["answer"].startswith("Fake answer")
+
+
+def test_ask_stream_that_fails_before_output_ends_with_an_error_record(server, dataset, monkeypatch):
+    def failing_stream(*args, **kwargs):
+        raise RuntimeError("prompt could not be built")
+        yield
+
+    monkeypatch.setattr(langchain_llm, "_stream_answer", failing_stream)
+    status, content_type, data = _request(server, "POST", f"/datasets/{dataset['id']}/ask",
+                                          {"question": "Stream a failing answer.", "stream": True})
+    assert status == 200 and content_type.startswith("text/plain")
+    assert json.loads(data) == {"error": "RuntimeError: prompt could not be built"}
+
+
+def test_ask_stream_that_fails_midway_ends_with_an_error_record(server, dataset, monkeypatch):
+    monkeypatch.setattr(langchain_llm.chain, "llm", FailingMidStream(latency_s=0, token_latency_s=0))
+    status, _, data = _request(server, "POST", f"/datasets/{dataset['id']}/ask",
+                               {"question": "Stream an answer that breaks off.", "stream": True})
+    text, _, last = data.decode("utf-8").rpartition("\n{")
+    assert status == 200 and text == "Fake"
+    assert json.loads("{" + last) == {"error": "FakeLLMError: Connection dropped"}
+
+
+def test_ask_stream_falls_back_when_the_model_fails_before_output(server, dataset, monkeypatch):
+    monkeypatch.setattr(langchain_llm.chain, "llm", RejectingModel(latency_s=0))
+    status, _, data = _request(server, "POST", f"/datasets/{dataset['id']}/ask",
+                               {"question": "Stream an answer from a rejecting model.", "stream": True})
+    assert status == 200 and data.decode("utf-8").startswith("LLM unavailable")
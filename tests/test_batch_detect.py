@@ -0,0 +1,62 @@
+import json
+import os
+import shutil
+import batch_detect
+from conftest import SAMPLE_BOOK
+from functions.data_loader import file_fingerprint
+from functions.ftp_rules import load_rules, rules_version
+from functions.result_store import list_runs, source_key
+
+OLD_BOOK = os.path.join("input_data", "ClientFTPData_Old.xlsx")
+
+
+def _copy_book(tmp_path, name="book.xlsx", source=SAMPLE_BOOK):
+    path = tmp_path / name
+    shutil.copy(source, path)
+    return str(path)
+
+
+def test_store_run_is_not_skipped_when_outputs_are_current(tmp_path):
+    book, out, store = _copy_book(tmp_path), str(tmp_path / "out"), str(tmp_path / "results.db")
+    assert batch_detect.run_batch([book], out, workers=1)[0]["status"] == "processed"
+    assert batch_detect.run_batch([book], out, workers=1)[0]["status"] == "skipped"
+
+    assert batch_detect.run_batch([book], out, workers=1, store=store)[0]["status"] == "processed"
+    runs = list_runs(store)
+    assert runs["source"].tolist() == [source_key(book)]
+    assert batch_detect.run_batch([book], out, workers=1, store=store)[0]["status"] == "skipped"
+
+
+def test_manifest_fingerprints_the_workbook_that_was_loaded(tmp_path, monkeypatch):
+    book = _copy_book(tmp_path)
+    loaded_sha = file_fingerprint(book)
+    load = batch_detect.load_client_data
+
+    def load_then_replace(path):
+        df = load(path)
+        shutil.copy(OLD_BOOK, path)     # the workbook is replaced while detection runs
+        return df
+
+    monkeypatch.setattr(batch_detect, "load_client_data", load_then_replace)
+    rules, out = load_rules(), str(tmp_path)
+    manifest = batch_detect.process_file(book, out, "csv", rules, summaries=False)
+    assert manifest["input_sha256"] == loaded_sha
+    evaluated_on = batch_detect.evaluation_date(rules)
+    assert not batch_detect.is_current(book, out, "csv", rules_version(rules), False, evaluated_on)
+    shutil.copy(SAMPLE_BOOK, book)
+    assert batch_detect.is_current(book, out, "csv", rules_version(rules), False, evaluated_on)
+
+
+def test_skip_key_includes_evaluation_date_and_input_folder(tmp_path):
+    rules, out = load_rules(), str(tmp_path)
+    first = _copy_book(tmp_path)
+    os.makedirs(tmp_path / "other")
+    second = _copy_book(tmp_path, os.path.join("other", "book.xlsx"), OLD_BOOK)
+    assert batch_detect.output_paths(first, out, "csv") != batch_detect.output_paths(second, out, "csv")
+
+    batch_detect.process_file(first, out, "csv", rules, summaries=False)
+    with open(batch_detect.output_paths(first, out, "csv")["manifest"], encoding="utf-8") as f:
+        evaluated_on = json.load(f)["evaluated_on"]
+    assert batch_detect.is_current(first, out, "csv", rules_version(rules), False, evaluated_on)
+    assert not batch_detect.is_current(first, out, "csv", rules_version(rules), False, "2099-01-01")
+    assert not batch_detect.is_current(second, out, "csv", rules_version(rules), False, evaluated_on)
@@ -0,0 +1,103 @@
+import time
+import pytest
+from functions import langchain_llm     # configures resilience at import, so before the fixture below
+from functions import llm_resilience as res
+from functions.fake_llm import FakeChatModel, FakeLLMError
+
+
+class RejectingModel(FakeChatModel):
+    """Fails every call with a non-retryable status."""
+
+    def _maybe_fail(self):
+        raise FakeLLMError("Bad request", status=400)
+
+
+@pytest.fixture(autouse=True)
+def fast_policy():
+    """Short deadlines and no backoff; the module defaults (and a fresh breaker) are restored afterwards."""
+    saved = dict(timeout_s=res.TIMEOUT_S, max_retries=res.MAX_RETRIES, backoff_base_s=res.BACKOFF_BASE_S,
+                 backoff_max_s=res.BACKOFF_MAX_S, breaker_failures=res._BREAKER.failure_threshold,
+                 breaker_recovery_s=res._BREAKER.recovery_s)
+    res.configure_resilience(timeout_s=5, max_retries=2, backoff_base_s=0, backoff_max_s=0,
+                             breaker_failures=3, breaker_recovery_s=0.2)
+    yield
+    res.configure_resilience(**saved)
+
+
+def healthy():
+    return FakeChatModel(latency_s=0, token_latency_s=0)
+
+
+def failing():
+    return FakeChatModel(latency_s=0, token_latency_s=0, failure_rate=1.0)
+
+
+def test_retryable_errors_are_retried_max_retries_times():
+    retries = []
+    with pytest.raises(FakeLLMError):
+        res.resilient_invoke(failing(), "hi", on_retry=retries.append)
+    assert len(retries) == 2
+    assert all(isinstance(e, FakeLLMError) and e.status == 503 for e in retries)
+
+
+def test_non_retryable_errors_fail_on_the_first_attempt():
+    retries = []
+    with pytest.raises(FakeLLMError):
+        res.resilient_invoke(RejectingModel(latency_s=0), "hi", on_retry=retries.append)
+    assert retries == []
+
+
+def test_stream_retries_until_the_first_chunk():
+    retries = []
+    with pytest.raises(FakeLLMError):
+        list(res.resilient_stream(failing(), "hi", on_retry=retries.append))
+    assert len(retries) == 2
+    assert "".join(c.content for c in res.resilient_stream(healthy(), "hi")).startswith("Fake answer")
+
+
+def test_breaker_opens_after_consecutive_failures_and_short_circuits():
+    for _ in range(3):
+        with pytest.raises(FakeLLMError):
+            res.resilient_invoke(failing(), "hi")
+    assert res.circuit_state() == "open"
+    retries = []
+    with pytest.raises(res.CircuitOpenError):
+        res.resilient_invoke(healthy(), "hi", on_retry=retries.append)
+    assert retries == []
+
+
+def test_half_open_trial_closes_on_success_and_reopens_on_failure():
+    for _ in range(3):
+        with pytest.raises(FakeLLMError):
+            res.resilient_invoke(failing(), "hi")
+    time.sleep(0.25)
+    assert res.circuit_state() == "half-open"
+    with pytest.raises(FakeLLMError):
+        res.resilient_invoke(failing(), "hi")       # failed trial: open again for another recovery period
+    assert res.circuit_state() == "open"
+    time.sleep(0.25)
+    assert res.resilient_invoke(healthy(), "hi").content.startswith("Fake answer")
+    assert res.circuit_state() == "closed"
+
+
+def test_half_open_allows_one_trial_at_a_time():
+    now = [0.0]
+    breaker = res.CircuitBreaker(failure_threshold=1, recovery_s=10, clock=lambda: now[0])
+    breaker.record_failure()
+    assert not breaker.allow()
+    now[0] = 10.0
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_open_breaker_falls_back_without_calling_the_model():
+    for _ in range(3):
+        with pytest.raises(FakeLLMError):
+            res.resilient_invoke(failing(), "hi")
+    inputs = {name: f"breaker-open {name} {time.time_ns()}" for name in langchain_llm.chain.prompt.input_variables}
+    assert langchain_llm._run_chain(langchain_llm.chain, inputs, "answer", "FALLBACK") == "FALLBACK"
+    assert list(langchain_llm._stream_answer(inputs, fallback="FALLBACK")) == ["FALLBACK"]
+    with pytest.raises(res.CircuitOpenError):
+        langchain_llm._run_chain(langchain_llm.chain, inputs, "answer")
@@ -0,0 +1,42 @@
+import json
+import pandas as pd
+from conftest import SAMPLE_BOOK
+from functions.data_loader import load_client_data
+from functions.ftp_rules import load_rules
+from functions.policy_registry import POLICY_JSON
+from functions.reconciliation import check_net_tp_amount, day_count_basis
+
+
+def _shipped_rule(check: str) -> dict:
+    with open(POLICY_JSON, "r", encoding="utf-8") as f:
+        return next(r for r in json.load(f) if r.get("check") == check)
+
+
+def test_day_count_basis_prefers_entity_currency_then_entity_then_currency():
+    df = pd.DataFrame({
+        "LEGAL_ENTITY_CODE": ["MB_CDAE", "MB_CDAE", "INVICTUS", "INVICTUS", " mb_cdae ", None],
+        "ISO_CURRENCY_CD":   ["USD",     "KWD",     "USD",      "GBP",      "kwd",       "GBP"],
+    })
+    basis = {"default": 360, "GBP": 365, "INVICTUS": 365, "MB_CDAE/KWD": 365, "INVICTUS/GBP": 366}
+    assert day_count_basis(df, basis).tolist() == [360, 365, 365, 366, 365, 365]
+
+
+def test_net_tp_amount_has_no_day_count_breaks_on_invictus():
+    # INVICTUS books ACT/365 in every currency; keyed by currency alone its rows broke at 360/365 of expected
+    df = load_client_data(SAMPLE_BOOK)
+    _expected, _actual, breaks = check_net_tp_amount(df, _shipped_rule("net_tp_amount"))
+    assert not breaks[(df["LEGAL_ENTITY_CODE"] == "INVICTUS").to_numpy()].any()
+
+
+def test_disabled_rules_are_not_loaded(tmp_path):
+    path = tmp_path / "policies.json"
+    path.write_text(json.dumps([
+        {"column": "TRANSFER_RATE", "condition": "pd.isna(x)", "description": "on"},
+        {"column": "NET_TP_RATE", "condition": "pd.isna(x)", "description": "off", "enabled": False},
+    ]))
+    assert [r["description"] for r in load_rules(str(path))] == ["on"]
+
+
+def test_net_tp_amount_ships_disabled():
+    assert _shipped_rule("net_tp_amount")["enabled"] is False
+    assert "net_tp_amount" not in {r.get("check") for r in load_rules()}
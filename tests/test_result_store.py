@@ -0,0 +1,48 @@
+import json
+import os
+from contextlib import closing
+import pandas as pd
+from functions.result_store import account_history, connect, policy_trend, record_run, source_key
+
+POLICY = "TRANSFER_RATE must be present (not null/NaN or blank)."
+
+
+def _book(as_of: str, accounts) -> pd.DataFrame:
+    return pd.DataFrame({"AS_OF_DATE": as_of, "ACCOUNT_NUMBER_MASKED": list(accounts)})
+
+
+def _violations(accounts) -> pd.DataFrame:
+    return pd.DataFrame({
+        "description": POLICY,
+        "row_context": [json.dumps({"ACCOUNT_NUMBER_MASKED": a, "ISO_CURRENCY_CD": "USD"}) for a in accounts],
+    })
+
+
+def _record(store, source, as_of, accounts, sha, rules="r1"):
+    record_run(str(store), _violations(accounts), _book(as_of, ["X1", *accounts]), sha, rules, source=source)
+
+
+def test_account_is_not_resolved_by_a_later_run_of_another_book(tmp_path):
+    store = tmp_path / "results.db"
+    _record(store, "unitA", "2025-06-30", ["A9"], "a-jun")
+    _record(store, "unitB", "2025-06-30", ["B1"], "b-jun")
+    _record(store, "unitB", "2025-07-31", [], "b-jul")
+
+    history = account_history(str(store)).set_index("account")
+    assert history.loc["A9", "resolved_on"] is None
+    assert history.loc["B1", "resolved_on"] == "2025-07-31"
+
+    _record(store, "unitA", "2025-08-31", [], "a-aug")
+    assert account_history(str(store), account="A9")["resolved_on"].tolist() == ["2025-08-31"]
+
+
+def test_one_book_recorded_by_batch_and_api_counts_once(tmp_path):
+    store = tmp_path / "results.db"
+    relative = os.path.join("input_data", "ClientFTPData.xlsx")
+    # The batch job and the API spell the same file differently; both go through source_key
+    _record(store, source_key(os.path.abspath(relative)), "2025-06-30", ["A1"], "sha", rules="r1")
+    _record(store, source_key(relative), "2025-06-30", ["A1"], "sha", rules="r2")
+
+    assert policy_trend(str(store))["Count"].tolist() == [1]
+    with closing(connect(str(store))) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM latest_runs").fetchone()[0] == 1
@@ -0,0 +1,43 @@
+import pandas as pd
+import pytest
+from functions.safe_query import run_query_spec, validate_query_spec
+
+FRAMES = {"book": pd.DataFrame({
+    "PRODUCT_NAME": ["a", "c", 101, None],
+    "BALANCE": [1.0, 2.0, 3.0, 4.0],
+    "MATURITY_DATE": ["2025-07-01", "1900-01-01", "2030-06-30", None],
+})}
+
+
+def _run(spec: dict) -> pd.DataFrame:
+    spec = {"frame": "book", **spec}
+    return run_query_spec(validate_query_spec(spec, FRAMES), FRAMES)
+
+
+@pytest.mark.parametrize("func", ["sum", "mean"])
+def test_sum_and_mean_need_a_numeric_column(func):
+    with pytest.raises(ValueError, match="not numeric"):
+        _run({"aggregations": [{"column": "PRODUCT_NAME", "func": func}]})
+    with pytest.raises(ValueError, match="not numeric"):
+        _run({"aggregations": [{"column": "MATURITY_DATE", "func": func}]})
+
+
+def test_min_max_of_mixed_text_and_dates_do_not_raise():
+    result = _run({"aggregations": [
+        {"column": "PRODUCT_NAME", "func": "max", "as": "last_name"},
+        {"column": "MATURITY_DATE", "func": "min", "as": "first_maturity"},
+        {"column": "BALANCE", "func": "sum", "as": "total"},
+    ]})
+    assert result.loc[0, "last_name"] == "c"
+    assert result.loc[0, "first_maturity"] == pd.Timestamp("1900-01-01")
+    assert result.loc[0, "total"] == 10.0
+
+
+@pytest.mark.parametrize("aggregations, group_by", [
+    ([{"column": "BALANCE", "func": "sum", "as": "x"}, {"column": "BALANCE", "func": "mean", "as": "x"}], []),
+    ([{"column": "BALANCE", "func": "sum"}, {"column": "BALANCE", "func": "sum"}], []),
+    ([{"column": "BALANCE", "func": "sum", "as": "PRODUCT_NAME"}], ["PRODUCT_NAME"]),
+])
+def test_duplicate_or_clashing_aggregation_names_are_rejected(aggregations, group_by):
+    with pytest.raises(ValueError, match="used twice or clashes"):
+        _run({"aggregations": aggregations, "group_by": group_by})